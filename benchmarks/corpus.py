@@ -0,0 +1,267 @@
+"""
+Synthetic post pages and processed posts generated from the example posts
+"""
+import os
+import copy
+import json
+import random
+import shutil
+from collections import Counter
+from itertools import accumulate
+from typing import Dict, List
+
+from lxml import etree, html
+from tqdm.auto import tqdm
+
+from task_1.post_store import PostStore
+from utils.normalizer import clean_text
+
+CONTENT_XPATH = '//div[@id="post-content-body"]'
+# Generation parameters kept next to the corpus files
+CORPUS_PARAMETERS = 'corpus.json'
+
+
+def load_examples(path: str = 'examples/unprocessed_posts') -> List[str]:
+    """
+    Read example post pages.
+
+    Args:
+        path: Directory where example html files are stored.
+
+    Returns:
+        Html of the example pages sorted by file name.
+    """
+    examples = []
+    for file_name in sorted(os.listdir(path)):
+        if not file_name.endswith('.html'):
+            continue
+        with open(f'{path}/{file_name}', encoding='utf-8') as file_:
+            examples.append(file_.read())
+    return examples
+
+
+def scale_page(html_text: str, scale: int) -> str:
+    """
+    Make the post content `scale` times longer by repeating it.
+
+    Args:
+        html_text: Post page.
+        scale: How many times the content is repeated.
+
+    Returns:
+        Post page with the same fields and the longer content.
+    """
+    if scale <= 1:
+        return html_text
+    root = html.fromstring(html_text)
+    for content in root.xpath(CONTENT_XPATH):
+        children = list(content)
+        for _ in range(scale - 1):
+            for child in children:
+                content.append(copy.deepcopy(child))
+    return etree.tostring(
+        root,
+        encoding='unicode',
+        method='html',
+        doctype='<!DOCTYPE html>',
+    )
+
+
+class PageGenerator():
+    """
+    Deterministic pages of generated posts.
+
+    The page of a post is an example page with the content repeated from 1
+    to `max_scale` times, both chosen by the post ID. Variants are built once
+    and shared by posts.
+
+    Attributes:
+        examples: Example post pages.
+        max_scale: The maximum number of content repeats.
+        seed: Seed of the page choice.
+    """
+
+    def __init__(self,
+                 examples: List[str],
+                 max_scale: int = 4,
+                 seed: int = 0) -> None:
+        """
+        Init PageGenerator
+        """
+        self.examples = examples
+        self.max_scale = max(1, max_scale)
+        self.seed = seed
+        self._variants: Dict = {}
+
+    def page(self, post_id: int) -> str:
+        """
+        Return the page of the post.
+
+        Args:
+            post_id: ID of the post.
+        """
+        rng = random.Random(self.seed * 1_000_003 + post_id)
+        variant = (rng.randrange(len(self.examples)),
+                   rng.randint(1, self.max_scale))
+        if variant not in self._variants:
+            example, scale = variant
+            self._variants[variant] = scale_page(self.examples[example],
+                                                 scale)
+        return self._variants[variant]
+
+
+def write_corpus(path: str,
+                 size: int,
+                 max_scale: int = 4,
+                 seed: int = 0,
+                 examples_path: str = 'examples/unprocessed_posts') -> None:
+    """
+    Write generated post pages as `{post_id}.html` files, post IDs are from
+    1 to `size`.
+
+    The corpus is kept if it was generated with the same parameters.
+
+    Args:
+        path: Directory of the corpus.
+        size: The number of posts.
+        max_scale: The maximum number of content repeats.
+        seed: Seed of the page choice.
+        examples_path: Directory where example html files are stored.
+    """
+    parameters = {'size': size, 'max_scale': max_scale, 'seed': seed}
+    parameters_path = f'{path}/{CORPUS_PARAMETERS}'
+    if os.path.exists(parameters_path):
+        with open(parameters_path, encoding='utf-8') as file_:
+            if json.load(file_) == parameters:
+                return
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
+
+    pages = PageGenerator(load_examples(examples_path), max_scale, seed)
+    for post_id in tqdm(range(1, size + 1), desc='Generating corpus'):
+        with open(f'{path}/{post_id}.html', 'w', encoding='utf-8') as file_:
+            file_.write(pages.page(post_id))
+    with open(parameters_path, 'w', encoding='utf-8') as file_:
+        json.dump(parameters, file_)
+
+
+def load_words(path: str = 'examples/processed_posts') -> List[str]:
+    """
+    Read words of the example processed posts.
+
+    Args:
+        path: Directory where example json files are stored.
+
+    Returns:
+        Distinct lowercase words, the most frequent first.
+    """
+    counts = Counter()
+    for file_name in sorted(os.listdir(path)):
+        if not file_name.endswith('.json'):
+            continue
+        with open(f'{path}/{file_name}', encoding='utf-8') as file_:
+            post = json.load(file_)
+        counts.update(clean_text(post['content'].lower()).split())
+    return [word for word, _ in counts.most_common()]
+
+
+class PostGenerator():
+    """
+    Deterministic processed posts with Zipf distributed words.
+
+    The vocabulary is the words of the example posts followed by made up
+    words glued from two of them, the word of rank `r` is drawn with
+    probability proportional to `1 / r`. Content length is log-normal.
+
+    Attributes:
+        vocabulary: Words ordered by rank.
+        seed: Seed of the generated posts.
+    """
+
+    def __init__(self,
+                 words: List[str],
+                 vocabulary_size: int = 200000,
+                 seed: int = 0) -> None:
+        """
+        Init PostGenerator
+        """
+        self.seed = seed
+        rng = random.Random(seed)
+        vocabulary = list(words[:vocabulary_size])
+        known = set(vocabulary)
+        while len(vocabulary) < vocabulary_size:
+            word = rng.choice(words) + rng.choice(words)
+            if word not in known:
+                known.add(word)
+                vocabulary.append(word)
+        self.vocabulary = vocabulary
+        cum_weights = list(
+            accumulate(1 / rank for rank in range(1, vocabulary_size + 1)))
+        # Words and cumulative weights of content, tags and habs
+        self._choices = {
+            limit: (vocabulary[:limit], cum_weights[:limit])
+            for limit in (vocabulary_size, 2000, 300)
+        }
+
+    def _words(self, rng: random.Random, count: int,
+               limit: int) -> List[str]:
+        vocabulary, cum_weights = self._choices[limit]
+        return rng.choices(vocabulary, cum_weights=cum_weights, k=count)
+
+    def post(self, post_id: int) -> Dict:
+        """
+        Return the processed post.
+
+        Args:
+            post_id: ID of the post.
+        """
+        rng = random.Random(self.seed * 1_000_003 + post_id)
+        length = min(20000, max(50, int(rng.lognormvariate(6.3, 0.8))))
+        size = len(self.vocabulary)
+        return {
+            'id': str(post_id),
+            'title': ' '.join(self._words(rng, rng.randint(3, 10), size)),
+            'datetime': '2022-01-01T00:00:00.000Z',
+            'content': ' '.join(self._words(rng, length, size)),
+            'tags': self._words(rng, rng.randint(1, 6), 2000),
+            'habs': self._words(rng, rng.randint(1, 3), 300),
+        }
+
+
+def write_posts(path: str,
+                size: int,
+                vocabulary_size: int = 200000,
+                seed: int = 0,
+                examples_path: str = 'examples/processed_posts') -> None:
+    """
+    Write generated processed posts to a post store, post IDs are from 1 to
+    `size`.
+
+    The store is kept if it was generated with the same parameters.
+
+    Args:
+        path: Directory of the post store.
+        size: The number of posts.
+        vocabulary_size: The number of distinct words.
+        seed: Seed of the generated posts.
+        examples_path: Directory where example json files are stored.
+    """
+    parameters = {
+        'size': size,
+        'vocabulary_size': vocabulary_size,
+        'seed': seed,
+    }
+    parameters_path = f'{path}/{CORPUS_PARAMETERS}'
+    if os.path.exists(parameters_path):
+        with open(parameters_path, encoding='utf-8') as file_:
+            if json.load(file_) == parameters:
+                return
+        shutil.rmtree(path)
+    os.makedirs(path, exist_ok=True)
+
+    posts = PostGenerator(load_words(examples_path), vocabulary_size, seed)
+    with PostStore(path) as store:
+        for post_id in tqdm(range(1, size + 1), desc='Generating posts'):
+            store.append(posts.post(post_id))
+    with open(parameters_path, 'w', encoding='utf-8') as file_:
+        json.dump(parameters, file_)
@@ -0,0 +1,501 @@
+"""
+Crawler load benchmark against the local mock of https://habr.com
+"""
+import os
+import time
+import argparse
+import tempfile
+from threading import Event, Thread
+from typing import Dict, List, Sequence
+
+from benchmarks.mock_habr import MockHabrServer
+from benchmarks.results import append_results
+from task_1 import crawler
+from task_1.manifest import CrawlManifest
+
+_CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    """
+    Return the percentile of the values, 0 if there are no values.
+
+    Args:
+        values: Measured values.
+        percent: Percentile from 0 to 100.
+    """
+    if len(values) == 0:
+        return 0.0
+    values = sorted(values)
+    index = int(round((len(values) - 1) * percent / 100))
+    return values[index]
+
+
+def _read_process(pid: int) -> Dict:
+    """
+    Read parent ID, CPU time, resident memory and its anonymous part (not
+    mapped from files) of the process from /proc.
+    """
+    with open(f'/proc/{pid}/stat', encoding='utf-8') as file_:
+        # Process name in parentheses may contain spaces
+        fields = file_.read().rsplit(')', 1)[1].split()
+    rss = 0
+    anon = 0
+    with open(f'/proc/{pid}/status', encoding='utf-8') as file_:
+        for line in file_:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+            elif line.startswith('RssAnon:'):
+                anon = int(line.split()[1]) * 1024
+                break
+    return {
+        'ppid': int(fields[1]),
+        'cpu_time': (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS,
+        'rss': rss,
+        'anon': anon,
+    }
+
+
+class ProcessMonitor(Thread):
+    """
+    Sample CPU time and peak resident memory of the child processes.
+
+    Only Linux is supported, nothing is sampled without /proc.
+
+    Attributes:
+        interval: Time between samples in seconds.
+        excluded: IDs of the processes that are not reported.
+        processes: Last CPU time and peak memory of every sampled process.
+    """
+
+    def __init__(self, interval: float = 0.5, excluded: List[int] = None):
+        """
+        Init ProcessMonitor
+        """
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.excluded = set(excluded or [])
+        self.processes = {}
+        self._stop_event = Event()
+
+    def _descendants(self) -> Dict[int, Dict]:
+        processes = {}
+        for name in os.listdir('/proc'):
+            if not name.isdigit():
+                continue
+            try:
+                processes[int(name)] = _read_process(int(name))
+            except (OSError, IndexError, ValueError):
+                continue  # Process exited while it was read
+
+        descendants = {}
+        parents = {os.getpid()}
+        while True:
+            children = {
+                pid: info
+                for pid, info in processes.items()
+                if info['ppid'] in parents and pid not in descendants
+            }
+            if len(children) == 0:
+                return descendants
+            descendants.update(children)
+            parents = set(children)
+
+    def sample(self) -> None:
+        """
+        Update CPU time and peak memory of running child processes.
+        """
+        for pid, info in self._descendants().items():
+            if pid in self.excluded:
+                continue
+            process = self.processes.setdefault(pid, {
+                'peak_rss': 0,
+                'peak_anon': 0
+            })
+            process['cpu_time'] = info['cpu_time']
+            process['peak_rss'] = max(process['peak_rss'], info['rss'])
+            process['peak_anon'] = max(process['peak_anon'], info['anon'])
+
+    def run(self) -> None:
+        if not os.path.exists('/proc'):
+            return
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self) -> None:
+        """
+        Take the last sample and stop sampling.
+        """
+        self._stop_event.set()
+        self.join()
+        if os.path.exists('/proc'):
+            self.sample()
+
+
+def _crawl(temp_path: str, server: MockHabrServer, **options) -> None:
+    # Log files of the crawl are written to the temporary directory instead
+    # of the working tree
+    cwd = os.getcwd()
+    os.chdir(temp_path)
+    try:
+        crawler.crawl(**options,
+                      proxies=server.proxy_addresses,
+                      post_url=server.post_url)
+    finally:
+        os.chdir(cwd)
+
+
+def run_benchmark(posts: int = 10000,
+                  processes: int = 1,
+                  engine: str = 'async',
+                  concurrency: int = 100,
+                  chunk_size: int = 500,
+                  adaptive: bool = False,
+                  rate: float = 10.0,
+                  max_attempts: int = 3,
+                  timeout: float = 30.0,
+                  hedge_percentile: float = None,
+                  archive: bool = False,
+                  save_html: bool = False,
+                  proxies: int = 4,
+                  shared_proxies: bool = True,
+                  max_scale: int = 4,
+                  metrics_path: str = None,
+                  explore: bool = False,
+                  min_density: float = 0.0,
+                  history: bool = False,
+                  **server_options) -> Dict:
+    """
+    Crawl generated posts from the mock server and measure throughput.
+
+    Args:
+        posts: The number of post IDs to be crawled.
+        processes: The number of crawler processes.
+        engine: Crawler engine, see `task_1.crawler.crawl`.
+        concurrency: The maximum number of requests in flight per process.
+        chunk_size: The number of post IDs in a chunk of crawling work.
+        adaptive: If True adapt crawling speed to the responses.
+        rate: Initial request rate of the adaptive crawling.
+        max_attempts: The maximum number of attempts to download a post.
+        timeout: Request timeout in seconds.
+        hedge_percentile: Latency percentile of hedged requests.
+        archive: If True save downloaded pages to an html archive.
+        save_html: If True save downloaded pages, as html files unless
+        `archive` is True.
+        proxies: The number of mock proxies.
+        shared_proxies: If True crawler processes share one proxy pool.
+        max_scale: The maximum number of content repeats of generated pages.
+        metrics_path: File where crawler metrics are written, see
+        `task_1.crawler.crawl`.
+        explore: If True probe the ID range first and crawl the densest
+        blocks first, see `task_1.crawler.crawl`.
+        min_density: Blocks with a lower estimated share of available
+        posts are skipped.
+        history: If True the ID range is crawled twice and the second
+        crawl is measured, so exploring starts from known outcomes.
+        server_options: Arguments of `benchmarks.mock_habr.MockHabr`.
+
+    Returns:
+        Benchmark results.
+    """
+    if metrics_path is not None:
+        metrics_path = os.path.abspath(metrics_path)
+    with tempfile.TemporaryDirectory() as temp_path:
+        options = dict(
+            first_id=1,
+            last_id=posts + 1,
+            max_workers=processes,
+            path=f'{temp_path}/html' if save_html else None,
+            engine=engine,
+            concurrency=concurrency,
+            manifest_path=f'{temp_path}/manifest',
+            chunk_size=chunk_size,
+            archive=archive,
+            adaptive=adaptive,
+            rate=rate,
+            max_attempts=max_attempts,
+            timeout=timeout,
+            hedge_percentile=hedge_percentile,
+            shared_proxies=shared_proxies,
+            explore=explore,
+            min_density=min_density,
+        )
+        if history:
+            with MockHabrServer(max_scale=max_scale, proxies=proxies,
+                                **server_options) as server:
+                _crawl(temp_path, server, **options)
+
+        with MockHabrServer(max_scale=max_scale, proxies=proxies,
+                            **server_options) as server:
+            monitor = ProcessMonitor(excluded=[server.pid])
+            monitor.start()
+            start_time = time.monotonic()
+            _crawl(temp_path, server, **options, metrics_path=metrics_path)
+            elapsed = time.monotonic() - start_time
+            monitor.stop()
+            server_stats = server.stop()
+
+        statuses = CrawlManifest.load(f'{temp_path}/manifest')
+        outcomes = {}
+        for status in statuses.values():
+            outcomes[status.name] = outcomes.get(status.name, 0) + 1
+
+    latencies = server_stats['latencies']
+    return {
+        'posts': posts,
+        'processes': processes,
+        'engine': engine,
+        'concurrency': concurrency,
+        'adaptive': adaptive,
+        'shared_proxies': shared_proxies,
+        'explore': explore,
+        'min_density': min_density,
+        'history': history,
+        'server_options': server_options,
+        'elapsed': elapsed,
+        'posts_per_sec': posts / elapsed,
+        'saved_per_sec': outcomes.get('SAVED', 0) / elapsed,
+        'requests': len(latencies),
+        'requests_per_sec': len(latencies) / elapsed,
+        'latency_p50': percentile(latencies, 50),
+        'latency_p99': percentile(latencies, 99),
+        'mbytes_per_sec': server_stats['bytes_sent'] / elapsed / 2**20,
+        'statuses': server_stats['statuses'],
+        'outcomes': outcomes,
+        'server_cpu_time': server_stats['cpu_time'],
+        'crawler_processes': [{
+            'pid': pid,
+            'cpu_time': process['cpu_time'],
+            'cpu_percent': 100 * process['cpu_time'] / elapsed,
+            'peak_rss_mb': process['peak_rss'] / 2**20,
+        } for pid, process in sorted(monitor.processes.items())],
+    }
+
+
+def print_results(results: Dict) -> None:
+    """
+    Print benchmark results.
+
+    Args:
+        results: Results returned by `run_benchmark`.
+    """
+    print(f'{results["posts"]} posts in {results["elapsed"]:.2f} s: '
+          f'{results["posts_per_sec"]:.1f} posts/s, '
+          f'{results["requests_per_sec"]:.1f} requests/s, '
+          f'{results["mbytes_per_sec"]:.2f} MB/s')
+    print(f'Request latency p50 {1000 * results["latency_p50"]:.1f} ms, '
+          f'p99 {1000 * results["latency_p99"]:.1f} ms')
+    print(f'Response statuses: {results["statuses"]}')
+    print(f'Post outcomes: {results["outcomes"]}, '
+          f'{results["saved_per_sec"]:.1f} saved posts/s')
+    print(f'Mock server CPU time: {results["server_cpu_time"]:.2f} s')
+    print('Crawler processes (workers and managers):')
+    for process in results['crawler_processes']:
+        print(f'  pid {process["pid"]:>7}: '
+              f'CPU {process["cpu_time"]:7.2f} s '
+              f'({process["cpu_percent"]:5.1f}%), '
+              f'peak RSS {process["peak_rss_mb"]:7.1f} MB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--posts',
+        type=int,
+        default=10000,
+        help='the number of post IDs to be crawled, default 10000',
+    )
+    parser.add_argument(
+        '-p',
+        '--processes_number',
+        type=int,
+        default=1,
+        help='the number of crawler processes, default 1',
+    )
+    parser.add_argument(
+        '-e',
+        '--engine',
+        type=str,
+        choices=('sync', 'async'),
+        default='async',
+        help='crawler engine, default async',
+    )
+    parser.add_argument(
+        '-c',
+        '--concurrency',
+        type=int,
+        default=100,
+        help='the maximum number of requests in flight per process',
+    )
+    parser.add_argument(
+        '--chunk_size',
+        type=int,
+        default=500,
+        help='the number of post IDs in a chunk of work, default 500',
+    )
+    parser.add_argument(
+        '--adaptive',
+        action='store_true',
+        help='adapt crawling speed to the responses',
+    )
+    parser.add_argument(
+        '--attempts',
+        type=int,
+        default=3,
+        help='the maximum number of attempts to download a post, default 3',
+    )
+    parser.add_argument(
+        '--hedge',
+        type=float,
+        default=None,
+        metavar='PERCENTILE',
+        help='latency percentile of hedged requests',
+    )
+    parser.add_argument(
+        '--save',
+        type=str,
+        choices=('none', 'html', 'archive'),
+        default='none',
+        help='how downloaded pages are saved, default none',
+    )
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.05,
+        help='mean response delay of the mock server in seconds',
+    )
+    parser.add_argument(
+        '--jitter',
+        type=float,
+        default=0.02,
+        help='standard deviation of the response delay in seconds',
+    )
+    parser.add_argument(
+        '--not_found',
+        type=float,
+        default=0.5,
+        help='share of post IDs answered with 404, default 0.5',
+    )
+    parser.add_argument(
+        '--server_errors',
+        type=float,
+        default=0.0,
+        help='share of requests answered with 503, default 0',
+    )
+    parser.add_argument(
+        '--throttled',
+        type=float,
+        default=0.0,
+        help='share of requests answered with 429, default 0',
+    )
+    parser.add_argument(
+        '--capacity',
+        type=int,
+        default=None,
+        help='requests in flight above which the mock answers 429',
+    )
+    parser.add_argument(
+        '--proxies',
+        type=int,
+        default=4,
+        help='the number of mock proxies, default 4',
+    )
+    parser.add_argument(
+        '--local_proxies',
+        action='store_true',
+        help='every crawler process manages its own copy of the proxy list',
+    )
+    parser.add_argument(
+        '--bad_proxies',
+        type=int,
+        default=0,
+        help='the number of mock proxies answering 407, default 0',
+    )
+    parser.add_argument(
+        '--proxy_failure',
+        type=float,
+        default=0.5,
+        help='share of failed requests of a bad proxy, default 0.5',
+    )
+    parser.add_argument(
+        '--dead_blocks',
+        type=float,
+        default=0.0,
+        help=('share of blocks of 1000 post IDs answered with 404, '
+              'default 0'),
+    )
+    parser.add_argument(
+        '--explore',
+        action='store_true',
+        help='probe the ID range first and crawl the densest blocks first',
+    )
+    parser.add_argument(
+        '--min_density',
+        type=float,
+        default=0.0,
+        help=('skip blocks whose estimated share of available posts is below '
+              'this value, only used with --explore, default 0'),
+    )
+    parser.add_argument(
+        '--history',
+        action='store_true',
+        help=('crawl the ID range once before the measured crawl, so '
+              'exploring starts from known outcomes'),
+    )
+    parser.add_argument(
+        '--max_scale',
+        type=int,
+        default=4,
+        help='the maximum number of content repeats of generated pages',
+    )
+    parser.add_argument(
+        '--metrics',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help='file where crawler metrics are written',
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help=('json lines file where the results are appended with the git '
+              'commit'),
+    )
+
+    args = parser.parse_args()
+
+    if args.proxies <= args.bad_proxies:
+        raise ValueError('At least one proxy must be good')
+
+    results = run_benchmark(
+        posts=args.posts,
+        processes=args.processes_number,
+        engine=args.engine,
+        concurrency=args.concurrency,
+        chunk_size=args.chunk_size,
+        adaptive=args.adaptive,
+        max_attempts=args.attempts,
+        hedge_percentile=args.hedge,
+        archive=args.save == 'archive',
+        save_html=args.save != 'none',
+        proxies=args.proxies,
+        shared_proxies=not args.local_proxies,
+        max_scale=args.max_scale,
+        metrics_path=args.metrics,
+        explore=args.explore,
+        min_density=args.min_density,
+        history=args.history,
+        latency=args.latency,
+        jitter=args.jitter,
+        not_found=args.not_found,
+        server_errors=args.server_errors,
+        throttled=args.throttled,
+        capacity=args.capacity,
+        bad_proxies=args.bad_proxies,
+        proxy_failure=args.proxy_failure,
+        dead_blocks=args.dead_blocks,
+    )
+    print_results(results)
+    if args.output is not None:
+        append_results(args.output, 'crawl', results)
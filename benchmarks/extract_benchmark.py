@@ -0,0 +1,271 @@
+"""
+Extraction benchmark on a synthetic corpus of post pages
+"""
+import os
+import time
+import argparse
+import resource
+import tempfile
+from multiprocessing import Pipe, Process
+from typing import Callable, Dict, List
+
+from bs4 import BeautifulSoup
+
+from benchmarks.corpus import write_corpus
+from benchmarks.results import append_results
+from task_1 import crawler, extracter, lxml_extracter
+from utils.normalizer import Normalizer, STOPWORDS, snowballstemmer
+
+# Field functions of the bs4 extracter, they take the filtered post soup
+FIELD_FUNCTIONS = dict(extracter.FIELD_EXTRACTORS)
+
+
+def _time_calls(func: Callable, arguments: List) -> float:
+    """
+    Return total time in seconds of calling the function on every argument.
+    """
+    total = 0.0
+    for argument in arguments:
+        start_time = time.perf_counter()
+        func(argument)
+        total += time.perf_counter() - start_time
+    return total
+
+
+def time_functions(pages: List[str]) -> Dict[str, Dict]:
+    """
+    Time the stages of extracting on every page.
+
+    Args:
+        pages: Post pages.
+
+    Returns:
+        Total time in seconds, mean time in milliseconds and pages per
+        second of every stage.
+    """
+    totals = {
+        'html_filter': _time_calls(
+            lambda page: crawler.html_filter(page, crawler.POST_CLASSES),
+            pages),
+        'parse': _time_calls(
+            lambda page: BeautifulSoup(markup=page, features='lxml'), pages),
+    }
+
+    soups = [BeautifulSoup(markup=page, features='lxml') for page in pages]
+    totals['filter_post_html'] = _time_calls(extracter.filter_post_html,
+                                             soups)
+    for field, func in FIELD_FUNCTIONS.items():
+        totals[field] = _time_calls(func, soups)
+
+    contents = [
+        soup.find('div', {'id': 'post-content-body'}).get_text(' ')
+        for soup in soups
+    ]
+    totals['clean_text'] = _time_calls(extracter.clean_text, contents)
+    totals['tokenize'] = _time_calls(Normalizer(STOPWORDS).tokenize,
+                                     contents)
+    if snowballstemmer is not None:
+        totals['tokenize_stem'] = _time_calls(
+            Normalizer(STOPWORDS, stem=True).tokenize, contents)
+
+    totals['bs4_extract'] = _time_calls(
+        lambda page: extracter.extract_post_data_from_html(page, '1'), pages)
+    totals['lxml_extract'] = _time_calls(
+        lambda page: lxml_extracter.extract_post_data_from_html(page, '1'),
+        pages)
+
+    posts = [
+        lxml_extracter.extract_post_data_from_html(page, str(post_id))
+        for post_id, page in enumerate(pages)
+    ]
+    with tempfile.TemporaryDirectory() as temp_path:
+        totals['save_post_data'] = _time_calls(
+            lambda post: extracter.save_post_data(post, temp_path), posts)
+
+    return {
+        stage: {
+            'total': total,
+            'mean_ms': 1000 * total / len(pages),
+            'pages_per_sec': len(pages) / total if total > 0 else None,
+        }
+        for stage, total in totals.items()
+    }
+
+
+def _run_extraction(path_src: str, path_dest: str, workers: int,
+                    chunk_size: int, engine: str, output_format: str,
+                    connection) -> None:
+    start_time = time.monotonic()
+    extracter.extract_posts_data(
+        path_src=path_src,
+        path_dest=path_dest,
+        workers=workers,
+        chunk_size=chunk_size,
+        engine=engine,
+        output_format=output_format,
+    )
+    connection.send(time.monotonic() - start_time)
+
+
+def time_extraction(path_src: str,
+                    workers: int = 1,
+                    chunk_size: int = 64,
+                    engine: str = 'bs4',
+                    output_format: str = 'json') -> Dict:
+    """
+    Time `extract_posts_data` over the corpus in a separate process.
+
+    Must be run before other child processes are started, peak memory is
+    the maximum over all finished child processes.
+
+    Args:
+        path_src: Directory of the corpus.
+        workers: The number of extracting processes.
+        chunk_size: The number of files sent to a process at a time.
+        engine: Extracter engine.
+        output_format: Output format of processed posts.
+
+    Returns:
+        Time, throughput, CPU time and peak resident memory of the run.
+    """
+    file_names = [
+        file_ for file_ in os.listdir(path_src) if file_.endswith('.html')
+    ]
+    size = sum(
+        os.path.getsize(f'{path_src}/{file_name}')
+        for file_name in file_names)
+
+    with tempfile.TemporaryDirectory() as temp_path:
+        connection, child_connection = Pipe()
+        process = Process(
+            target=_run_extraction,
+            args=(path_src, f'{temp_path}/processed', workers, chunk_size,
+                  engine, output_format, child_connection),
+        )
+        process.start()
+        elapsed = connection.recv()
+        process.join()
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'posts': len(file_names),
+        'elapsed': elapsed,
+        'posts_per_sec': len(file_names) / elapsed,
+        'mbytes_per_sec': size / elapsed / 2**20,
+        'cpu_time': usage.ru_utime + usage.ru_stime,
+        # Kilobytes on Linux
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+    }
+
+
+def print_results(results: Dict) -> None:
+    """
+    Print benchmark results.
+
+    Args:
+        results: Results of `time_extraction` and `time_functions`.
+    """
+    run = results['run']
+    print(f'{run["posts"]} posts extracted by {results["engine"]} in '
+          f'{run["elapsed"]:.2f} s with {results["workers"]} workers: '
+          f'{run["posts_per_sec"]:.1f} posts/s, '
+          f'{run["mbytes_per_sec"]:.2f} MB/s, '
+          f'CPU {run["cpu_time"]:.2f} s, '
+          f'peak RSS {run["peak_rss_mb"]:.1f} MB')
+    print(f'Stages on {results["sample"]} pages:')
+    for stage, timing in results['stages'].items():
+        print(f'  {stage:<18} {timing["mean_ms"]:9.3f} ms/page '
+              f'{timing["total"]:9.3f} s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--corpus',
+        type=str,
+        default='data/benchmark_corpus',
+        help=('directory of the generated corpus, it is generated again if '
+              'the parameters change, default data/benchmark_corpus'),
+    )
+    parser.add_argument(
+        '--size',
+        type=int,
+        default=10000,
+        help='the number of posts in the corpus, default 10000',
+    )
+    parser.add_argument(
+        '--max_scale',
+        type=int,
+        default=4,
+        help=('the maximum number of content repeats of generated pages, '
+              'default 4'),
+    )
+    parser.add_argument(
+        '--sample',
+        type=int,
+        default=500,
+        help='the number of pages used to time every stage, default 500',
+    )
+    parser.add_argument(
+        '-e',
+        '--engine',
+        type=str,
+        choices=extracter.ENGINES,
+        default='bs4',
+        help='extracter engine of the full run, default bs4',
+    )
+    parser.add_argument(
+        '-f',
+        '--format',
+        type=str,
+        choices=extracter.OUTPUT_FORMATS,
+        default='json',
+        help='output format of the full run, default json',
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=1,
+        help='the number of processes of the full run, default 1',
+    )
+    parser.add_argument(
+        '--chunk_size',
+        type=int,
+        default=64,
+        help='the number of files sent to a process at a time, default 64',
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help=('json lines file where the results are appended with the git '
+              'commit'),
+    )
+
+    args = parser.parse_args()
+
+    if args.size < 1 or args.sample < 1:
+        raise ValueError('Corpus size and sample must be positive')
+
+    write_corpus(args.corpus, args.size, args.max_scale)
+    results = {
+        'size': args.size,
+        'max_scale': args.max_scale,
+        'engine': args.engine,
+        'format': args.format,
+        'workers': args.workers,
+        'sample': min(args.sample, args.size),
+        'run': time_extraction(args.corpus, args.workers, args.chunk_size,
+                               args.engine, args.format),
+    }
+
+    pages = []
+    for post_id in range(1, results['sample'] + 1):
+        with open(f'{args.corpus}/{post_id}.html', encoding='utf-8') as file_:
+            pages.append(file_.read())
+    results['stages'] = time_functions(pages)
+
+    print_results(results)
+    if args.output is not None:
+        append_results(args.output, 'extract', results)
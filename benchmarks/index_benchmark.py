@@ -0,0 +1,351 @@
+"""
+Inverted index benchmark on generated processed posts
+"""
+import os
+import time
+import random
+import argparse
+import resource
+import tempfile
+from multiprocessing import Pipe, Process
+from typing import Dict, List
+
+from benchmarks.corpus import PostGenerator, load_words, write_posts
+from benchmarks.crawl_benchmark import ProcessMonitor, percentile
+from benchmarks.results import append_results
+from task_2.index import InvertedIndex
+from task_2.indexer import build_index
+
+QUERY_KINDS = ('term', 'and', 'and3', 'or', 'not', 'field')
+# The number of words of ranked queries
+RANKED_LENGTHS = (1, 2, 3, 5, 8)
+
+
+def _run_build(path_src: str, path_dest: str, workers: int, stem: bool,
+               memory_budget: int, connection) -> None:
+    start_time = time.monotonic()
+    posts = build_index(path_src,
+                        path_dest,
+                        stem=stem,
+                        max_workers=workers,
+                        memory_budget=memory_budget)
+    connection.send((posts, time.monotonic() - start_time))
+
+
+def time_build(path_src: str,
+               path_dest: str,
+               workers: int = 1,
+               stem: bool = False,
+               memory_budget: int = 256) -> Dict:
+    """
+    Time `build_index` over the posts in a separate process.
+
+    Must be run before other child processes are started, peak resident
+    memory is the maximum over all finished child processes. It includes
+    the pages of the memory mapped segments, so the anonymous memory of
+    every process building the index is sampled too.
+
+    Args:
+        path_src: Post store of the generated posts.
+        path_dest: Directory of the index.
+        workers: The number of processes building the index.
+        stem: If True terms are stemmed.
+        memory_budget: Memory of in-memory postings of a process in
+            megabytes.
+
+    Returns:
+        Time, throughput, index size, CPU time, peak resident memory and
+        peak anonymous memory of a process and of all processes of the
+        run.
+    """
+    monitor = ProcessMonitor(interval=0.1)
+    monitor.start()
+    connection, child_connection = Pipe()
+    process = Process(
+        target=_run_build,
+        args=(path_src, path_dest, workers, stem, memory_budget,
+              child_connection),
+    )
+    process.start()
+    posts, elapsed = connection.recv()
+    process.join()
+    monitor.stop()
+
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    size = sum(
+        os.path.getsize(f'{root}/{file_}')
+        for root, _, files in os.walk(path_dest) for file_ in files)
+    return {
+        'posts': posts,
+        'elapsed': elapsed,
+        'posts_per_sec': posts / elapsed,
+        'index_mb': size / 2**20,
+        'cpu_time': usage.ru_utime + usage.ru_stime,
+        # Kilobytes on Linux
+        'peak_rss_mb': usage.ru_maxrss / 1024,
+        'peak_anon_mb': max(
+            (process['peak_anon'] for process in monitor.processes.values()),
+            default=0) / 2**20,
+        # Upper bound, processes may peak at different times
+        'peak_anon_total_mb': sum(
+            process['peak_anon']
+            for process in monitor.processes.values()) / 2**20,
+    }
+
+
+def make_queries(vocabulary: List[str], count: int,
+                 seed: int = 0) -> Dict[str, List[str]]:
+    """
+    Make boolean queries of every kind from words of all frequencies.
+
+    Args:
+        vocabulary: Words ordered by rank.
+        count: The number of queries of every kind.
+        seed: Seed of the word choice.
+
+    Returns:
+        Queries of every kind of `QUERY_KINDS`.
+    """
+    rng = random.Random(seed)
+
+    def word() -> str:
+        # Log-uniform rank, so frequent and rare words are both common
+        return vocabulary[int(len(vocabulary)**rng.random()) - 1]
+
+    makers = {
+        'term': lambda: word(),
+        'and': lambda: f'{word()} {word()}',
+        'and3': lambda: f'{word()} {word()} {word()}',
+        'or': lambda: f'{word()} OR {word()}',
+        'not': lambda: f'{word()} -{word()}',
+        'field': lambda: f'title:{word()} {word()}',
+    }
+    return {
+        kind: [makers[kind]() for _ in range(count)]
+        for kind in QUERY_KINDS
+    }
+
+
+def time_queries(path: str, queries: Dict[str, List[str]]) -> Dict:
+    """
+    Time opening the index and answering the queries one by one.
+
+    Args:
+        path: Directory of the index.
+        queries: Queries of every kind.
+
+    Returns:
+        Open time, latency percentiles and queries per second of every
+        kind.
+    """
+    start_time = time.perf_counter()
+    index = InvertedIndex(path)
+    open_ms = 1000 * (time.perf_counter() - start_time)
+
+    results = {'open_ms': open_ms, 'kinds': {}}
+    with index:
+        for kind, kind_queries in queries.items():
+            latencies = []
+            hits = 0
+            for query in kind_queries:
+                start_time = time.perf_counter()
+                hits += len(index.search(query))
+                latencies.append(time.perf_counter() - start_time)
+            results['kinds'][kind] = {
+                'qps': len(latencies) / sum(latencies),
+                'p50_ms': 1000 * percentile(latencies, 50),
+                'p99_ms': 1000 * percentile(latencies, 99),
+                'mean_hits': hits / len(latencies),
+            }
+    return results
+
+
+def make_ranked_queries(vocabulary: List[str], count: int,
+                        seed: int = 0) -> Dict[str, List[str]]:
+    """
+    Make ranked queries of every length of `RANKED_LENGTHS`.
+
+    Args:
+        vocabulary: Words ordered by rank.
+        count: The number of queries of every length.
+        seed: Seed of the word choice.
+
+    Returns:
+        Queries of every length.
+    """
+    rng = random.Random(seed)
+    return {
+        f'{length} words': [
+            ' '.join(vocabulary[int(len(vocabulary)**rng.random()) - 1]
+                     for _ in range(length)) for _ in range(count)
+        ]
+        for length in RANKED_LENGTHS
+    }
+
+
+def time_ranking(path: str, queries: Dict[str, List[str]],
+                 k: int = 10) -> Dict:
+    """
+    Time ranked queries with pruning against scoring every posting.
+
+    Args:
+        path: Directory of the index.
+        queries: Queries of every kind.
+        k: The number of returned posts.
+
+    Returns:
+        Queries per second and latency percentiles with and without
+        pruning of every kind and the number of queries with different
+        results.
+    """
+    results = {'k': k, 'kinds': {}}
+    with InvertedIndex(path) as index:
+        for kind, kind_queries in queries.items():
+            latencies = {'pruned': [], 'exhaustive': []}
+            mismatches = 0
+            for query in kind_queries:
+                ranked = []
+                for name in latencies:
+                    start_time = time.perf_counter()
+                    ranked.append(index.rank(query, k, name == 'pruned'))
+                    latencies[name].append(time.perf_counter() -
+                                           start_time)
+                mismatches += ranked[0] != ranked[1]
+            timing = {'mismatches': mismatches}
+            for name, name_latencies in latencies.items():
+                timing[f'{name}_qps'] = (len(name_latencies) /
+                                         sum(name_latencies))
+                timing[f'{name}_p50_ms'] = 1000 * percentile(
+                    name_latencies, 50)
+                timing[f'{name}_p99_ms'] = 1000 * percentile(
+                    name_latencies, 99)
+            results['kinds'][kind] = timing
+    return results
+
+
+def print_results(results: Dict) -> None:
+    """
+    Print benchmark results.
+
+    Args:
+        results: Results of `time_build`, `time_queries` and
+            `time_ranking`.
+    """
+    build = results['build']
+    print(f'{build["posts"]} posts indexed in {build["elapsed"]:.2f} s with '
+          f'{results["workers"]} workers and {results["memory_budget"]} MB '
+          'each: '
+          f'{build["posts_per_sec"]:.1f} posts/s, '
+          f'index {build["index_mb"]:.1f} MB, '
+          f'CPU {build["cpu_time"]:.2f} s, '
+          f'peak RSS {build["peak_rss_mb"]:.1f} MB, '
+          f'peak anonymous {build["peak_anon_mb"]:.1f} MB per process, '
+          f'{build["peak_anon_total_mb"]:.1f} MB in all')
+    search = results['search']
+    print(f'Index opened in {search["open_ms"]:.2f} ms')
+    for kind, timing in search['kinds'].items():
+        print(f'  {kind:<6} {timing["qps"]:9.1f} queries/s, '
+              f'p50 {timing["p50_ms"]:8.3f} ms, '
+              f'p99 {timing["p99_ms"]:8.3f} ms, '
+              f'{timing["mean_hits"]:9.1f} hits')
+    ranking = results['ranking']
+    print(f'Top {ranking["k"]} ranked, pruned / exhaustive:')
+    for kind, timing in ranking['kinds'].items():
+        print(f'  {kind:<8} {timing["pruned_qps"]:8.1f} / '
+              f'{timing["exhaustive_qps"]:8.1f} queries/s, '
+              f'p50 {timing["pruned_p50_ms"]:7.3f} / '
+              f'{timing["exhaustive_p50_ms"]:7.3f} ms, '
+              f'p99 {timing["pruned_p99_ms"]:7.3f} / '
+              f'{timing["exhaustive_p99_ms"]:7.3f} ms, '
+              f'{timing["mismatches"]} different results')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--corpus',
+        type=str,
+        default='data/benchmark_posts',
+        help=('post store of the generated posts, it is generated again if '
+              'the parameters change, default data/benchmark_posts'),
+    )
+    parser.add_argument(
+        '--size',
+        type=int,
+        default=20000,
+        help='the number of posts, default 20000',
+    )
+    parser.add_argument(
+        '--vocabulary',
+        type=int,
+        default=200000,
+        help='the number of distinct words, default 200000',
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=1,
+        help='the number of processes building the index, default 1',
+    )
+    parser.add_argument(
+        '--stem',
+        action='store_true',
+        help='stem the indexed words',
+    )
+    parser.add_argument(
+        '-m',
+        '--memory',
+        type=int,
+        default=256,
+        help=('memory of in-memory postings of a building process in '
+              'megabytes, default 256'),
+    )
+    parser.add_argument(
+        '--queries',
+        type=int,
+        default=200,
+        help='the number of queries of every kind, default 200',
+    )
+    parser.add_argument(
+        '-k',
+        type=int,
+        default=10,
+        help='the number of posts of ranked queries, default 10',
+    )
+    parser.add_argument(
+        '--output',
+        type=str,
+        default=None,
+        help=('json lines file where the results are appended with the git '
+              'commit'),
+    )
+
+    args = parser.parse_args()
+
+    if min(args.size, args.vocabulary, args.queries, args.k,
+           args.memory) < 1:
+        raise ValueError(
+            'Size, vocabulary, queries, k and memory must be positive')
+
+    write_posts(args.corpus, args.size, args.vocabulary)
+    with tempfile.TemporaryDirectory() as temp_path:
+        results = {
+            'size': args.size,
+            'vocabulary': args.vocabulary,
+            'workers': args.workers,
+            'stem': args.stem,
+            'memory_budget': args.memory,
+            'build': time_build(args.corpus, temp_path, args.workers,
+                                args.stem, args.memory),
+        }
+        generator = PostGenerator(load_words(), args.vocabulary)
+        results['search'] = time_queries(
+            temp_path, make_queries(generator.vocabulary, args.queries))
+        results['ranking'] = time_ranking(
+            temp_path,
+            make_ranked_queries(generator.vocabulary, args.queries), args.k)
+
+    print_results(results)
+    if args.output is not None:
+        append_results(args.output, 'index', results)
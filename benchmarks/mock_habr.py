@@ -0,0 +1,297 @@
+"""
+Local stand-in for https://habr.com used to benchmark the crawler
+"""
+import re
+import time
+import zlib
+import random
+import socket
+import asyncio
+from collections import Counter
+from multiprocessing import Event, Pipe, Process
+from typing import Dict, List
+
+from aiohttp import web
+
+from benchmarks.corpus import PageGenerator, load_examples
+
+POST_PATH = re.compile(r'/ru/post/(\d+)/?$')
+
+
+class MockHabr():
+    """
+    Request handler serving generated post pages with injected faults.
+
+    Every listening port plays a proxy, the crawler sends absolute URLs to
+    it and gets the page straight away. The first `bad_proxies` ports
+    answer 407 to a `proxy_failure` share of requests. With `etag` pages
+    are sent with an ETag and requests with a matching `If-None-Match`
+    are answered with 304. A `dead_blocks` share of blocks of `block_size`
+    consecutive IDs is entirely gone, like long runs of deleted posts.
+
+    Attributes:
+        pages: Generator of post pages.
+        latency: Mean response delay in seconds.
+        jitter: Standard deviation of the response delay.
+        not_found: Share of post IDs answered with 404.
+        server_errors: Share of requests answered with 503.
+        throttled: Share of requests answered with 429.
+        capacity: The number of requests in flight above which requests are
+        answered with 429, not limited if None.
+        retry_after: `Retry-After` of 429 responses in seconds.
+        bad_proxies: The number of failing proxies.
+        proxy_failure: Share of failed requests of a failing proxy.
+        etag: If True support conditional requests.
+        dead_blocks: Share of blocks of post IDs answered with 404.
+        block_size: The number of post IDs in a block.
+        seed: Seed of the injected faults.
+    """
+
+    def __init__(self,
+                 pages: PageGenerator,
+                 latency: float = 0.05,
+                 jitter: float = 0.02,
+                 not_found: float = 0.5,
+                 server_errors: float = 0.0,
+                 throttled: float = 0.0,
+                 capacity: int = None,
+                 retry_after: int = 1,
+                 bad_proxies: int = 0,
+                 proxy_failure: float = 0.5,
+                 etag: bool = False,
+                 dead_blocks: float = 0.0,
+                 block_size: int = 1000,
+                 seed: int = 0) -> None:
+        """
+        Init MockHabr
+        """
+        self.pages = pages
+        self.latency = latency
+        self.jitter = jitter
+        self.not_found = not_found
+        self.server_errors = server_errors
+        self.throttled = throttled
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.bad_proxies = bad_proxies
+        self.proxy_failure = proxy_failure
+        self.etag = etag
+        self.dead_blocks = dead_blocks
+        self.block_size = block_size
+        self.seed = seed
+        self.in_flight = 0
+        self.latencies = []
+        self.statuses = Counter()
+        self.proxy_requests = Counter()
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+
+    def is_gone(self, post_id: int) -> bool:
+        """
+        Check that the post is deleted, the same for every request.
+
+        Args:
+            post_id: ID of the post.
+        """
+        block = post_id // self.block_size
+        if (self.dead_blocks > 0 and random.Random(
+                f'{self.seed}:{block}').random() < self.dead_blocks):
+            return True
+        return random.Random(self.seed - post_id).random() < self.not_found
+
+    def _respond(self, proxy: int, path: str,
+                 if_none_match: str = None) -> web.Response:
+        if (proxy < self.bad_proxies
+                and self._random.random() < self.proxy_failure):
+            return web.Response(status=407)
+        match = POST_PATH.search(path)
+        if match is None:
+            return web.Response(status=400)
+
+        if self.capacity is not None and self.in_flight > self.capacity:
+            return web.Response(
+                status=429,
+                headers={'Retry-After': str(self.retry_after)},
+            )
+        chance = self._random.random()
+        if chance < self.throttled:
+            return web.Response(
+                status=429,
+                headers={'Retry-After': str(self.retry_after)},
+            )
+        if chance < self.throttled + self.server_errors:
+            return web.Response(status=503)
+
+        post_id = int(match.group(1))
+        if self.is_gone(post_id):
+            return web.Response(status=404)
+        page = self.pages.page(post_id)
+        if not self.etag:
+            return web.Response(text=page, content_type='text/html')
+        etag = '"{:08x}"'.format(zlib.crc32(page.encode('utf-8')))
+        if if_none_match == etag:
+            return web.Response(status=304, headers={'ETag': etag})
+        return web.Response(
+            text=page,
+            content_type='text/html',
+            headers={'ETag': etag},
+        )
+
+    async def handle(self, request: web.Request) -> web.Response:
+        """
+        Answer a post request after the response delay.
+
+        Args:
+            request: Post request sent to one of the proxies.
+        """
+        start_time = time.monotonic()
+        proxy = request.app['proxy']
+        self.in_flight += 1
+        try:
+            delay = self._random.gauss(self.latency, self.jitter)
+            await asyncio.sleep(max(0.0, delay))
+            response = self._respond(proxy, request.path,
+                                     request.headers.get('If-None-Match'))
+        finally:
+            self.in_flight -= 1
+
+        self.latencies.append(time.monotonic() - start_time)
+        self.statuses[response.status] += 1
+        self.proxy_requests[proxy] += 1
+        if response.body is not None:
+            self.bytes_sent += len(response.body)
+        return response
+
+    def stats(self) -> Dict:
+        """
+        Return statistics of the answered requests.
+        """
+        return {
+            'latencies': self.latencies,
+            'statuses': dict(self.statuses),
+            'proxy_requests': dict(self.proxy_requests),
+            'bytes_sent': self.bytes_sent,
+        }
+
+
+async def _serve(mock: MockHabr, sockets: List[socket.socket],
+                 stop: Event) -> None:
+    runners = []
+    for proxy, sock in enumerate(sockets):
+        app = web.Application()
+        app['proxy'] = proxy
+        app.router.add_route('GET', '/{path:.*}', mock.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.SockSite(runner, sock).start()
+        runners.append(runner)
+
+    while not stop.is_set():
+        await asyncio.sleep(0.1)
+    for runner in runners:
+        await runner.cleanup()
+
+
+def _run_server(options: Dict, examples_path: str, max_scale: int,
+                proxies: int, host: str, stop: Event, connection) -> None:
+    pages = PageGenerator(load_examples(examples_path), max_scale,
+                          options.get('seed', 0))
+    mock = MockHabr(pages, **options)
+    sockets = []
+    for _ in range(proxies):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind((host, 0))
+        sock.listen(1024)
+        sockets.append(sock)
+    connection.send([sock.getsockname()[1] for sock in sockets])
+
+    asyncio.run(_serve(mock, sockets, stop))
+    stats = mock.stats()
+    stats['cpu_time'] = time.process_time()
+    connection.send(stats)
+
+
+class MockHabrServer():
+    """
+    Mock Habr served by a separate process.
+
+    Attributes:
+        options: Arguments of `MockHabr`.
+        examples_path: Directory of the example pages.
+        max_scale: The maximum number of content repeats of generated pages.
+        proxies: The number of listening ports, each of them is a proxy.
+        host: Listening host.
+        ports: Listening ports, known after `start`.
+        pid: ID of the server process, known after `start`.
+    """
+
+    def __init__(self,
+                 examples_path: str = 'examples/unprocessed_posts',
+                 max_scale: int = 4,
+                 proxies: int = 4,
+                 host: str = '127.0.0.1',
+                 **options) -> None:
+        """
+        Init MockHabrServer
+        """
+        self.options = options
+        self.examples_path = examples_path
+        self.max_scale = max_scale
+        self.proxies = proxies
+        self.host = host
+        self.ports = []
+        self.pid = None
+        self._stop = Event()
+        self._connection = None
+        self._process = None
+
+    def __enter__(self) -> 'MockHabrServer':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._process is not None:
+            self.stop()
+
+    @property
+    def post_url(self) -> str:
+        """
+        Post URL template of the crawler.
+        """
+        return f'http://{self.host}:{self.ports[0]}/ru/post/{{post_id}}/'
+
+    @property
+    def proxy_addresses(self) -> List[str]:
+        """
+        Addresses of the proxies.
+        """
+        return [f'{self.host}:{port}' for port in self.ports]
+
+    def start(self) -> None:
+        """
+        Start the server process and wait until it listens.
+        """
+        self._connection, child_connection = Pipe()
+        self._process = Process(
+            target=_run_server,
+            args=(self.options, self.examples_path, self.max_scale,
+                  self.proxies, self.host, self._stop, child_connection),
+            daemon=True,
+        )
+        self._process.start()
+        self.pid = self._process.pid
+        self.ports = self._connection.recv()
+
+    def stop(self) -> Dict:
+        """
+        Stop the server process.
+
+        Returns:
+            Statistics of the answered requests, see `MockHabr.stats`, and
+            CPU time of the server process under `cpu_time` key.
+        """
+        self._stop.set()
+        stats = self._connection.recv()
+        self._process.join()
+        self._process = None
+        return stats
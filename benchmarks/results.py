@@ -0,0 +1,42 @@
+"""
+Benchmark results files
+"""
+import json
+import subprocess
+import time
+from typing import Dict, Optional
+
+
+def git_commit() -> Optional[str]:
+    """
+    Return the current git commit or None outside of a git repository.
+    """
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def append_results(path: str, benchmark: str, results: Dict) -> None:
+    """
+    Append results to a json lines file with the commit and time of the run,
+    so runs of different commits can be compared.
+
+    Args:
+        path: Results file.
+        benchmark: Name of the benchmark.
+        results: Benchmark results.
+    """
+    record = {
+        'benchmark': benchmark,
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        **results,
+    }
+    with open(path, 'a', encoding='utf-8') as file_:
+        file_.write(json.dumps(record, ensure_ascii=False) + '\n')
@@ -0,0 +1,31 @@
+"""
+Script to convert processed posts json files to a post store
+"""
+import argparse
+
+from task_1 import post_store
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--src',
+        type=str,
+        default='data/processed_posts',
+        help=('directory where processed posts json files are stored, '
+              'default data/processed_posts'),
+    )
+    parser.add_argument(
+        '--dest',
+        type=str,
+        default='data/post_store',
+        help='directory of the post store, default data/post_store',
+    )
+
+    args = parser.parse_args()
+
+    print('Converting started.')
+    post_store.convert_directory(
+        path_src=args.src,
+        path_dest=args.dest,
+    )
+    print('Done.')
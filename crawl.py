@@ -4,29 +4,11 @@ Script to run the crawler
 import argparse
 
 from task_1 import crawler
+from task_1.arguments import add_crawl_arguments, validate_crawl_args
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
-    parser.add_argument(
-        '--first',
-        type=int,
-        required=True,
-        help='ID of the first post to be crawled',
-    )
-    parser.add_argument(
-        '--last',
-        type=int,
-        required=True,
-        help='ID of the last post to be crawled',
-    )
-    parser.add_argument(
-        '-p',
-        '--processes_number',
-        type=int,
-        default=1,
-        help=('the maximum number of processes that will be used, '
-              'recommended <=8, default 1'),
-    )
+    add_crawl_arguments(parser)
     parser.add_argument(
         '--path',
         type=str,
@@ -35,18 +17,21 @@ if __name__ == '__main__':
               'unprocessed_posts'),
     )
     parser.add_argument(
-        '-D',
-        '--debug',
+        '-a',
+        '--archive',
         action='store_true',
-        help='setting the log level to DEBUG, default INFO',
+        help=('append posts to compressed segments of an html archive in PATH '
+              'instead of saving every post as html file'),
+    )
+    parser.add_argument(
+        '--local_proxies',
+        action='store_true',
+        help=('every process manages its own copy of the proxy list instead '
+              'of one proxy pool shared by all processes'),
     )
 
     args = parser.parse_args()
-
-    if (args.first < 0 or args.last < 0):
-        raise ValueError('Post id must be positive')
-    if args.first >= args.last:
-        raise ValueError('Last id must be greater than first id')
+    validate_crawl_args(args)
 
     print('Crawler started.')
     crawler.crawl(
@@ -55,5 +40,25 @@ if __name__ == '__main__':
         max_workers=args.processes_number,
         path=args.path,
         debug=args.debug,
+        engine=args.engine,
+        concurrency=args.concurrency,
+        manifest_path=args.manifest,
+        resume=args.resume,
+        chunk_size=args.chunk_size,
+        archive=args.archive,
+        shared_proxies=not args.local_proxies,
+        adaptive=args.adaptive,
+        rate=args.rate,
+        max_attempts=args.attempts,
+        timeout=args.timeout,
+        hedge_percentile=args.hedge,
+        metrics_path=args.metrics,
+        log_sample=args.log_sample,
+        refresh_path=args.refresh,
+        max_age=args.max_age,
+        explore=args.explore,
+        block_size=args.block_size,
+        sample_every=args.sample_every,
+        min_density=args.min_density,
     )
     print('Done.')
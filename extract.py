@@ -11,8 +11,8 @@ if __name__ == '__main__':
         '--src',
         type=str,
         default='data/unprocessed_posts',
-        help=('directory where unprocessed posts are stored, default data/'
-              'unprocessed_posts'),
+        help=('directory where unprocessed posts or html archive are stored, '
+              'default data/unprocessed_posts'),
     )
     parser.add_argument(
         '--dest',
@@ -21,12 +21,69 @@ if __name__ == '__main__':
         help=('directory where processed posts will be saved, default data/'
               'processed_posts'),
     )
-    
+    parser.add_argument(
+        '-e',
+        '--engine',
+        type=str,
+        choices=extracter.ENGINES,
+        default='bs4',
+        help=('bs4 extracts posts with BeautifulSoup, lxml uses the faster '
+              'single pass lxml extracter, default bs4'),
+    )
+    parser.add_argument(
+        '-f',
+        '--format',
+        type=str,
+        choices=extracter.OUTPUT_FORMATS,
+        default='json',
+        help=('json saves every post as a separate file, store appends posts '
+              'to compressed shards with an ID index, default json'),
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=1,
+        help='the number of processes used for extracting, default 1',
+    )
+    parser.add_argument(
+        '-i',
+        '--incremental',
+        action='store_true',
+        help=('only extract new or changed posts and remove processed posts '
+              'whose html file disappeared'),
+    )
+    parser.add_argument(
+        '--chunk_size',
+        type=int,
+        default=64,
+        help='the number of files sent to a process at a time, default 64',
+    )
+    parser.add_argument(
+        '--metrics',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help=('file where extracting metrics are written in the Prometheus '
+              'text format'),
+    )
+
     args = parser.parse_args()
 
+    if args.workers < 1:
+        raise ValueError('Number of workers must be positive')
+    if args.chunk_size < 1:
+        raise ValueError('Chunk size must be positive')
+
     print('Data extracting started.')
     extracter.extract_posts_data(
         path_src=args.src,
         path_dest=args.dest,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        engine=args.engine,
+        incremental=args.incremental,
+        output_format=args.format,
+        metrics_path=args.metrics,
     )
     print('Done.')
@@ -0,0 +1,65 @@
+"""
+Script to build the inverted index over processed posts
+"""
+import argparse
+
+from task_2 import indexer
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--src',
+        type=str,
+        default='data/processed_posts',
+        help=('directory of processed posts json files or a post store, '
+              'default data/processed_posts'),
+    )
+    parser.add_argument(
+        '--dest',
+        type=str,
+        default='data/index',
+        help='directory of the index, default data/index',
+    )
+    parser.add_argument(
+        '--stem',
+        action='store_true',
+        help='stem Russian and English words, needs snowballstemmer',
+    )
+    parser.add_argument(
+        '--stopwords',
+        action='store_true',
+        help='do not index Russian and English stopwords',
+    )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=1,
+        help='the number of processes building the index, default 1',
+    )
+    parser.add_argument(
+        '-m',
+        '--memory',
+        type=int,
+        default=256,
+        help=('memory of in-memory postings of a process in megabytes, '
+              'default 256'),
+    )
+
+    args = parser.parse_args()
+
+    if args.workers < 1:
+        raise ValueError('Number of workers must be positive')
+    if args.memory < 1:
+        raise ValueError('Memory must be positive')
+
+    print('Indexing started.')
+    posts = indexer.build_index(
+        path_src=args.src,
+        path_dest=args.dest,
+        stem=args.stem,
+        stopwords=args.stopwords,
+        max_workers=args.workers,
+        memory_budget=args.memory,
+    )
+    print(f'Done. {posts} posts indexed.')
@@ -0,0 +1,103 @@
+"""
+Script to run the crawler and the data extracting as one pipeline
+"""
+import argparse
+
+from task_1 import extracter, pipeline
+from task_1.arguments import add_crawl_arguments, validate_crawl_args
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    add_crawl_arguments(parser)
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=1,
+        help='the number of extracting processes, default 1',
+    )
+    parser.add_argument(
+        '--dest',
+        type=str,
+        default='data/processed_posts',
+        help=('directory where processed posts will be saved, default data/'
+              'processed_posts'),
+    )
+    parser.add_argument(
+        '-f',
+        '--format',
+        type=str,
+        choices=extracter.OUTPUT_FORMATS,
+        default='json',
+        help=('json saves every post as a separate file, store appends posts '
+              'to compressed shards with an ID index, default json'),
+    )
+    parser.add_argument(
+        '--html_path',
+        type=str,
+        default=None,
+        help='directory where downloaded html is also saved, not saved if unset',
+    )
+    parser.add_argument(
+        '-a',
+        '--archive',
+        action='store_true',
+        help='save downloaded html to an html archive in HTML_PATH',
+    )
+    parser.add_argument(
+        '--extract_engine',
+        type=str,
+        choices=extracter.ENGINES,
+        default='lxml',
+        help='extracter engine, default lxml',
+    )
+    parser.add_argument(
+        '--queue_size',
+        type=int,
+        default=1000,
+        help='the maximum number of pages waiting for extracting, default 1000',
+    )
+
+    args = parser.parse_args()
+    validate_crawl_args(args)
+
+    if args.workers < 1:
+        raise ValueError('Number of workers must be positive')
+    if args.queue_size < 1:
+        raise ValueError('Queue size must be positive')
+    if args.archive and args.html_path is None:
+        raise ValueError('Html archive requires --html_path')
+
+    print('Pipeline started.')
+    valid_posts = pipeline.run_pipeline(
+        first_id=args.first,
+        last_id=args.last,
+        crawl_workers=args.processes_number,
+        extract_workers=args.workers,
+        path_dest=args.dest,
+        output_format=args.format,
+        html_path=args.html_path,
+        archive=args.archive,
+        engine=args.engine,
+        extract_engine=args.extract_engine,
+        concurrency=args.concurrency,
+        chunk_size=args.chunk_size,
+        manifest_path=args.manifest,
+        resume=args.resume,
+        queue_size=args.queue_size,
+        adaptive=args.adaptive,
+        rate=args.rate,
+        max_attempts=args.attempts,
+        timeout=args.timeout,
+        hedge_percentile=args.hedge,
+        metrics_path=args.metrics,
+        log_sample=args.log_sample,
+        refresh_path=args.refresh,
+        max_age=args.max_age,
+        explore=args.explore,
+        block_size=args.block_size,
+        sample_every=args.sample_every,
+        min_density=args.min_density,
+        debug=args.debug,
+    )
+    print(f'Done. {valid_posts} posts extracted.')
@@ -0,0 +1,59 @@
+"""
+Script to rank posts of the inverted index by query words
+"""
+import sys
+import time
+import argparse
+
+from task_2.index import InvertedIndex
+
+POST_URL = 'https://habr.com/ru/post/{post_id}/'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'query',
+        type=str,
+        nargs='*',
+        help=('query words, posts with any of them are ranked, queries are '
+              'read from stdin line by line if not given'),
+    )
+    parser.add_argument(
+        '--index',
+        type=str,
+        default='data/index',
+        help='directory of the index, default data/index',
+    )
+    parser.add_argument(
+        '-k',
+        type=int,
+        default=10,
+        help='the number of printed posts, default 10',
+    )
+    parser.add_argument(
+        '--exhaustive',
+        action='store_true',
+        help='score every posting of the query words instead of pruning',
+    )
+
+    args = parser.parse_args()
+
+    if args.k < 1:
+        raise ValueError('K must be positive')
+
+    with InvertedIndex(args.index) as index:
+        if args.query:
+            queries = [' '.join(args.query)]
+        else:
+            queries = (line.strip() for line in sys.stdin)
+        for query in queries:
+            if not query:
+                continue
+            # Posts indexed by a running updater are searched at once
+            index.refresh()
+            start_time = time.perf_counter()
+            ranked = index.rank(query, args.k, not args.exhaustive)
+            elapsed = 1000 * (time.perf_counter() - start_time)
+            print(f'{query}: {len(ranked)} posts in {elapsed:.2f} ms')
+            for post_id, score in ranked:
+                print(f'  {score:7.3f} ' + POST_URL.format(post_id=post_id))
@@ -0,0 +1,60 @@
+"""
+Script to search the inverted index
+"""
+import sys
+import time
+import argparse
+
+from task_2.index import InvertedIndex
+
+POST_URL = 'https://habr.com/ru/post/{post_id}/'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        'query',
+        type=str,
+        nargs='*',
+        help=('boolean query: words are all required, OR, NOT or -word, '
+              'parentheses and title:, tags:, habs:, content: fields, '
+              'queries are read from stdin line by line if not given'),
+    )
+    parser.add_argument(
+        '--index',
+        type=str,
+        default='data/index',
+        help='directory of the index, default data/index',
+    )
+    parser.add_argument(
+        '-n',
+        '--limit',
+        type=int,
+        default=10,
+        help='the maximum number of printed posts, default 10',
+    )
+
+    args = parser.parse_args()
+
+    if args.limit < 0:
+        raise ValueError('Limit must not be negative')
+
+    with InvertedIndex(args.index) as index:
+        if args.query:
+            queries = [' '.join(args.query)]
+        else:
+            queries = (line.strip() for line in sys.stdin)
+        for query in queries:
+            if not query:
+                continue
+            # Posts indexed by a running updater are searched at once
+            index.refresh()
+            start_time = time.perf_counter()
+            try:
+                post_ids = index.search(query)
+            except ValueError as error:
+                print(f'{query}: {error}')
+                continue
+            elapsed = 1000 * (time.perf_counter() - start_time)
+            print(f'{query}: {len(post_ids)} posts in {elapsed:.2f} ms')
+            for post_id in post_ids[:args.limit]:
+                print('  ' + POST_URL.format(post_id=post_id))
@@ -0,0 +1,218 @@
+"""
+Command line arguments of the crawling scripts
+"""
+import argparse
+
+from task_1 import crawler
+
+
+def add_crawl_arguments(parser: argparse.ArgumentParser) -> None:
+    """
+    Add the arguments of `crawler.crawl` shared by the crawling scripts.
+
+    Args:
+        parser: Parser of the script arguments.
+    """
+    parser.add_argument(
+        '--first',
+        type=int,
+        default=None,
+        help=('ID of the first post to be crawled, required unless --refresh '
+              'is given'),
+    )
+    parser.add_argument(
+        '--last',
+        type=int,
+        default=None,
+        help=('ID of the last post to be crawled, required unless --refresh '
+              'is given'),
+    )
+    parser.add_argument(
+        '-p',
+        '--processes_number',
+        type=int,
+        default=1,
+        help=('the maximum number of crawling processes, recommended <=8, '
+              'default 1'),
+    )
+    parser.add_argument(
+        '-e',
+        '--engine',
+        type=str,
+        choices=crawler.ENGINES,
+        default='sync',
+        help=('sync downloads posts one by one, async keeps many requests in '
+              'flight in every process, default sync'),
+    )
+    parser.add_argument(
+        '-c',
+        '--concurrency',
+        type=int,
+        default=100,
+        help=('the maximum number of requests in flight per process, only '
+              'used by the async engine, default 100'),
+    )
+    parser.add_argument(
+        '--adaptive',
+        action='store_true',
+        help=('adapt the number of requests in flight and the request rate '
+              'to response latency and 429/5xx responses'),
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=10.0,
+        help=('initial number of requests per second of every process, only '
+              'used with --adaptive, default 10'),
+    )
+    parser.add_argument(
+        '--attempts',
+        type=int,
+        default=3,
+        help=('the maximum number of attempts to download a post, failed '
+              'posts are retried with exponential backoff, default 3'),
+    )
+    parser.add_argument(
+        '--timeout',
+        type=float,
+        default=30.0,
+        help='request timeout in seconds, default 30',
+    )
+    parser.add_argument(
+        '--hedge',
+        type=float,
+        default=None,
+        metavar='PERCENTILE',
+        help=('send a second request through another proxy when the first '
+              'one is slower than this latency percentile, only used by the '
+              'async engine'),
+    )
+    parser.add_argument(
+        '--chunk_size',
+        type=int,
+        default=500,
+        help=('the number of post IDs that a process takes from the shared '
+              'work queue at a time, default 500'),
+    )
+    parser.add_argument(
+        '--manifest',
+        type=str,
+        default='data/crawl_manifest',
+        help=('directory where the download status of every post is '
+              'recorded, default data/crawl_manifest'),
+    )
+    parser.add_argument(
+        '-r',
+        '--resume',
+        action='store_true',
+        help=('skip posts already saved or known to be unavailable and '
+              'retry the failed ones'),
+    )
+    parser.add_argument(
+        '--refresh',
+        type=str,
+        default=None,
+        metavar='CORPUS',
+        help=('request posts of the processed posts directory or post store '
+              'again, the newest first, with conditional requests and only '
+              'save changed pages'),
+    )
+    parser.add_argument(
+        '--max_age',
+        type=float,
+        default=None,
+        metavar='DAYS',
+        help='only refresh posts published within DAYS days',
+    )
+    parser.add_argument(
+        '--explore',
+        action='store_true',
+        help=('probe every --sample_every-th ID of the blocks previous crawls '
+              'know little about first, then crawl the densest blocks first'),
+    )
+    parser.add_argument(
+        '--block_size',
+        type=int,
+        default=1000,
+        help=('the number of IDs in a block, only used with --explore, '
+              'default 1000'),
+    )
+    parser.add_argument(
+        '--sample_every',
+        type=int,
+        default=20,
+        help=('distance between probed IDs, only used with --explore, '
+              'default 20'),
+    )
+    parser.add_argument(
+        '--min_density',
+        type=float,
+        default=0.0,
+        help=('skip blocks whose estimated share of available posts is below '
+              'this value, only used with --explore, default 0'),
+    )
+    parser.add_argument(
+        '--metrics',
+        type=str,
+        default=None,
+        metavar='PATH',
+        help=('file where metrics of all processes are written in the '
+              'Prometheus text format'),
+    )
+    parser.add_argument(
+        '--log_sample',
+        type=int,
+        default=1,
+        metavar='N',
+        help=('keep one of N info and debug log messages of the worker '
+              'processes, warnings and errors are always kept, default 1'),
+    )
+    parser.add_argument(
+        '-D',
+        '--debug',
+        action='store_true',
+        help='setting the log level to DEBUG, default INFO',
+    )
+
+
+def validate_crawl_args(args: argparse.Namespace) -> None:
+    """
+    Check the arguments added by `add_crawl_arguments`, the first ID is set
+    to 0 if only --refresh is given.
+
+    Args:
+        args: Parsed script arguments.
+
+    Raises:
+        ValueError: An argument is out of its range.
+    """
+    if args.refresh is None and (args.first is None or args.last is None):
+        raise ValueError('First and last id are required without --refresh')
+    if args.first is None:
+        args.first = 0
+    if (args.first < 0 or (args.last is not None and args.last < 0)):
+        raise ValueError('Post id must be positive')
+    if args.last is not None and args.first >= args.last:
+        raise ValueError('Last id must be greater than first id')
+    if args.max_age is not None and args.max_age <= 0:
+        raise ValueError('Maximum age must be positive')
+    if args.processes_number < 1:
+        raise ValueError('Number of processes must be positive')
+    if args.concurrency < 1:
+        raise ValueError('Concurrency must be positive')
+    if args.chunk_size < 1:
+        raise ValueError('Chunk size must be positive')
+    if args.rate <= 0:
+        raise ValueError('Request rate must be positive')
+    if args.attempts < 1:
+        raise ValueError('Number of attempts must be positive')
+    if args.timeout <= 0:
+        raise ValueError('Timeout must be positive')
+    if args.block_size < 1 or args.sample_every < 1:
+        raise ValueError('Block size and sampling distance must be positive')
+    if not 0 <= args.min_density <= 1:
+        raise ValueError('Minimum density must be between 0 and 1')
+    if args.log_sample < 1:
+        raise ValueError('Log sampling rate must be positive')
+    if args.hedge is not None and not 0 < args.hedge < 100:
+        raise ValueError('Hedge percentile must be between 0 and 100')
@@ -2,142 +2,1142 @@
 Crawler for scrap data from https://habr.com
 """
 import os
-from typing import List
-from multiprocessing import freeze_support, RLock
-from concurrent.futures import ProcessPoolExecutor, as_completed
+import time
+import asyncio
+from contextlib import ExitStack
+from queue import Empty, Queue
+from typing import (Iterable, Iterator, List, Mapping, Optional, Sequence,
+                    Tuple, Union)
+from logging import Logger
+from multiprocessing import freeze_support, Manager, RLock
+from concurrent.futures import ProcessPoolExecutor
 
+import aiohttp
 import requests
 from tqdm.auto import tqdm
-from bs4 import BeautifulSoup, SoupStrainer
+from lxml import etree
 
-from task_1.proxier import ProxyManager
-from utils import subintervals, logging
+from task_1.proxier import (CachedProxyPool, NoProxyError, ProxyManager,
+                            ProxyPoolManager)
+from task_1.manifest import CrawlManifest, PostStatus
+from task_1.html_archive import HtmlArchive, create_archive
+from task_1.throttle import HostLimiters, is_throttled, parse_retry_after
+from task_1.retrier import LatencyTracker, RetryPolicy, RetryQueue
+from task_1.refresher import (PageValidators, REFRESH_DIR, VALIDATORS_DIR,
+                              select_posts)
+from task_1.explorer import plan_passes
+from utils import subintervals, logging, metrics
 
+HEADERS = {
+    'User-Agent': ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_4) '
+                   'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83'
+                   '.0.4103.97 Safari/537.36')
+}
+POST_URL = 'https://habr.com/ru/post/{post_id}/'
+POST_CLASSES = [
+    'tm-article-presenter__body', 'tm-article-author',
+    'tm-article-blocks__comments'
+]
+ENGINES = ('sync', 'async')
 
-def html_filter(html_text: str, classes: List[str] = None) -> str:
+
+# Size in bytes of the page parts fed to the streaming html parser
+FILTER_CHUNK_SIZE = 64 * 1024
+
+
+def _has_class(element: etree._Element, classes: frozenset) -> bool:
+    value = element.get('class')
+    return value is not None and not classes.isdisjoint(value.split())
+
+
+def html_filter(html_text: Union[str, bytes],
+                classes: List[str] = None) -> str:
     """
     Extract and return html tags with specified classes.
 
+    The page is fed to a streaming lxml parser in parts, only the wanted
+    div subtrees are kept and the rest of the page is dropped as soon as
+    it is parsed. Parsing stops once a div of every class has been found,
+    so only the first div of every class is extracted.
+
     Args:
-        html_text: HTML page content.
+        html_text: HTML page content, bytes are decoded as utf-8.
         classes: List of classes to extract.
     Returns:
         Сontent of extracted div tags or original page content if no classes
         are specified.
     """
     if classes is None:
-        parse_only = None
-    else:
-        parse_only = SoupStrainer(name='div', class_=classes)
+        if isinstance(html_text, bytes):
+            return html_text.decode('utf-8', errors='replace')
+        return html_text
 
-    soup = BeautifulSoup(
-        markup=html_text,
-        features='lxml',
-        parse_only=parse_only,
+    classes = frozenset(classes)
+    parser = etree.HTMLPullParser(
+        events=('start', 'end'),
+        tag='div',
+        encoding='utf-8' if isinstance(html_text, bytes) else None,
     )
-    return str(soup)
+    extracted = []
+    found = set()
+    kept = None
+    # None closes the parser, divs left open get their end events
+    for start in [*range(0, len(html_text), FILTER_CHUNK_SIZE), None]:
+        if start is not None:
+            parser.feed(html_text[start:start + FILTER_CHUNK_SIZE])
+        elif len(html_text) > 0:
+            parser.close()
+        for event, element in parser.read_events():
+            if event == 'start':
+                if kept is None and _has_class(element, classes):
+                    kept = element
+            elif element is kept:
+                extracted.append(
+                    etree.tostring(
+                        element,
+                        method='html',
+                        encoding='unicode',
+                        with_tail=False,
+                    ))
+                found.update(
+                    classes.intersection(element.get('class').split()))
+                kept = None
+                element.clear()
+            elif kept is None:
+                element.clear()  # Not a part of the wanted divs
+        if kept is None and len(found) == len(classes):
+            break
+    return ''.join(extracted)
+
+
+def save_post(html_text: str, path: str, post_id: int) -> None:
+    """
+    Save filtered post html as `{path}/{post_id}.html`.
+
+    Args:
+        html_text: Filtered post html.
+        path: Directory where posts are downloaded.
+        post_id: ID of the saved post.
+    """
+    with open(
+            f'{path}/{post_id}.html',
+            'w+',
+            encoding='utf-8',
+    ) as file_:
+        file_.write(html_text)
+
+
+class PostWriter():
+    """
+    Output of the downloaded posts of one process.
+
+    Filtered post html is saved as html file or to the html archive and
+    put to the page queue if one is given.
+
+    Attributes:
+        path: Directory where posts are downloaded, html is not saved if None.
+        logger: Logger used for logging.
+        archive: Html archive where posts are saved instead of html files.
+        page_queue: Queue where (post_id, html) of every post is put.
+        post_url: URL template of the posts with a `{post_id}` field.
+    """
+
+    def __init__(self,
+                 path: str,
+                 logger: Logger,
+                 process_number: int = 0,
+                 archive: bool = False,
+                 page_queue: Queue = None,
+                 post_url: str = POST_URL) -> None:
+        """
+        Init PostWriter
+        """
+        self.path = path
+        self.logger = logger
+        self.post_url = post_url
+        self.archive = None
+        self.page_queue = page_queue
+        if archive and path is not None:
+            self.archive = HtmlArchive(path, f'crawler_{process_number}')
+
+    def write(self, post_id: int, html_text: str) -> None:
+        """
+        Output filtered post html.
+
+        Args:
+            post_id: ID of the post.
+            html_text: Filtered post html.
+        """
+        post_url = self.post_url.format(post_id=post_id)
+        if self.archive is not None:
+            self.archive.put(post_id, html_text)
+            self.logger.info(
+                'Post "%s" saved to archive %s',
+                post_url,
+                self.archive.path,
+            )
+        elif self.path is not None:
+            save_post(html_text, self.path, post_id)
+            self.logger.info(
+                'Post "%s" saved as %s/%s.html',
+                post_url,
+                self.path,
+                post_id,
+            )
+
+        if self.page_queue is not None:
+            self.page_queue.put((post_id, html_text))
+
+    def close(self) -> None:
+        """
+        Close the html archive.
+        """
+        if self.archive is not None:
+            self.archive.close()
+
+
+def open_validators(path: Optional[str],
+                    process_number: int,
+                    refresh: bool = False) -> Optional[PageValidators]:
+    """
+    Open validators of the pages saved by the running process.
+
+    Args:
+        path: Directory where validators are recorded.
+        process_number: Running process number.
+        refresh: If True load validators of the previous runs.
+
+    Returns:
+        Validators of the process, None if `path` is None.
+    """
+    if path is None:
+        return None
+    known = PageValidators.load(path) if refresh else None
+    return PageValidators(path, f'crawler_{process_number}', known)
 
 
-def download_posts(first_id: int,
-                   last_id: int,
+def handle_response(post_id: int,
+                    response_status: int,
+                    content: bytes,
+                    proxy_address: str,
+                    proxy_manager: ProxyManager,
+                    writer: PostWriter,
+                    logger: Logger,
+                    latency: float = None,
+                    headers: Mapping[str, str] = None,
+                    validators: PageValidators = None) -> PostStatus:
+    """
+    Process the response to a post request.
+
+    Args:
+        post_id: ID of the requested post.
+        response_status: Response status code.
+        content: Response body, only used if the post is available.
+        proxy_address: Proxy used for the request.
+        proxy_manager: Proxy manager of the running process.
+        writer: Output of the downloaded posts.
+        logger: Logger used for logging.
+        latency: Response time in seconds.
+        headers: Response headers.
+        validators: Validators of the saved pages, a downloaded page is
+        only written if it changed since it was saved.
+
+    Returns:
+        Download outcome of the post.
+    """
+    post_url = writer.post_url.format(post_id=post_id)
+    metrics.inc('crawler_responses_total',
+                proxy=proxy_address,
+                status=response_status)
+    if latency is not None:
+        metrics.observe('crawler_fetch_latency_seconds', latency,
+                        metrics.LATENCY_BUCKETS)
+    # Proxy is working
+    if response_status in (200, 304, 404, 403):
+        proxy_manager.report_success(proxy_address, latency)
+    # Post is available
+    if response_status == 200:
+        metrics.inc('crawler_downloaded_bytes_total', len(content))
+        with metrics.timer('crawler_html_filter_seconds'):
+            html_text = html_filter(
+                html_text=content,
+                classes=POST_CLASSES,
+            )
+        if validators is not None and not validators.update(
+                post_id, html_text, headers):
+            logger.info('Post "%s" is not changed', post_url)
+            return PostStatus.UNCHANGED
+        with metrics.timer('crawler_write_seconds'):
+            writer.write(post_id, html_text)
+        return PostStatus.SAVED
+    # Post is not modified since the validators were saved
+    elif response_status == 304:
+        logger.info('Post "%s" is not modified', post_url)
+        return PostStatus.UNCHANGED
+    # Post is unavailable or deleted
+    elif response_status in (404, 403):
+        logger.info(
+            ('Failed to download post "%s"; Post is not'
+             ' available, response status code - %d'),
+            post_url,
+            response_status,
+        )
+        return PostStatus.GONE
+    # Site is overloaded or rate limits requests
+    elif is_throttled(response_status):
+        logger.info(
+            ('Failed to download post "%s"; Request is throttled, '
+             'response status code - %d'),
+            post_url,
+            response_status,
+        )
+        return PostStatus.THROTTLED
+    # Most likely problem with proxy
+    proxy_manager.report_failure(proxy_address, latency)
+    logger.info(
+        ('Failed to download post "%s"; Response '
+         'status code - %d'),
+        post_url,
+        response_status,
+    )
+    return PostStatus.PROXY_ERROR
+
+
+def iter_chunks(chunk_queue: Queue) -> Iterator[Sequence[int]]:
+    """
+    Take chunks of post IDs from the shared queue until a None sentinel.
+
+    Args:
+        chunk_queue: Queue of post ID chunks shared by all processes.
+
+    Yields:
+        Chunk of post IDs to be downloaded.
+    """
+    while True:
+        chunk = chunk_queue.get()
+        if chunk is None:
+            return
+        yield chunk
+
+
+def download_posts(post_chunks: Iterable[Sequence[int]],
                    process_number: int,
                    proxies: List[str] = None,
                    path: str = None,
-                   debug: bool = False) -> None:
+                   debug: bool = False,
+                   manifest_path: str = None,
+                   progress_queue: Queue = None,
+                   archive: bool = False,
+                   page_queue: Queue = None,
+                   proxy_pool: ProxyManager = None,
+                   limiters: HostLimiters = None,
+                   retry_policy: RetryPolicy = None,
+                   timeout: float = 30.0,
+                   validators_path: str = None,
+                   refresh: bool = False,
+                   post_url: str = POST_URL) -> None:
     """
     Download posts data from https://habr.com
 
+    Failed posts of a chunk are requested again with exponential backoff
+    before the next chunk is taken.
+
     Args:
-        first_id: ID of the first post to be downloaded.
-        last_id: ID of the last post to be downloaded.
+        post_chunks: Chunks of IDs of the posts to be downloaded.
         process_number: Running process number.
         proxies: Initial proxy list.
-        path: Directory where posts are downloaded.
+        path: Directory where posts are downloaded, html is not saved if
+        None.
         debug: If True setting log level to DEBUG, INFO otherwise.
+        manifest_path: Directory of the crawl manifest, download outcomes
+        are not recorded if None.
+        progress_queue: Queue where the size of every finished chunk is put.
+        archive: If True `path` is an html archive where posts are saved.
+        page_queue: Queue where (post_id, html) of every post is put.
+        proxy_pool: Proxy pool shared by all processes, a process-local
+        proxy manager with `proxies` is used if None.
+        limiters: Adaptive request rate limiters, requests are sent as fast
+        as possible if None.
+        retry_policy: Retry policy of failed posts, posts are requested
+        once if None.
+        timeout: Time limit in seconds of connecting and of waiting for
+        response data.
+        validators_path: Directory where validators of the saved pages are
+        recorded, not recorded if None.
+        refresh: If True send conditional requests for the pages with
+        validators and only write changed pages.
+        post_url: URL template of the posts with a `{post_id}` field.
     """
     logger = logging.get_logger(
         filename=f'crawler_{process_number}',
         debug=debug,
     )
-    proxy_manager = ProxyManager(logger=logger, proxies=proxies)
-    headers = {
-        'User-Agent': ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_4) '
-                       'AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83'
-                       '.0.4103.97 Safari/537.36')
-    }
+    proxy_manager = proxy_pool
+    if proxy_manager is None:
+        proxy_manager = ProxyManager(logger=logger, proxies=proxies)
+    manifest = None
+    if manifest_path is not None:
+        manifest = CrawlManifest(manifest_path, f'crawler_{process_number}')
+    writer = PostWriter(path, logger, process_number, archive, page_queue,
+                        post_url)
+    validators = open_validators(validators_path, process_number, refresh)
+    if retry_policy is None:
+        retry_policy = RetryPolicy(max_attempts=1)
+    retries = RetryQueue(retry_policy)
 
-    for post_id in tqdm(
-            range(first_id, last_id),
+    with requests.Session() as session, tqdm(
             desc=f'{process_number:2}',
             position=(process_number + 1),
             leave=False,
-    ):
-        try:
-            proxy_address = proxy_manager.get_proxy()
-            proxies = {'http': f'http://{proxy_address}'}
-            post_url = f'https://habr.com/ru/post/{post_id}/'
-            response = requests.get(
+    ) as progress_bar:
+        session.headers.update(HEADERS)
+
+        for chunk in post_chunks:
+            for post_id, attempt in retries.iter_items(chunk):
+                post_url = writer.post_url.format(post_id=post_id)
+                limiter = None
+                if limiters is not None:
+                    limiter = limiters.get(post_url)
+                    limiter.wait()
+                request_headers = None
+                if validators is not None:
+                    request_headers = validators.headers(post_id)
+                try:
+                    proxy_address = proxy_manager.get_proxy()
+                    proxies = {'http': f'http://{proxy_address}'}
+                    start_time = time.monotonic()
+                    response = session.get(
+                        url=post_url,
+                        proxies=proxies,
+                        timeout=timeout,
+                        headers=request_headers,
+                    )
+                    latency = time.monotonic() - start_time
+                    if limiter is not None:
+                        limiter.release(
+                            response.status_code,
+                            latency,
+                            parse_retry_after(
+                                response.headers.get('Retry-After')),
+                        )
+                        limiter = None
+                    status = handle_response(
+                        post_id=post_id,
+                        response_status=response.status_code,
+                        content=response.content,
+                        proxy_address=proxy_address,
+                        proxy_manager=proxy_manager,
+                        writer=writer,
+                        logger=logger,
+                        latency=latency,
+                        headers=response.headers,
+                        validators=validators,
+                    )
+
+                except NoProxyError as err:
+                    status = None
+                    logger.warning('No proxy for post "%s": %s', post_url,
+                                   str(err))
+                except requests.exceptions.RequestException as err:
+                    status = PostStatus.FAILED
+                    proxy_manager.report_failure(proxy_address)
+                    metrics.inc('crawler_responses_total',
+                                proxy=proxy_address,
+                                status='error')
+                    logger.error(
+                        'An error occurred while downloading post "%s": %s',
+                        post_url,
+                        str(err),
+                    )
+                if limiter is not None:
+                    limiter.release()
+
+                if status is None:
+                    # No request was sent, the post waits for a new proxy
+                    # list without losing an attempt
+                    retries.schedule(post_id, attempt, counted=False)
+                    continue
+
+                if retry_policy.should_retry(status, attempt):
+                    logger.info(
+                        'Post "%s" will be requested again, attempt %d of %d',
+                        post_url,
+                        attempt + 1,
+                        retry_policy.max_attempts,
+                    )
+                    retries.schedule(post_id, attempt)
+                    metrics.inc('crawler_retries_total')
+                    continue
+
+                metrics.inc('crawler_posts_total', status=status.name)
+                if manifest is not None:
+                    manifest.record(post_id, status)
+                if limiters is not None:
+                    progress_bar.set_postfix(limiters.describe(),
+                                             refresh=False)
+                progress_bar.update()
+
+            if progress_queue is not None:
+                progress_queue.put(len(chunk))
+
+    if manifest is not None:
+        manifest.close()
+    if validators is not None:
+        validators.close()
+    writer.close()
+
+
+class _ChunkTracker():
+    """
+    Hand out post IDs of chunks and due retries to async workers and report
+    a chunk as soon as every one of its posts has its final outcome.
+
+    Attributes:
+        post_chunks: Iterator over chunks of post IDs.
+        progress_queue: Queue where the size of every finished chunk is put.
+        retry_policy: Retry policy of failed posts.
+    """
+
+    def __init__(self,
+                 post_chunks: Iterable[Sequence[int]],
+                 progress_queue: Queue = None,
+                 retry_policy: RetryPolicy = None) -> None:
+        """
+        Init _ChunkTracker
+        """
+        self.post_chunks = iter(post_chunks)
+        self.progress_queue = progress_queue
+        if retry_policy is None:
+            retry_policy = RetryPolicy(max_attempts=1)
+        self.retry_policy = retry_policy
+        self._retries = RetryQueue(retry_policy)
+        self._post_ids = self._iter_post_ids()
+        self._chunk_sizes = {}
+        self._remaining = {}
+
+    def _iter_post_ids(self) -> Iterator[Tuple[int, int]]:
+        for chunk_number, chunk in enumerate(self.post_chunks):
+            if len(chunk) == 0:
+                continue
+            self._chunk_sizes[chunk_number] = len(chunk)
+            self._remaining[chunk_number] = len(chunk)
+            for post_id in chunk:
+                yield chunk_number, post_id
+
+    async def next(self) -> Optional[Tuple[int, int, int]]:
+        """
+        Return the next post, waiting for a retry to be due if there are
+        no new posts.
+
+        Returns:
+            (chunk_number, post_id, attempt) or None if no posts are left.
+        """
+        while True:
+            ready = self._retries.pop_ready()
+            if ready is not None:
+                (chunk_number, post_id), attempt = ready
+                return chunk_number, post_id, attempt
+            item = next(self._post_ids, None)
+            if item is not None:
+                return (*item, 1)
+            if len(self._retries) == 0:
+                return None
+            await asyncio.sleep(self._retries.wait_time())
+
+    def retry(self,
+              chunk_number: int,
+              post_id: int,
+              attempt: int,
+              counted: bool = True) -> None:
+        """
+        Schedule the next attempt of the post.
+
+        Args:
+            chunk_number: Number of the chunk the post belongs to.
+            post_id: ID of the post.
+            attempt: Number of the failed attempt.
+            counted: If False the post is requested again as the same
+            attempt.
+        """
+        self._retries.schedule((chunk_number, post_id), attempt, counted)
+
+    def done(self, chunk_number: int) -> None:
+        """
+        Mark one post of the chunk as processed.
+
+        Args:
+            chunk_number: Number of the chunk the post belongs to.
+        """
+        self._remaining[chunk_number] -= 1
+        if self._remaining[chunk_number] == 0:
+            del self._remaining[chunk_number]
+            chunk_size = self._chunk_sizes.pop(chunk_number)
+            if self.progress_queue is not None:
+                self.progress_queue.put(chunk_size)
+
+
+class _ProxyRequestError(Exception):
+    """
+    Request through the proxy failed without response.
+
+    Attributes:
+        proxy_address: Proxy used for the request.
+    """
+
+    def __init__(self, proxy_address: str, error: Exception) -> None:
+        """
+        Init _ProxyRequestError
+        """
+        super().__init__(str(error) or type(error).__name__)
+        self.proxy_address = proxy_address
+
+
+async def _request_post(
+        session: aiohttp.ClientSession,
+        post_url: str,
+        proxy_address: str,
+        headers: Mapping[str, str] = None
+) -> Tuple[int, Mapping[str, str], bytes, float]:
+    """
+    Request the post through the proxy.
+
+    Returns:
+        Response status code, response headers, response body and
+        response time in seconds, the body is only read if the post is
+        available.
+
+    Raises:
+        _ProxyRequestError: The request failed or timed out.
+    """
+    try:
+        start_time = time.monotonic()
+        async with session.get(
                 url=post_url,
+                proxy=f'http://{proxy_address}',
+                headers=headers,
+        ) as response:
+            content = None
+            if response.status == 200:
+                content = await response.read()
+            return (response.status, response.headers, content,
+                    time.monotonic() - start_time)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+        raise _ProxyRequestError(proxy_address, err) from err
+
+
+async def _request_post_hedged(
+        session: aiohttp.ClientSession,
+        post_url: str,
+        proxy_manager: ProxyManager,
+        hedge_delay: float = None,
+        headers: Mapping[str, str] = None) -> Tuple[str, Tuple]:
+    """
+    Request the post and send a second request through another proxy if
+    the first one takes longer than `hedge_delay`.
+
+    The first response wins and the other request is cancelled. Failures
+    of the proxies that did not win are reported to the proxy manager.
+
+    Args:
+        session: HTTP session with the shared connection pool.
+        post_url: URL of the post.
+        proxy_manager: Proxy manager of the running process.
+        hedge_delay: Time in seconds before the second request, no second
+        request is sent if None.
+        headers: Additional request headers.
+
+    Returns:
+        Proxy of the winning request and its response, see `_request_post`.
+
+    Raises:
+        _ProxyRequestError: All requests failed.
+        NoProxyError: No proxy is known.
+    """
+    proxy_address = proxy_manager.get_proxy()
+    if hedge_delay is None:
+        return proxy_address, await _request_post(session, post_url,
+                                                   proxy_address, headers)
+
+    tasks = {
+        asyncio.ensure_future(
+            _request_post(session, post_url, proxy_address, headers)):
+        proxy_address
+    }
+    done, pending = await asyncio.wait(tasks, timeout=hedge_delay)
+    if len(done) == 0:
+        try:
+            hedge_address = proxy_manager.get_proxy()
+        except NoProxyError:
+            hedge_address = proxy_address
+        if hedge_address != proxy_address:
+            metrics.inc('crawler_hedged_requests_total')
+            task = asyncio.ensure_future(
+                _request_post(session, post_url, hedge_address, headers))
+            tasks[task] = hedge_address
+            pending.add(task)
+
+    errors = []
+    try:
+        while len(done) > 0 or len(pending) > 0:
+            for task in done:
+                error = task.exception()
+                if error is None:
+                    for error in errors:
+                        proxy_manager.report_failure(error.proxy_address)
+                    return tasks[task], task.result()
+                if not isinstance(error, _ProxyRequestError):
+                    raise error
+                errors.append(error)
+            done = set()
+            if len(pending) > 0:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    for error in errors[:-1]:
+        proxy_manager.report_failure(error.proxy_address)
+    raise errors[-1]
+
+
+async def _download_posts_worker(post_ids: _ChunkTracker,
+                                 session: aiohttp.ClientSession,
+                                 proxy_manager: ProxyManager,
+                                 writer: PostWriter,
+                                 logger: Logger,
+                                 progress_bar: tqdm,
+                                 manifest: CrawlManifest = None,
+                                 limiters: HostLimiters = None,
+                                 latencies: LatencyTracker = None,
+                                 validators: PageValidators = None) -> None:
+    """
+    Download posts one by one while there are unclaimed post IDs or
+    pending retries.
+
+    Args:
+        post_ids: Post IDs shared by all workers of the process.
+        session: HTTP session with the shared connection pool.
+        proxy_manager: Proxy manager of the running process.
+        writer: Output of the downloaded posts.
+        logger: Logger used for logging.
+        progress_bar: Progress bar of the running process.
+        manifest: Manifest where download outcomes are recorded.
+        limiters: Adaptive limiters of requests in flight and request rate,
+        only the number of workers limits requests if None.
+        latencies: Latency percentile after which a hedged request is sent
+        through another proxy, requests are not hedged if None.
+        validators: Validators of the saved pages, see `handle_response`.
+    """
+    while True:
+        item = await post_ids.next()
+        if item is None:
+            return
+        chunk_number, post_id, attempt = item
+        post_url = writer.post_url.format(post_id=post_id)
+        limiter = None
+        if limiters is not None:
+            limiter = limiters.get(post_url)
+            await limiter.acquire()
+        hedge_delay = None
+        if latencies is not None:
+            hedge_delay = latencies.value()
+        request_headers = None
+        if validators is not None:
+            request_headers = validators.headers(post_id)
+        try:
+            start_time = time.monotonic()
+            proxy_address, response = await _request_post_hedged(
+                session, post_url, proxy_manager, hedge_delay,
+                request_headers)
+            response_status, headers, content, latency = response
+            if latencies is not None:
+                latencies.add(time.monotonic() - start_time)
+            if limiter is not None:
+                limiter.release(response_status, latency,
+                                parse_retry_after(headers.get('Retry-After')))
+                limiter = None
+            status = handle_response(
+                post_id=post_id,
+                response_status=response_status,
+                content=content,
+                proxy_address=proxy_address,
+                proxy_manager=proxy_manager,
+                writer=writer,
+                logger=logger,
+                latency=latency,
                 headers=headers,
-                proxies=proxies,
+                validators=validators,
             )
 
-            response_status = response.status_code
-            # Post is available
-            if response_status == 200:
-                html_text = html_filter(
-                    html_text=response.content,
-                    classes=[
-                        'tm-article-presenter__body', 'tm-article-author',
-                        'tm-article-blocks__comments'
-                    ],
-                )
-                with open(
-                        f'{path}/{post_id}.html',
-                        'w+',
-                        encoding='utf-8',
-                ) as file_:
-                    file_.write(html_text)
-                logger.info(
-                    'Post "%s" saved as %s/%s.html',
-                    post_url,
-                    path,
-                    post_id,
-                )
-            # Post is unavailable or deleted
-            elif response_status in (404, 403):
-                logger.info(
-                    ('Failed to download post "%s"; Post is not'
-                     ' available, response status code - %d'),
-                    post_url,
-                    response_status,
-                )
-            # Most likely problem with proxy
-            else:
-                proxy_manager.remove_proxy(proxy_address)
-                logger.info(
-                    ('Failed to download post "%s"; Response '
-                     'status code - %d'),
-                    post_url,
-                    response_status,
-                )
-
-        except requests.exceptions.RequestException as err:
+        except NoProxyError as err:
+            status = None
+            logger.warning('No proxy for post "%s": %s', post_url, str(err))
+        except _ProxyRequestError as err:
+            status = PostStatus.FAILED
+            proxy_manager.report_failure(err.proxy_address)
+            metrics.inc('crawler_responses_total',
+                        proxy=err.proxy_address,
+                        status='error')
             logger.error(
                 'An error occurred while downloading post "%s": %s',
                 post_url,
                 str(err),
             )
+        if limiter is not None:
+            limiter.release()
+
+        if status is None:
+            # No request was sent, the post waits for a new proxy list
+            # without losing an attempt
+            post_ids.retry(chunk_number, post_id, attempt, counted=False)
+            continue
+
+        if post_ids.retry_policy.should_retry(status, attempt):
+            logger.info(
+                'Post "%s" will be requested again, attempt %d of %d',
+                post_url,
+                attempt + 1,
+                post_ids.retry_policy.max_attempts,
+            )
+            post_ids.retry(chunk_number, post_id, attempt)
+            metrics.inc('crawler_retries_total')
+            continue
+
+        metrics.inc('crawler_posts_total', status=status.name)
+        if manifest is not None:
+            manifest.record(post_id, status)
+        if limiters is not None:
+            progress_bar.set_postfix(limiters.describe(), refresh=False)
+        progress_bar.update()
+        post_ids.done(chunk_number)
+
+
+async def _download_posts_async(post_chunks: Iterable[Sequence[int]],
+                                process_number: int,
+                                proxy_manager: ProxyManager,
+                                writer: PostWriter,
+                                concurrency: int,
+                                logger: Logger,
+                                manifest: CrawlManifest = None,
+                                progress_queue: Queue = None,
+                                limiters: HostLimiters = None,
+                                retry_policy: RetryPolicy = None,
+                                timeout: float = 30.0,
+                                hedge_percentile: float = None,
+                                validators: PageValidators = None) -> None:
+    """
+    Run `concurrency` download workers over one keep-alive connection pool.
+
+    Args:
+        post_chunks: Chunks of IDs of the posts to be downloaded.
+        process_number: Running process number.
+        proxy_manager: Proxy manager of the running process.
+        writer: Output of the downloaded posts.
+        concurrency: The maximum number of requests in flight.
+        logger: Logger used for logging.
+        manifest: Manifest where download outcomes are recorded.
+        progress_queue: Queue where the size of every finished chunk is put.
+        limiters: Adaptive limiters, the number of requests in flight is
+        kept below `concurrency` by them.
+        retry_policy: Retry policy of failed posts, posts are requested
+        once if None.
+        timeout: Total time limit of a request in seconds.
+        hedge_percentile: Latency percentile after which a second request
+        is sent through another proxy, requests are not hedged if None.
+        validators: Validators of the saved pages, see `handle_response`.
+    """
+    post_ids = _ChunkTracker(post_chunks, progress_queue, retry_policy)
+    latencies = None
+    if hedge_percentile is not None:
+        latencies = LatencyTracker(hedge_percentile)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(
+            connector=connector,
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+    ) as session:
+        with tqdm(
+                desc=f'{process_number:2}',
+                position=(process_number + 1),
+                leave=False,
+        ) as progress_bar:
+            exchange = None
+            if isinstance(proxy_manager, CachedProxyPool):
+                await proxy_manager.sync()
+                exchange = asyncio.ensure_future(proxy_manager.run())
+            try:
+                await asyncio.gather(*[
+                    _download_posts_worker(post_ids, session, proxy_manager,
+                                           writer, logger, progress_bar,
+                                           manifest, limiters, latencies,
+                                           validators)
+                    for _ in range(concurrency)
+                ])
+            finally:
+                if exchange is not None:
+                    exchange.cancel()
+                    await proxy_manager.sync()
+
+
+def download_posts_async(post_chunks: Iterable[Sequence[int]],
+                         process_number: int,
+                         proxies: List[str] = None,
+                         path: str = None,
+                         debug: bool = False,
+                         manifest_path: str = None,
+                         progress_queue: Queue = None,
+                         concurrency: int = 100,
+                         archive: bool = False,
+                         page_queue: Queue = None,
+                         proxy_pool: ProxyManager = None,
+                         limiters: HostLimiters = None,
+                         retry_policy: RetryPolicy = None,
+                         timeout: float = 30.0,
+                         hedge_percentile: float = None,
+                         validators_path: str = None,
+                         refresh: bool = False,
+                         post_url: str = POST_URL) -> None:
+    """
+    Download posts data from https://habr.com keeping up to `concurrency`
+    requests in flight over pooled keep-alive connections.
+
+    Args:
+        post_chunks: Chunks of IDs of the posts to be downloaded.
+        process_number: Running process number.
+        proxies: Initial proxy list.
+        path: Directory where posts are downloaded, html is not saved if
+        None.
+        debug: If True setting log level to DEBUG, INFO otherwise.
+        manifest_path: Directory of the crawl manifest, download outcomes
+        are not recorded if None.
+        progress_queue: Queue where the size of every finished chunk is put.
+        concurrency: The maximum number of requests in flight.
+        archive: If True `path` is an html archive where posts are saved.
+        page_queue: Queue where (post_id, html) of every post is put.
+        proxy_pool: Proxy pool shared by all processes, a process-local
+        proxy manager with `proxies` is used if None.
+        limiters: Adaptive limiters of requests in flight and request rate,
+        `concurrency` requests are kept in flight if None.
+        retry_policy: Retry policy of failed posts, posts are requested
+        once if None.
+        timeout: Total time limit of a request in seconds.
+        hedge_percentile: Latency percentile after which a second request
+        is sent through another proxy, requests are not hedged if None.
+        validators_path: Directory where validators of the saved pages are
+        recorded, not recorded if None.
+        refresh: If True send conditional requests for the pages with
+        validators and only write changed pages.
+        post_url: URL template of the posts with a `{post_id}` field.
+    """
+    logger = logging.get_logger(
+        filename=f'crawler_{process_number}',
+        debug=debug,
+    )
+    if proxy_pool is None:
+        proxy_manager = ProxyManager(logger=logger, proxies=proxies)
+    else:
+        # Calls of the shared pool must not block the event loop
+        proxy_manager = CachedProxyPool(proxy_pool)
+    manifest = None
+    if manifest_path is not None:
+        manifest = CrawlManifest(manifest_path, f'crawler_{process_number}')
+    writer = PostWriter(path, logger, process_number, archive, page_queue,
+                        post_url)
+    validators = open_validators(validators_path, process_number, refresh)
+
+    asyncio.run(
+        _download_posts_async(
+            post_chunks=post_chunks,
+            process_number=process_number,
+            proxy_manager=proxy_manager,
+            writer=writer,
+            concurrency=max(1, concurrency),
+            logger=logger,
+            manifest=manifest,
+            progress_queue=progress_queue,
+            limiters=limiters,
+            retry_policy=retry_policy,
+            timeout=timeout,
+            hedge_percentile=hedge_percentile,
+            validators=validators,
+        ))
+
+    if manifest is not None:
+        manifest.close()
+    if validators is not None:
+        validators.close()
+    writer.close()
+
+
+def crawl_worker(chunk_queue: Queue,
+                 progress_queue: Queue,
+                 process_number: int,
+                 proxies: List[str] = None,
+                 path: str = None,
+                 debug: bool = False,
+                 manifest_path: str = None,
+                 engine: str = 'sync',
+                 concurrency: int = 100,
+                 archive: bool = False,
+                 page_queue: Queue = None,
+                 proxy_pool: ProxyManager = None,
+                 adaptive: bool = False,
+                 rate: float = 10.0,
+                 max_attempts: int = 3,
+                 timeout: float = 30.0,
+                 hedge_percentile: float = None,
+                 metrics_queue: Queue = None,
+                 log_queue: Queue = None,
+                 log_sample: int = 1,
+                 validators_path: str = None,
+                 refresh: bool = False,
+                 post_url: str = POST_URL) -> None:
+    """
+    Download chunks of posts taken from the shared queue until it is empty.
+
+    Args:
+        chunk_queue: Queue of post ID chunks shared by all processes.
+        progress_queue: Queue where the size of every finished chunk is put.
+        process_number: Running process number.
+        proxies: Initial proxy list.
+        path: Directory where posts are downloaded.
+        debug: If True setting log level to DEBUG, INFO otherwise.
+        manifest_path: Directory of the crawl manifest, download outcomes
+        are not recorded if None.
+        engine: 'sync' or 'async' crawler engine.
+        concurrency: The maximum number of requests in flight, only used
+        by the 'async' engine.
+        archive: If True `path` is an html archive where posts are saved.
+        page_queue: Queue where (post_id, html) of every post is put.
+        proxy_pool: Proxy pool shared by all processes.
+        adaptive: If True adapt the number of requests in flight and the
+        request rate of every host to the responses.
+        rate: Initial request rate per second of every host.
+        max_attempts: The maximum number of attempts to download a post.
+        timeout: Request timeout in seconds.
+        hedge_percentile: Latency percentile after which a second request
+        is sent through another proxy, only used by the 'async' engine.
+        metrics_queue: Queue of the metrics collector, metrics are not
+        recorded if None.
+        log_queue: Queue of the log listener, the log file is written
+        directly if None.
+        log_sample: Keep one of `log_sample` info and debug log records.
+        validators_path: Directory where validators of the saved pages are
+        recorded, not recorded if None.
+        refresh: If True send conditional requests for the pages with
+        validators and only write changed pages.
+        post_url: URL template of the posts with a `{post_id}` field.
+    """
+    metrics.configure(metrics_queue)
+    logging.configure(log_queue, log_sample)
+    post_chunks = iter_chunks(chunk_queue)
+    retry_policy = RetryPolicy(max_attempts=max_attempts)
+    limiters = None
+    if adaptive:
+        limiters = HostLimiters(
+            max_concurrency=max(1, concurrency),
+            initial_concurrency=min(8, max(1, concurrency)),
+            initial_rate=rate,
+        )
+    try:
+        if engine == 'async':
+            download_posts_async(post_chunks, process_number, proxies, path,
+                                 debug, manifest_path, progress_queue,
+                                 concurrency, archive, page_queue,
+                                 proxy_pool, limiters, retry_policy, timeout,
+                                 hedge_percentile, validators_path, refresh,
+                                 post_url)
+        else:
+            download_posts(post_chunks, process_number, proxies, path, debug,
+                           manifest_path, progress_queue, archive,
+                           page_queue, proxy_pool, limiters, retry_policy,
+                           timeout, validators_path, refresh, post_url)
+    finally:
+        metrics.flush(force=True)
+        logging.flush()
+
+
+def _crawl_pass(post_ids: Sequence[int],
+                chunk_size: int,
+                max_workers: int,
+                executor: ProcessPoolExecutor,
+                chunk_queue: Queue,
+                progress_queue: Queue,
+                progress_bar: tqdm,
+                worker_args: tuple) -> None:
+    first_indices, last_indices = subintervals.get_chunks(
+        left=0,
+        right=len(post_ids),
+        chunk_size=chunk_size,
+    )
+    max_workers = min(max_workers, len(first_indices))
+    for first_index, last_index in zip(first_indices, last_indices):
+        chunk_queue.put(post_ids[first_index:last_index])
+    for _ in range(max_workers):
+        chunk_queue.put(None)
+
+    futures = [
+        executor.submit(crawl_worker, chunk_queue, progress_queue, i,
+                        *worker_args) for i in range(max_workers)
+    ]
+    while not all(future.done() for future in futures):
+        try:
+            progress_bar.update(progress_queue.get(timeout=1))
+        except Empty:
+            pass
+    while not progress_queue.empty():
+        progress_bar.update(progress_queue.get())
+
+    # Chunks and sentinels left by a failed worker must not leak into the
+    # next pass
+    while True:
+        try:
+            chunk_queue.get_nowait()
+        except Empty:
+            break
+    for future in futures:
+        future.result()
 
 
 def crawl(first_id: int,
           last_id: int,
           max_workers: int = 1,
           path: str = 'data/unprocessed_posts',
-          debug: bool = False) -> None:
+          debug: bool = False,
+          engine: str = 'sync',
+          concurrency: int = 100,
+          manifest_path: str = 'data/crawl_manifest',
+          resume: bool = False,
+          chunk_size: int = 500,
+          archive: bool = False,
+          page_queue: Queue = None,
+          shared_proxies: bool = True,
+          adaptive: bool = False,
+          rate: float = 10.0,
+          max_attempts: int = 3,
+          timeout: float = 30.0,
+          hedge_percentile: float = None,
+          proxies: List[str] = None,
+          metrics_path: str = None,
+          metrics_queue: Queue = None,
+          log_sample: int = 1,
+          log_queue: Queue = None,
+          refresh_path: str = None,
+          max_age: float = None,
+          explore: bool = False,
+          block_size: int = 1000,
+          sample_every: int = 20,
+          min_density: float = 0.0,
+          post_url: str = POST_URL) -> None:
     """
     Crawl posts data from https://habr.com
 
+    The ID range is split into small chunks which are put into a shared
+    queue, every process takes the next chunk as soon as it is done with
+    the previous one, so no process stays idle until the queue is empty.
+
     Note:
         It is not recommended to set the value of the max_workers above 8.
 
@@ -146,39 +1146,160 @@ def crawl(first_id: int,
         last_id: ID of the last post to be crawled.
         max_workers: The maximum number of processes that will be used
         to crawling.
-        path: Directory where posts will be downloaded.
+        path: Directory where posts will be downloaded, html is not saved
+        if None.
         debug: If True setting log level to DEBUG, INFO otherwise.
+        engine: 'sync' to download posts one by one, 'async' to keep up
+        to `concurrency` requests in flight in every process.
+        concurrency: The maximum number of requests in flight per process,
+        only used by the 'async' engine.
+        manifest_path: Directory where download outcomes of every post
+        are recorded.
+        resume: If True skip posts that the manifest marks as saved or
+        gone, otherwise start a new manifest.
+        chunk_size: The number of post IDs in a chunk of work.
+        archive: If True append posts to compressed segments of the html
+        archive in `path` instead of saving every post as html file.
+        page_queue: `multiprocessing.Manager` queue where (post_id, html)
+        of every downloaded post is put.
+        shared_proxies: If True all processes use one proxy pool served by
+        a manager process, otherwise every process manages its own copy of
+        the proxy list.
+        adaptive: If True every process raises the number of requests in
+        flight (up to `concurrency`) and the request rate while responses
+        are fast and lowers them on 429/5xx responses or growing latency,
+        `Retry-After` headers pause requests to the host.
+        rate: Initial request rate per second of every process, only used
+        if `adaptive` is True.
+        max_attempts: The maximum number of attempts to download a post,
+        failed and throttled posts are requested again after exponentially
+        growing delays.
+        timeout: Request timeout in seconds, so a stuck proxy can not block
+        a worker.
+        hedge_percentile: If given, a second request is sent through
+        another proxy when the first one is slower than this percentile of
+        recent latencies, only used by the 'async' engine.
+        proxies: Initial proxy list, free proxies are scraped if None.
+        metrics_path: File where fetch latency, downloaded bytes, response
+        statuses per proxy and html filtering time of all processes are
+        written periodically in the Prometheus text format, a summary is
+        printed at the end.
+        metrics_queue: Queue of a metrics collector started by the caller,
+        `metrics_path` is not used if given.
+        log_sample: Keep one of `log_sample` info and debug records of the
+        crawling processes, warnings and errors are always kept.
+        log_queue: Queue of a log listener started by the caller. Crawling
+        processes send their records in batches to a listener thread of
+        the main process, which is started if None.
+        refresh_path: Processed posts (json files or a post store) to be
+        refreshed instead of crawling the ID range. Posts from `first_id`
+        up to `last_id` (no upper bound if None) are requested again, the
+        newest first, with `If-None-Match`/`If-Modified-Since` validators
+        of the saved pages, and only changed pages are saved. Outcomes are
+        recorded in the `refresh` subdirectory of `manifest_path`.
+        max_age: Only refresh posts published within `max_age` days.
+        explore: If True the ID range is crawled in two passes. Every
+        `sample_every`-th ID of the blocks that previous crawls know
+        little about is probed first, then the rest of the range is
+        crawled block by block, the blocks with the most available posts
+        first. Not used when refreshing.
+        block_size: The number of IDs in a block, only used if `explore`
+        is True.
+        sample_every: Distance between probed IDs, only used if `explore`
+        is True.
+        min_density: Blocks whose estimated share of available posts is
+        below this value are skipped, only used if `explore` is True.
+        post_url: URL template of the posts with a `{post_id}` field, a
+        local stand-in of the site can be crawled with it.
     """
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown crawler engine "{engine}"')
+
     freeze_support()  # for Windows
 
-    if not os.path.exists(path):
+    if path is not None and archive:
+        create_archive(path)
+    elif path is not None and not os.path.exists(path):
         os.makedirs(path)
 
-    max_workers = min(max_workers, last_id - first_id)
-    first_ids, last_ids = subintervals.get_subintervals(
-        left=first_id,
-        right=last_id,
-        n_intervals=max_workers,
-    )
+    # Validators of the saved pages are kept by every crawl
+    validators_path = f'{manifest_path}/{VALIDATORS_DIR}'
+    PageValidators.compact(validators_path)
+    if refresh_path is None:
+        post_ids = range(first_id, last_id)
+    else:
+        manifest_path = f'{manifest_path}/{REFRESH_DIR}'
+        post_ids = select_posts(refresh_path, first_id, last_id, max_age)
+
+    # Outcomes of the previous crawls guide the exploration of the range
+    explore = explore and refresh_path is None
+    history = CrawlManifest.load(manifest_path) if explore else None
+    if resume:
+        post_ids = CrawlManifest.pending(manifest_path, post_ids)
+    else:
+        CrawlManifest.clear(manifest_path)
+    if len(post_ids) == 0:
+        return
+
+    if explore:
+        passes = plan_passes(post_ids, manifest_path, history, block_size,
+                             sample_every, min_density)
+    else:
+        passes = iter([post_ids])
+    max_workers = min(max_workers, -(-len(post_ids) // chunk_size))
 
     logger = logging.get_logger(filename='clrawler_main', debug=debug)
-    proxy_manager = ProxyManager(logger=logger)
+    proxy_manager = ProxyManager(logger=logger, proxies=proxies)
     proxies = proxy_manager.proxies
 
-    with ProcessPoolExecutor(
+    with Manager() as manager, ExitStack() as stack, ProcessPoolExecutor(
             max_workers=max_workers,
             initargs=(RLock(), ),
             initializer=tqdm.set_lock,
     ) as executor:
+        # The pool manager process is only started when it is used
+        proxy_pool = None
+        if shared_proxies:
+            pool_manager = stack.enter_context(ProxyPoolManager())
+            proxy_pool = pool_manager.ProxyPool(proxies, debug)
+        collector = None
+        if metrics_queue is None and metrics_path is not None:
+            metrics_queue = manager.Queue()
+            collector = metrics.start_collector(metrics_queue, metrics_path)
+        listener = None
+        if log_queue is None:
+            log_queue = manager.Queue()
+            listener = logging.start_listener(log_queue)
+
+        chunk_queue = manager.Queue()
+        progress_queue = manager.Queue()
         with tqdm(
-                total=max_workers,
+                total=len(post_ids),
                 position=0,
                 desc=f'Running {max_workers} processes',
-        ) as process_bar:
-            futures = [
-                executor.submit(download_posts, first_ids[i], last_ids[i], i,
-                                proxies, path, debug)
-                for i in range(max_workers)
-            ]
-            for _ in as_completed(futures):
-                process_bar.update()
+        ) as progress_bar:
+            planned = 0
+            for pass_ids in passes:
+                planned += len(pass_ids)
+                _crawl_pass(pass_ids, chunk_size, max_workers, executor,
+                            chunk_queue, progress_queue, progress_bar,
+                            (proxies, path, debug, manifest_path, engine,
+                             concurrency, archive, page_queue, proxy_pool,
+                             adaptive, rate, max_attempts, timeout,
+                             hedge_percentile, metrics_queue, log_queue,
+                             log_sample, validators_path,
+                             refresh_path is not None, post_url))
+            if planned < len(post_ids):
+                logger.info('Skipped %d IDs of sparse blocks',
+                            len(post_ids) - planned)
+                progress_bar.total = planned
+                progress_bar.refresh()
+
+        if proxy_pool is not None:
+            logger.info('Proxy pool statistics: %s', proxy_pool.stats())
+        if collector is not None:
+            summary = metrics.stop_collector(collector)
+            logger.info(summary)
+            print(summary)
+        if listener is not None:
+            listener.stop()
@@ -0,0 +1,163 @@
+"""
+Ordering of the crawled ID range by the density of available posts
+"""
+from typing import Dict, Iterator, List, Mapping, Sequence
+
+from task_1.manifest import CrawlManifest, PostStatus
+
+# Outcomes of the posts that exist
+LIVE_STATUSES = (PostStatus.SAVED, PostStatus.UNCHANGED)
+
+
+class DensityMap():
+    """
+    Share of available posts in blocks of consecutive IDs estimated from
+    download outcomes.
+
+    The estimate of a block is smoothed towards the share over the whole
+    range, so a block with few known outcomes is neither taken for dead
+    nor for dense.
+
+    Attributes:
+        block_size: The number of IDs in a block.
+        prior_weight: The number of outcomes the share over the whole range
+        counts for in the estimate of a block.
+        live: The number of available posts of every block.
+        known: The number of available and gone posts of every block.
+        share: Share of available posts over the whole range.
+    """
+
+    def __init__(self,
+                 statuses: Mapping[int, PostStatus],
+                 block_size: int = 1000,
+                 prior_weight: float = 4.0) -> None:
+        """
+        Init DensityMap
+        """
+        self.block_size = block_size
+        self.prior_weight = prior_weight
+        self.live: Dict[int, int] = {}
+        self.known: Dict[int, int] = {}
+        for post_id, status in statuses.items():
+            if status not in LIVE_STATUSES and status != PostStatus.GONE:
+                continue
+            block = self.block(post_id)
+            self.known[block] = self.known.get(block, 0) + 1
+            if status in LIVE_STATUSES:
+                self.live[block] = self.live.get(block, 0) + 1
+
+        known = sum(self.known.values())
+        # Half of the IDs are available if nothing is known
+        self.share = sum(self.live.values()) / known if known > 0 else 0.5
+
+    def block(self, post_id: int) -> int:
+        """
+        Return the block number of the post ID.
+
+        Args:
+            post_id: ID of the post.
+        """
+        return post_id // self.block_size
+
+    def density(self, block: int) -> float:
+        """
+        Return the estimated share of available posts in the block.
+
+        Args:
+            block: Block number.
+        """
+        return ((self.live.get(block, 0) + self.share * self.prior_weight) /
+                (self.known.get(block, 0) + self.prior_weight))
+
+
+def sample_ids(post_ids: Sequence[int],
+               density_map: DensityMap,
+               sample_every: int = 20,
+               min_known: int = 10) -> List[int]:
+    """
+    Choose IDs probed before the rest of the range.
+
+    Every `sample_every`-th ID of the blocks with fewer than `min_known`
+    known outcomes is probed, so the density of every block is known
+    before the range is ordered.
+
+    Args:
+        post_ids: IDs to be crawled.
+        density_map: Densities known from the previous crawls.
+        sample_every: Distance between probed IDs.
+        min_known: Blocks with this number of known outcomes are not
+        probed.
+
+    Returns:
+        Probed IDs in ascending order.
+    """
+    return [
+        post_id for post_id in sorted(post_ids)
+        if post_id % sample_every == 0
+        and density_map.known.get(density_map.block(post_id), 0) < min_known
+    ]
+
+
+def order_ids(post_ids: Sequence[int],
+              density_map: DensityMap,
+              min_density: float = 0.0) -> List[int]:
+    """
+    Order IDs block by block, the densest blocks first.
+
+    Args:
+        post_ids: IDs to be crawled.
+        density_map: Densities of the blocks.
+        min_density: Blocks with a lower density are not crawled.
+
+    Returns:
+        IDs of the blocks with at least `min_density` density, densest
+        blocks first and ascending IDs within a block.
+    """
+    blocks: Dict[int, List[int]] = {}
+    for post_id in post_ids:
+        blocks.setdefault(density_map.block(post_id), []).append(post_id)
+
+    densities = {block: density_map.density(block) for block in blocks}
+    ordered = []
+    for block in sorted(blocks, key=lambda block: (-densities[block], block)):
+        if densities[block] < min_density:
+            continue
+        ordered.extend(sorted(blocks[block]))
+    return ordered
+
+
+def plan_passes(post_ids: Sequence[int],
+                manifest_path: str,
+                history: Mapping[int, PostStatus] = None,
+                block_size: int = 1000,
+                sample_every: int = 20,
+                min_density: float = 0.0) -> Iterator[List[int]]:
+    """
+    Split crawling into a probing pass and a pass over the rest of the IDs
+    ordered by density.
+
+    The second pass is planned when the next item is requested, after the
+    first pass has been crawled and its outcomes are in the manifest.
+
+    Args:
+        post_ids: IDs to be crawled.
+        manifest_path: Directory where outcomes of the crawl are recorded.
+        history: Outcomes of the previous crawls.
+        block_size: The number of IDs in a block.
+        sample_every: Distance between probed IDs.
+        min_density: Blocks with a lower density are not crawled.
+
+    Yields:
+        IDs of a crawling pass.
+    """
+    history = history or {}
+    probed = sample_ids(post_ids, DensityMap(history, block_size),
+                        sample_every)
+    if len(probed) > 0:
+        yield probed
+
+    statuses = {**history, **CrawlManifest.load(manifest_path)}
+    probed = set(probed)
+    rest = [post_id for post_id in post_ids if post_id not in probed]
+    if len(rest) > 0:
+        yield order_ids(rest, DensityMap(statuses, block_size), min_density)
@@ -0,0 +1,141 @@
+"""
+Manifest of extracted posts for incremental extracting
+"""
+import os
+import json
+import hashlib
+from typing import Callable, Dict, List, Tuple
+
+
+def file_hash(file_path: str) -> str:
+    """
+    Return SHA-1 hex digest of the file content.
+
+    Args:
+        file_path: Path to the file.
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file_:
+        for block in iter(lambda: file_.read(1 << 16), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class ExtractionManifest():
+    """
+    Source file size, modification time and hash of every extracted post
+    together with the extracter version that produced the output.
+
+    A post is current if its source file is unchanged, it was extracted
+    by the same extracter version and its saved output still exists. The
+    file hash is only computed when
+    the size or modification time differ from the recorded ones.
+
+    Attributes:
+        path: Path to the manifest json file.
+        version: Current extracter version.
+        files: Dictionary of source file name to its recorded
+        [size, mtime_ns, sha1, saved] entry.
+    """
+
+    def __init__(self, path: str, version: int) -> None:
+        """
+        Init ExtractionManifest
+        """
+        self.path = path
+        self.version = version
+        self.files = {}
+
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as file_:
+                manifest = json.load(file_)
+            # Outputs of another extracter version are all outdated
+            if manifest.get('version') == version:
+                self.files = manifest['files']
+
+    def stale_files(
+            self,
+            path_src: str,
+            file_names: List[str],
+            has_output: Callable[[str], bool] = None
+    ) -> List[Tuple[str, List]]:
+        """
+        Find source files whose output is missing or outdated.
+
+        Args:
+            path_src: Directory where unprocessed posts are stored.
+            file_names: Names of the source files.
+            has_output: Check that the saved output of the source file
+            exists, outputs are not checked if None.
+
+        Returns:
+            List of (file name, new manifest entry) pairs, the entry is
+            completed by `update` after extracting.
+        """
+        stale = []
+        for file_name in file_names:
+            file_path = f'{path_src}/{file_name}'
+            stat = os.stat(file_path)
+            entry = self.files.get(file_name)
+            sha1 = None
+            current = (entry is not None and entry[0] == stat.st_size
+                       and entry[1] == stat.st_mtime_ns)
+            if not current and entry is not None:
+                sha1 = file_hash(file_path)
+                if entry[2] == sha1:
+                    # Touched but not changed, output is still current
+                    entry[0], entry[1] = stat.st_size, stat.st_mtime_ns
+                    current = True
+            # Saved output may have been deleted since
+            if current and (not entry[3] or has_output is None
+                            or has_output(file_name)):
+                continue
+
+            if sha1 is None:
+                sha1 = file_hash(file_path)
+            stale.append((file_name, [stat.st_size, stat.st_mtime_ns, sha1]))
+
+        return stale
+
+    def removed_files(self, file_names: List[str]) -> List[str]:
+        """
+        Find recorded source files that no longer exist.
+
+        Args:
+            file_names: Names of the current source files.
+        """
+        file_names = set(file_names)
+        return [
+            file_name for file_name in self.files
+            if file_name not in file_names
+        ]
+
+    def update(self, file_name: str, entry: List, saved: bool) -> None:
+        """
+        Record the extracted source file.
+
+        Args:
+            file_name: Name of the source file.
+            entry: Entry returned by `stale_files`.
+            saved: True if the post was valid and saved.
+        """
+        self.files[file_name] = entry[:3] + [saved]
+
+    def remove(self, file_name: str) -> None:
+        """
+        Forget the source file.
+
+        Args:
+            file_name: Name of the source file.
+        """
+        self.files.pop(file_name, None)
+
+    def save(self) -> None:
+        """
+        Atomically write the manifest to disk.
+        """
+        manifest: Dict = {'version': self.version, 'files': self.files}
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file_:
+            json.dump(manifest, file_)
+        os.replace(tmp_path, self.path)
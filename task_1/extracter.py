@@ -3,13 +3,38 @@ Post processing for data extracting
 """
 import os
 import re
+import sys
 import json
-from typing import Dict, List
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, TypeVar
 from pathlib import Path
+from functools import partial
+from queue import Queue
+from multiprocessing import Manager
+from multiprocessing.util import Finalize
+from concurrent.futures import ProcessPoolExecutor
 
 from bs4 import BeautifulSoup
 from tqdm.auto import tqdm
 
+from task_1.extract_manifest import ExtractionManifest
+from task_1.post_store import PostStore
+from task_1.html_archive import HtmlArchiveReader, is_archive
+from utils import metrics
+from utils.normalizer import clean_text
+
+T = TypeVar('T')
+ENGINES = ('bs4', 'lxml')
+OUTPUT_FORMATS = ('json', 'store')
+# Increase when the format of processed posts changes
+EXTRACTER_VERSION = 2
+MANIFEST_NAME = '.manifest.json'
+# Chunks of files submitted to a process ahead of the consumed results
+MAX_CHUNKS_PER_WORKER = 2
+
+# Html archives opened by the process, see `get_archive`
+_archives = {}
+
 
 def validate_post(post: Dict) -> bool:
     """
@@ -23,30 +48,6 @@ def validate_post(post: Dict) -> bool:
     return True
 
 
-def clean_text(text: str) -> str:
-    """
-    Removes punctuation marks, special characters, extra spaces and urls.
-
-    Args:
-        text: Text to clean up.
-
-    Returns:
-        Clean text.
-    """
-    # Remove everything except letters and digits
-    text = re.sub(r'-', '', text)
-    text = re.sub(r'[^\w\s]+', ' ', text)
-    # Remove all numbers
-    text = re.sub(r'\s\d+\s', ' ', text)
-    # Remove all urls
-    text = re.sub(
-        (r'(http|ftp|https):\/\/([\w_-]+(?:(?:\.[\w_-]+)+))([\w.,@?^=%&:\/~'
-         '+#-]*[\w@?^=%&\/~+#-])'), '', text)
-    # Remove all extra spaces
-    text = re.sub(r'\s+', ' ', text)
-    return text
-
-
 def filter_post_html(post_soup: BeautifulSoup) -> None:
     """
     Remove <code> and <img> tags from post html tree.
@@ -124,7 +125,17 @@ def extract_comments_count(post_soup: BeautifulSoup) -> int:
         'span', {'class': 'tm-article-comments-counter-link__value'})
     if comments_count_element is None:
         return 0
-    comments_count = re.sub(r'[^\d]+', '', comments_count_element.text)
+    return parse_comments_count(comments_count_element.text)
+
+
+def parse_comments_count(comments_count: str) -> int:
+    """
+    Convert comments counter text to number.
+
+    Args:
+        comments_count: Comments counter text, e.g. 'Комментарии 12'.
+    """
+    comments_count = re.sub(r'[^\d]+', '', comments_count)
     if comments_count == '':
         return 0
     return int(comments_count)
@@ -140,6 +151,16 @@ def extract_watch_count(post_soup: BeautifulSoup) -> int:
     watch_count = post_soup.find('span', {
         'class': 'tm-icon-counter__value'
     }).text
+    return parse_watch_count(watch_count)
+
+
+def parse_watch_count(watch_count: str) -> int:
+    """
+    Convert watch counter text to number.
+
+    Args:
+        watch_count: Watch counter text, e.g. '12K' or '1.5M'.
+    """
     is_thousands = 'K' in watch_count
     is_millions = 'M' in watch_count
     is_floating = '.' in watch_count
@@ -230,6 +251,21 @@ def extract_user_data(post_soup: BeautifulSoup) -> Dict:
     }
 
 
+# (post field, extracting function) in the order of post fields
+FIELD_EXTRACTORS = (
+    ('title', extract_title),
+    ('datetime', extract_datetime),
+    ('rating', extract_rating),
+    ('bookmarksCount', extract_bookmarks_count),
+    ('watchCount', extract_watch_count),
+    ('commentsCount', extract_comments_count),
+    ('content', extract_content),
+    ('tags', extract_tags),
+    ('habs', extract_habs),
+    ('user', extract_user_data),
+)
+
+
 def extract_post_data(file_path: str) -> Dict:
     """
     Extract post data.
@@ -243,55 +279,415 @@ def extract_post_data(file_path: str) -> Dict:
     post_id = Path(file_path).stem
 
     with open(file_path, encoding='utf-8') as file_:
+        return extract_post_data_from_html(file_.read(), post_id)
+
+
+def extract_post_data_from_html(html_text: str, post_id: str) -> Dict:
+    """
+    Extract post data.
+
+    Args:
+        html_text: Post html.
+        post_id: ID of the post.
+
+    Returns:
+        Dictionary of extracted post data.
+    """
+    with metrics.timer('extracter_parse_seconds', engine='bs4'):
         post_soup = BeautifulSoup(
-            markup=file_,
+            markup=html_text,
             features='lxml',
         )
         filter_post_html(post_soup)
-        return {
-            'id': post_id,
-            'url': f'https://habr.com/ru/post/{post_id}/',
-            'title': extract_title(post_soup),
-            'datetime': extract_datetime(post_soup),
-            'rating': extract_rating(post_soup),
-            'bookmarksCount': extract_bookmarks_count(post_soup),
-            'watchCount': extract_watch_count(post_soup),
-            'commentsCount': extract_comments_count(post_soup),
-            'content': extract_content(post_soup),
-            'tags': extract_tags(post_soup),
-            'habs': extract_habs(post_soup),
-            'user': extract_user_data(post_soup),
-        }
+
+    post = {
+        'id': post_id,
+        'url': f'https://habr.com/ru/post/{post_id}/',
+    }
+    for field, extract_field in FIELD_EXTRACTORS:
+        with metrics.timer('extracter_field_seconds', field=field):
+            post[field] = extract_field(post_soup)
+    return post
+
+
+def get_extractor(engine: str = 'bs4', from_html: bool = False) -> Callable:
+    """
+    Return post data extracting function of the engine.
+
+    Args:
+        engine: 'bs4' for BeautifulSoup based extracting, 'lxml' for the
+        single pass lxml based one.
+        from_html: If True return the function that takes post html and
+        post ID instead of post html file path.
+
+    Returns:
+        Function that returns post data.
+    """
+    if engine == 'bs4':
+        module = sys.modules[__name__]
+    elif engine == 'lxml':
+        # Imported here because lxml_extracter depends on this module
+        from task_1 import lxml_extracter
+        module = lxml_extracter
+    else:
+        raise ValueError(f'Unknown extracter engine "{engine}"')
+
+    if from_html:
+        return module.extract_post_data_from_html
+    return module.extract_post_data
+
+
+def get_archive(path: str) -> HtmlArchiveReader:
+    """
+    Return the html archive reader, opened once per process.
+
+    Args:
+        path: Directory of the html archive.
+    """
+    if path not in _archives:
+        _archives[path] = HtmlArchiveReader(path)
+    return _archives[path]
+
+
+def close_archives() -> None:
+    """
+    Close the html archive readers opened by `get_archive`.
+    """
+    for archive in _archives.values():
+        archive.close()
+    _archives.clear()
+
+
+def save_post_data(post: Dict, path_dest: str) -> None:
+    """
+    Save post data as `{path_dest}/{post_id}.json`.
+
+    Args:
+        post: Dictionary of extracted post data.
+        path_dest: Directory where processed posts will be saved.
+    """
+    post_id = post['id']
+
+    try:
+        with metrics.timer('extracter_write_seconds', format='json'), open(
+                f'{path_dest}/{post_id}.json', 'w+',
+                encoding='utf-8') as file_p:
+            json.dump(
+                obj=post,
+                fp=file_p,
+                sort_keys=True,
+                indent=4,
+                ensure_ascii=False,
+            )
+    except OSError:
+        pass # Antiivrus blocked some files
+
+
+def extract_valid_post(file_path: str,
+                       engine: str = 'bs4',
+                       archive_path: str = None) -> Optional[Dict]:
+    """
+    Extract post data from the html file.
+
+    Args:
+        file_path: Path to the post html file or post ID if `archive_path`
+        is given.
+        engine: Extracter engine, see `get_extractor`.
+        archive_path: Directory of the html archive the post is read from.
+
+    Returns:
+        Dictionary of extracted post data or None if the post is invalid.
+    """
+    with metrics.timer('extracter_extract_seconds', engine=engine):
+        if archive_path is None:
+            post = get_extractor(engine)(file_path)
+        else:
+            html_text = get_archive(archive_path).get(file_path)
+            post = get_extractor(engine, from_html=True)(html_text,
+                                                         str(file_path))
+
+    if not validate_post(post):
+        metrics.inc('extracter_posts_total', status='invalid')
+        return None
+    metrics.inc('extracter_posts_total', status='valid')
+    return post
+
+
+def process_post_file(file_path: str,
+                      path_dest: str,
+                      engine: str = 'bs4',
+                      archive_path: str = None) -> bool:
+    """
+    Extract post data from the html file and save it if the post is valid.
+
+    Args:
+        file_path: Path to the post html file or post ID if `archive_path`
+        is given.
+        path_dest: Directory where processed posts will be saved.
+        engine: Extracter engine, see `get_extractor`.
+        archive_path: Directory of the html archive the post is read from.
+
+    Returns:
+        True if the post was saved, False otherwise.
+    """
+    post = extract_valid_post(file_path, engine, archive_path)
+
+    if post is None:
+        return False
+
+    save_post_data(post, path_dest)
+    return True
+
+
+def _init_worker(metrics_queue: Optional[Queue]) -> None:
+    metrics.configure(metrics_queue)
+    # Archive memory maps of the process are closed when it exits
+    Finalize(None, close_archives, exitpriority=10)
+
+
+def _map_chunk(func: Callable[[str], T], file_paths: List[str]) -> List[T]:
+    return [func(file_path) for file_path in file_paths]
+
+
+def map_post_files(func: Callable[[str], T],
+                   file_paths: List[str],
+                   workers: int = 1,
+                   chunk_size: int = 64) -> Iterator[T]:
+    """
+    Apply the function to every post html file.
+
+    Args:
+        func: Function that takes post html file path.
+        file_paths: Paths to the post html files.
+        workers: The number of processes used for extracting.
+        chunk_size: The number of files sent to a process at a time, at
+        most `MAX_CHUNKS_PER_WORKER` chunks per process are in flight.
+
+    Yields:
+        Function results in order of files.
+    """
+    if workers <= 1:
+        for file_path in file_paths:
+            yield func(file_path)
+        return
+
+    # Workers send metrics to the collector of the current process
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(metrics.get_queue(), ),
+    ) as executor:
+        # Only a few chunks per process are in flight, so the results
+        # waiting to be consumed do not grow with the number of files
+        futures = deque()
+        for start in range(0, len(file_paths), chunk_size):
+            if len(futures) >= MAX_CHUNKS_PER_WORKER * workers:
+                yield from futures.popleft().result()
+            futures.append(
+                executor.submit(_map_chunk, func,
+                                file_paths[start:start + chunk_size]))
+        while futures:
+            yield from futures.popleft().result()
+
+
+def process_post_files(file_paths: List[str],
+                       path_dest: str,
+                       workers: int = 1,
+                       chunk_size: int = 64,
+                       engine: str = 'bs4',
+                       store: PostStore = None,
+                       archive_path: str = None) -> Iterator[bool]:
+    """
+    Extract and save posts from the html files.
+
+    Args:
+        file_paths: Paths to the post html files or post IDs if
+        `archive_path` is given.
+        path_dest: Directory where processed posts will be saved as json
+        files, not used if `store` is given.
+        workers: The number of processes used for extracting.
+        chunk_size: The number of files sent to a process at a time.
+        engine: Extracter engine, see `get_extractor`.
+        store: Post store where processed posts will be saved.
+        archive_path: Directory of the html archive posts are read from.
+
+    Yields:
+        True if the post was saved, False otherwise, in order of files.
+    """
+    if store is None:
+        # Workers save posts themselves and only send back a flag, so
+        # memory usage does not depend on the number of posts
+        yield from map_post_files(
+            partial(process_post_file,
+                    path_dest=path_dest,
+                    engine=engine,
+                    archive_path=archive_path),
+            file_paths,
+            workers,
+            chunk_size,
+        )
+        return
+
+    for post in map_post_files(
+            partial(extract_valid_post,
+                    engine=engine,
+                    archive_path=archive_path),
+            file_paths,
+            workers,
+            chunk_size,
+    ):
+        if post is not None:
+            with metrics.timer('extracter_write_seconds', format='store'):
+                store.append(post)
+        yield post is not None
+
+
+def remove_post_data(post_id: str,
+                     path_dest: str,
+                     store: PostStore = None) -> None:
+    """
+    Remove saved post data if it exists.
+
+    Args:
+        post_id: ID of the post.
+        path_dest: Directory where processed posts are saved as json files,
+        not used if `store` is given.
+        store: Post store where processed posts are saved.
+    """
+    if store is not None:
+        store.delete(post_id)
+        return
+
+    file_path = f'{path_dest}/{post_id}.json'
+    if os.path.exists(file_path):
+        os.remove(file_path)
 
 
 def extract_posts_data(path_src: str = 'data/unprocessed_posts',
-                       path_dest: str = 'data/processed_posts') -> None:
+                       path_dest: str = 'data/processed_posts',
+                       workers: int = 1,
+                       chunk_size: int = 64,
+                       engine: str = 'bs4',
+                       incremental: bool = False,
+                       output_format: str = 'json',
+                       metrics_path: str = None) -> None:
     """
     Args:
-        path_src: Directory where unprocessed posts are stored.
-        path_dest: Directory where processed posts will be saved. 
+        path_src: Directory where unprocessed posts are stored as html files
+        or html archive written by the crawler.
+        path_dest: Directory where processed posts will be saved.
+        workers: The number of processes used for extracting, posts are
+        processed in the current process if 1.
+        chunk_size: The number of files sent to a process at a time.
+        engine: 'bs4' for BeautifulSoup based extracting, 'lxml' for the
+        faster single pass lxml based one, both give the same output.
+        incremental: If True only extract posts which are new or changed
+        since the previous incremental run and remove processed posts
+        whose html file disappeared.
+        output_format: 'json' to save every post as `{post_id}.json` file,
+        'store' to save posts to a `PostStore` in `path_dest`.
+        metrics_path: File where extracting metrics are written in the
+        Prometheus text format, not collected if None.
     """
+    get_extractor(engine)  # Fail early on unknown engine
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output format "{output_format}"')
+
     if not os.path.exists(path_dest):
         os.makedirs(path_dest)
 
-    for file_ in tqdm(os.listdir(path_src)):
-        if file_.endswith('.html'):
-            post = extract_post_data(f'{path_src}/{file_}')
-
-            if not validate_post(post):
-                continue
-
-            post_id = post['id']
-
-            try:
-                with open(f'{path_dest}/{post_id}.json', 'w+',
-                        encoding='utf-8') as file_p:
-                    json.dump(
-                        obj=post,
-                        fp=file_p,
-                        sort_keys=True,
-                        indent=4,
-                        ensure_ascii=False,
-                    )
-            except OSError:
-                pass # Antiivrus blocked some files
+    manager = None
+    collector = None
+    if metrics_path is not None:
+        manager = Manager()
+        collector = metrics.start_collector(manager.Queue(), metrics_path)
+
+    store = None
+    if output_format == 'store':
+        store = PostStore(path_dest)
+    try:
+        _extract_posts_data(path_src, path_dest, workers, chunk_size, engine,
+                            incremental, store)
+    finally:
+        close_archives()
+        if store is not None:
+            store.close()
+        if collector is not None:
+            print(metrics.stop_collector(collector))
+            manager.shutdown()
+
+
+def _has_output(path_dest: str, store: Optional[PostStore],
+                file_name: str) -> bool:
+    """
+    Check that the processed post of the source file is saved.
+    """
+    post_id = Path(file_name).stem
+    if store is not None:
+        return post_id in store
+    return os.path.exists(f'{path_dest}/{post_id}.json')
+
+
+def _extract_posts_data(path_src: str, path_dest: str, workers: int,
+                        chunk_size: int, engine: str, incremental: bool,
+                        store: Optional[PostStore]) -> None:
+    """
+    Extract posts, see `extract_posts_data`.
+    """
+    if is_archive(path_src):
+        if incremental:
+            raise ValueError(
+                'Incremental extracting of html archive is not supported')
+        with HtmlArchiveReader(path_src) as archive:
+            post_ids = archive.ids()
+        for _ in tqdm(
+                process_post_files(post_ids, path_dest, workers, chunk_size,
+                                   engine, store, path_src),
+                total=len(post_ids),
+        ):
+            pass
+        return
+
+    file_names = [
+        file_ for file_ in os.listdir(path_src) if file_.endswith('.html')
+    ]
+
+    if not incremental:
+        file_paths = [f'{path_src}/{file_}' for file_ in file_names]
+        for _ in tqdm(
+                process_post_files(file_paths, path_dest, workers,
+                                   chunk_size, engine, store),
+                total=len(file_paths),
+        ):
+            pass
+        return
+
+    manifest = ExtractionManifest(
+        path=f'{path_dest}/{MANIFEST_NAME}',
+        version=EXTRACTER_VERSION,
+    )
+    for file_name in manifest.removed_files(file_names):
+        remove_post_data(Path(file_name).stem, path_dest, store)
+        manifest.remove(file_name)
+
+    stale = manifest.stale_files(path_src, file_names,
+                                 partial(_has_output, path_dest, store))
+    file_paths = [f'{path_src}/{file_name}' for file_name, _ in stale]
+    try:
+        for (file_name, entry), saved in tqdm(
+                zip(
+                    stale,
+                    process_post_files(file_paths, path_dest, workers,
+                                       chunk_size, engine, store),
+                ),
+                total=len(stale),
+        ):
+            # Changed post may have become invalid
+            if not saved:
+                remove_post_data(Path(file_name).stem, path_dest, store)
+            manifest.update(file_name, entry, saved)
+    finally:
+        # Keep the progress of an interrupted run
+        if store is not None:
+            store.flush()
+        manifest.save()
@@ -0,0 +1,232 @@
+"""
+Compressed archive of downloaded post html pages
+"""
+import os
+import re
+import zlib
+from collections import Counter
+from typing import Iterable, Iterator, List, Tuple
+
+from task_1.post_store import RecordStore
+
+DICTIONARY_NAME = 'dictionary.bin'
+DEFAULT_DICTIONARY_PATH = os.path.join(os.path.dirname(__file__),
+                                       'html_dictionary.txt')
+# zlib uses at most 32 KB of a preset dictionary
+MAX_DICTIONARY_SIZE = 32 * 1024
+
+
+def build_dictionary(html_texts: Iterable[str],
+                     size: int = MAX_DICTIONARY_SIZE,
+                     min_documents: int = 2) -> bytes:
+    """
+    Build a preset compression dictionary of the most common html tags.
+
+    Args:
+        html_texts: Sample html pages.
+        size: The maximum size of the dictionary in bytes.
+        min_documents: The minimum number of pages a tag must appear in.
+
+    Returns:
+        Dictionary with the most common tags at the end, where zlib finds
+        them with the shortest distances.
+    """
+    counter = Counter()
+    for html_text in html_texts:
+        counter.update(set(re.findall(r'<[^<>]{1,512}>', html_text)))
+
+    tags = []
+    dictionary_size = 0
+    for tag, documents in counter.most_common():
+        tag = tag.encode('utf-8')
+        if documents < min_documents:
+            break
+        if dictionary_size + len(tag) > size:
+            continue
+        tags.append(tag)
+        dictionary_size += len(tag)
+
+    return b''.join(reversed(tags))
+
+
+def create_archive(path: str, dictionary: bytes = None) -> None:
+    """
+    Create archive directory with the preset dictionary if it does not exist.
+
+    Args:
+        path: Directory of the archive.
+        dictionary: Preset compression dictionary, the default one built from
+        `examples/unprocessed_posts` is used if None.
+    """
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    dictionary_path = f'{path}/{DICTIONARY_NAME}'
+    if os.path.exists(dictionary_path):
+        return
+    if dictionary is None:
+        with open(DEFAULT_DICTIONARY_PATH, 'rb') as file_:
+            dictionary = file_.read()
+    with open(dictionary_path, 'wb') as file_:
+        file_.write(dictionary[-MAX_DICTIONARY_SIZE:])
+
+
+def is_archive(path: str) -> bool:
+    """
+    Check that the directory is an html archive.
+
+    Args:
+        path: Directory to check.
+    """
+    return os.path.exists(f'{path}/{DICTIONARY_NAME}')
+
+
+def _load_dictionary(path: str) -> bytes:
+    with open(f'{path}/{DICTIONARY_NAME}', 'rb') as file_:
+        return file_.read()
+
+
+class HtmlArchive(RecordStore):
+    """
+    Html pages written by one process to the archive.
+
+    Every page is compressed separately with the preset dictionary of the
+    archive, so any page can be read without decompressing others. Pages
+    are appended to rotating segment files with an ID index, see
+    `RecordStore`.
+
+    Attributes:
+        path: Directory of the pages written by the process.
+        max_shard_size: The maximum size of a segment file in bytes.
+        compress_level: zlib compression level of pages.
+    """
+
+    def __init__(self,
+                 archive_path: str,
+                 writer: str,
+                 max_shard_size: int = 64 * 1024 * 1024,
+                 compress_level: int = 6) -> None:
+        """
+        Init HtmlArchive
+        """
+        super().__init__(f'{archive_path}/{writer}', max_shard_size)
+        self.compress_level = compress_level
+        self._dictionary = _load_dictionary(archive_path)
+
+    def __enter__(self) -> 'HtmlArchive':
+        return self
+
+    def put(self, post_id: int, html_text: str) -> None:
+        """
+        Add the post page.
+
+        Args:
+            post_id: ID of the post.
+            html_text: Post html.
+        """
+        compressor = zlib.compressobj(
+            level=self.compress_level,
+            zdict=self._dictionary,
+        )
+        data = compressor.compress(html_text.encode('utf-8'))
+        data += compressor.flush()
+        self.put_record(post_id, data)
+
+    def decode(self, data: bytes) -> str:
+        """
+        Decompress the page record.
+
+        Args:
+            data: Compressed page.
+        """
+        decompressor = zlib.decompressobj(zdict=self._dictionary)
+        data = decompressor.decompress(data) + decompressor.flush()
+        return data.decode('utf-8')
+
+    def get(self, post_id: int) -> str:
+        """
+        Return the post page.
+
+        Args:
+            post_id: ID of the post.
+
+        Raises:
+            KeyError: The post is not in the archive.
+        """
+        return self.decode(self.get_record(post_id))
+
+
+class HtmlArchiveReader():
+    """
+    Read pages written to the archive by all processes.
+
+    If a page was written by several processes, the one from the most
+    recently modified index is used.
+
+    Attributes:
+        path: Directory of the archive.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Init HtmlArchiveReader
+        """
+        self.path = path
+        writers = [
+            writer for writer in os.listdir(path)
+            if os.path.exists(f'{path}/{writer}/index.bin')
+        ]
+        writers.sort(key=lambda writer: os.path.getmtime(
+            f'{path}/{writer}/index.bin'))
+
+        self._archives = [HtmlArchive(path, writer) for writer in writers]
+        self._owners = {}
+        for archive in self._archives:
+            for post_id in archive.ids():
+                self._owners[post_id] = archive
+
+    def __enter__(self) -> 'HtmlArchiveReader':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._owners)
+
+    def __contains__(self, post_id: int) -> bool:
+        return int(post_id) in self._owners
+
+    def __iter__(self) -> Iterator[Tuple[int, str]]:
+        """
+        Iterate over (post_id, html) of all pages in storage order.
+        """
+        for archive in self._archives:
+            for post_id, data in archive.iter_records():
+                if self._owners[post_id] is archive:
+                    yield post_id, archive.decode(data)
+
+    def ids(self) -> List[int]:
+        """
+        Return sorted IDs of archived posts.
+        """
+        return sorted(self._owners)
+
+    def get(self, post_id: int) -> str:
+        """
+        Return the post page.
+
+        Args:
+            post_id: ID of the post.
+
+        Raises:
+            KeyError: The post is not in the archive.
+        """
+        return self._owners[int(post_id)].get(post_id)
+
+    def close(self) -> None:
+        """
+        Close all archive files.
+        """
+        for archive in self._archives:
+            archive.close()
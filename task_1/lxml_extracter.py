@@ -0,0 +1,248 @@
+"""
+Post processing for data extracting based on lxml
+
+Returns the same data as `task_1.extracter.extract_post_data`, but all the
+required elements are found in one walk over the lxml tree and no
+BeautifulSoup objects are created.
+"""
+from typing import Dict, Iterator, List, Optional
+from pathlib import Path
+
+from lxml import etree
+
+from task_1.extracter import (clean_text, parse_comments_count,
+                              parse_watch_count)
+from utils import metrics
+
+# Tags removed from the post before extracting, see `filter_post_html`
+REMOVED_TAGS = frozenset(('code', 'img'))
+
+# (tag, class) of the elements to find, only the first one is used
+TARGETS = frozenset((
+    ('h1', 'tm-article-snippet__title'),
+    ('span', 'tm-article-snippet__datetime-published'),
+    ('span', 'tm-votes-meter__value_rating'),
+    ('span', 'bookmarks-button__counter'),
+    ('span', 'tm-article-comments-counter-link__value'),
+    ('span', 'tm-icon-counter__value'),
+    ('a', 'tm-user-card__nickname'),
+    ('div', 'tm-karma__votes'),
+    ('div', 'tm-rating__counter'),
+))
+SEPARATED_LIST = 'tm-separated-list'
+CONTENT_ID = 'post-content-body'
+
+_parser = etree.HTMLParser()
+
+
+def iter_strings(element: etree._Element) -> Iterator[str]:
+    """
+    Iterate over the text nodes of the element subtree.
+
+    Comments and removed tags are skipped, the text following them is not.
+
+    Args:
+        element: Root of the subtree.
+    """
+    if element.text:
+        yield element.text
+    for child in element:
+        if isinstance(child.tag, str) and child.tag not in REMOVED_TAGS:
+            yield from iter_strings(child)
+        if child.tail:
+            yield child.tail
+
+
+def get_text(element: etree._Element,
+             separator: str = '',
+             strip: bool = False) -> str:
+    """
+    Return the element text the same way as BeautifulSoup `get_text`.
+
+    Args:
+        element: Element to get the text of.
+        separator: Separator between text nodes.
+        strip: If True strip text nodes and skip empty ones.
+    """
+    strings = iter_strings(element)
+    if strip:
+        strings = (string.strip() for string in strings)
+        strings = (string for string in strings if string)
+    return separator.join(strings)
+
+
+def find_first(element: etree._Element,
+               tag: str) -> Optional[etree._Element]:
+    """
+    Find the first descendant with the tag outside of removed tags.
+
+    Args:
+        element: Element to search in.
+        tag: Tag name of the descendant.
+    """
+    walker = etree.iterwalk(element, events=('start', ))
+    next(walker)  # Skip the element itself
+    for _, child in walker:
+        if child.tag in REMOVED_TAGS:
+            walker.skip_subtree()
+        elif child.tag == tag:
+            return child
+    return None
+
+
+def find_all(element: etree._Element, tag: str) -> List[etree._Element]:
+    """
+    Find all descendants with the tag outside of removed tags.
+
+    Args:
+        element: Element to search in.
+        tag: Tag name of the descendants.
+    """
+    found = []
+    walker = etree.iterwalk(element, events=('start', ))
+    next(walker)  # Skip the element itself
+    for _, child in walker:
+        if child.tag in REMOVED_TAGS:
+            walker.skip_subtree()
+        elif child.tag == tag:
+            found.append(child)
+    return found
+
+
+def collect_elements(root: etree._Element) -> Dict:
+    """
+    Find all the elements used for extracting in a single tree walk.
+
+    Args:
+        root: Root of the post html tree.
+
+    Returns:
+        Dictionary with the first element for every (tag, class) target,
+        the post content element under CONTENT_ID key and the list of
+        separated lists under SEPARATED_LIST key.
+    """
+    elements = {SEPARATED_LIST: []}
+    walker = etree.iterwalk(root, events=('start', ))
+    for _, element in walker:
+        tag = element.tag
+        if tag in REMOVED_TAGS:
+            walker.skip_subtree()
+            continue
+
+        if tag == 'div' and CONTENT_ID not in elements:
+            if element.get('id') == CONTENT_ID:
+                elements[CONTENT_ID] = element
+
+        classes = element.get('class')
+        if not classes:
+            continue
+        for class_ in classes.split():
+            if (tag, class_) in TARGETS:
+                elements.setdefault((tag, class_), element)
+            elif tag == 'div' and class_ == SEPARATED_LIST:
+                elements[SEPARATED_LIST].append(element)
+
+    return elements
+
+
+def extract_separated_list(separated_lists: List[etree._Element],
+                           title: str) -> List[str]:
+    """
+    Extract items of the separated list with the title.
+
+    Args:
+        separated_lists: 'tm-separated-list' div elements.
+        title: Title of the list, e.g. 'Теги:' or 'Хабы:'.
+    """
+    for element in separated_lists:
+        title_element = find_first(element, 'span')
+        if get_text(title_element, strip=True) == title:
+            items_element = find_first(element, 'ul')
+            return [
+                get_text(item, strip=True)
+                for item in find_all(items_element, 'li')
+            ]
+
+    return []
+
+
+def extract_user_data(elements: Dict) -> Dict:
+    """
+    Extract post author data.
+
+    Args:
+        elements: Elements found by `collect_elements`.
+    """
+    username = elements.get(('a', 'tm-user-card__nickname'))
+    if username is None:
+        return {}
+    url = username.get('href')
+    karma = get_text(elements[('div', 'tm-karma__votes')])
+    rating = get_text(elements[('div', 'tm-rating__counter')])
+    return {
+        'url': f'https://habr.com{url}',
+        'username': get_text(username).strip(),
+        'karma': int(karma),
+        'rating': float(rating),
+    }
+
+
+def extract_post_data(file_path: str) -> Dict:
+    """
+    Extract post data.
+
+    Args:
+        file_path: path to the post html file.
+
+    Returns:
+        Dictionary of extracted post data.
+    """
+    post_id = Path(file_path).stem
+
+    with open(file_path, encoding='utf-8') as file_:
+        return extract_post_data_from_html(file_.read(), post_id)
+
+
+def extract_post_data_from_html(html_text: str, post_id: str) -> Dict:
+    """
+    Extract post data.
+
+    Args:
+        html_text: Post html.
+        post_id: ID of the post.
+
+    Returns:
+        Dictionary of extracted post data.
+    """
+    with metrics.timer('extracter_parse_seconds', engine='lxml'):
+        root = etree.fromstring(html_text, _parser)
+        elements = collect_elements(root)
+    datetime = find_first(
+        elements[('span', 'tm-article-snippet__datetime-published')],
+        'time',
+    ).get('datetime')
+    comments_count = elements.get(
+        ('span', 'tm-article-comments-counter-link__value'))
+    if comments_count is None:
+        comments_count = 0
+    else:
+        comments_count = parse_comments_count(get_text(comments_count))
+    content = get_text(elements[CONTENT_ID], ' ')
+
+    return {
+        'id': post_id,
+        'url': f'https://habr.com/ru/post/{post_id}/',
+        'title': get_text(elements[('h1', 'tm-article-snippet__title')]),
+        'datetime': datetime,
+        'rating': int(
+            get_text(elements[('span', 'tm-votes-meter__value_rating')])),
+        'bookmarksCount': int(
+            get_text(elements[('span', 'bookmarks-button__counter')])),
+        'watchCount': parse_watch_count(
+            get_text(elements[('span', 'tm-icon-counter__value')])),
+        'commentsCount': comments_count,
+        'content': clean_text(content),
+        'tags': extract_separated_list(elements[SEPARATED_LIST], 'Теги:'),
+        'habs': extract_separated_list(elements[SEPARATED_LIST], 'Хабы:'),
+        'user': extract_user_data(elements),
+    }
@@ -0,0 +1,154 @@
+"""
+Persistent manifest of crawled post statuses
+"""
+import os
+import struct
+from enum import IntEnum
+from typing import Dict, Iterable, List
+
+
+class PostStatus(IntEnum):
+    """
+    Outcome of a post download.
+    """
+    SAVED = 1
+    GONE = 2
+    FAILED = 3
+    PROXY_ERROR = 4
+    THROTTLED = 5
+    UNCHANGED = 6
+
+
+FINISHED_STATUSES = (PostStatus.SAVED, PostStatus.GONE, PostStatus.UNCHANGED)
+
+
+class CrawlManifest():
+    """
+    Append-only log of post download outcomes.
+
+    Every process writes its own `{name}.bin` file, so no locking is needed.
+    A record is 5 bytes: post ID as uint32 and status as uint8.
+
+    Attributes:
+        path: Directory where manifest files are stored.
+        name: Name of the manifest file of the running process.
+        flush_every: Number of records buffered before writing to disk.
+    """
+    _record = struct.Struct('<IB')
+
+    def __init__(self,
+                 path: str,
+                 name: str,
+                 flush_every: int = 256) -> None:
+        """
+        Init CrawlManifest
+        """
+        self.path = path
+        self.name = name
+        self.flush_every = flush_every
+        self._buffer = bytearray()
+        self._buffered = 0
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._file = open(f'{path}/{name}.bin', 'ab')
+
+    def __enter__(self) -> 'CrawlManifest':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def record(self, post_id: int, status: PostStatus) -> None:
+        """
+        Record the outcome of a post download.
+
+        Args:
+            post_id: ID of the post.
+            status: Download outcome.
+        """
+        self._buffer += self._record.pack(post_id, status)
+        self._buffered += 1
+        if self._buffered >= self.flush_every:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write buffered records to disk.
+        """
+        self._file.write(self._buffer)
+        self._file.flush()
+        self._buffer.clear()
+        self._buffered = 0
+
+    def close(self) -> None:
+        """
+        Flush buffered records and close the manifest file.
+        """
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    @classmethod
+    def load(cls, path: str) -> Dict[int, PostStatus]:
+        """
+        Read post statuses from every manifest file in the directory.
+
+        A finished status (saved, gone or unchanged) is never overridden by an
+        unfinished one, otherwise the latest record of a file wins.
+
+        Args:
+            path: Directory where manifest files are stored.
+
+        Returns:
+            Dictionary of post ID to its download outcome.
+        """
+        statuses = {}
+        if not os.path.exists(path):
+            return statuses
+
+        for file_name in sorted(os.listdir(path)):
+            if not file_name.endswith('.bin'):
+                continue
+            with open(f'{path}/{file_name}', 'rb') as file_:
+                data = file_.read()
+            # Ignore a record truncated by a crash
+            data = data[:len(data) - len(data) % cls._record.size]
+            for post_id, status in cls._record.iter_unpack(data):
+                if statuses.get(post_id) in FINISHED_STATUSES:
+                    continue
+                statuses[post_id] = PostStatus(status)
+
+        return statuses
+
+    @staticmethod
+    def clear(path: str) -> None:
+        """
+        Remove every manifest file in the directory.
+
+        Args:
+            path: Directory where manifest files are stored.
+        """
+        if not os.path.exists(path):
+            return
+        for file_name in os.listdir(path):
+            if file_name.endswith('.bin'):
+                os.remove(f'{path}/{file_name}')
+
+    @classmethod
+    def pending(cls, path: str, post_ids: Iterable[int]) -> List[int]:
+        """
+        Filter out posts that were already saved or are known to be gone.
+
+        Args:
+            path: Directory where manifest files are stored.
+            post_ids: Post IDs to be crawled.
+
+        Returns:
+            List of post IDs that still have to be downloaded.
+        """
+        statuses = cls.load(path)
+        return [
+            post_id for post_id in post_ids
+            if statuses.get(post_id) not in FINISHED_STATUSES
+        ]
@@ -0,0 +1,272 @@
+"""
+Streaming pipeline from crawling to data extracting
+"""
+import os
+from queue import Queue
+from threading import Thread
+from multiprocessing import Manager
+from concurrent.futures import ProcessPoolExecutor
+
+from task_1 import crawler, extracter
+from task_1.post_store import PostStore
+from utils import logging, metrics
+
+# Errors raised by extracters on pages without required elements
+EXTRACTING_ERRORS = (AttributeError, TypeError, ValueError, KeyError)
+
+
+def extract_worker(page_queue: Queue,
+                   process_number: int,
+                   path_dest: str,
+                   engine: str = 'lxml',
+                   post_queue: Queue = None,
+                   metrics_queue: Queue = None,
+                   log_queue: Queue = None,
+                   log_sample: int = 1,
+                   debug: bool = False) -> int:
+    """
+    Extract posts taken from the page queue until a None sentinel.
+
+    Args:
+        page_queue: Queue of (post_id, html) of downloaded posts.
+        process_number: Running process number.
+        path_dest: Directory where processed posts will be saved as json
+        files, not used if `post_queue` is given.
+        engine: Extracter engine, see `extracter.get_extractor`.
+        post_queue: Queue where valid posts data is put instead of saving,
+        a None sentinel is put when the page queue is exhausted.
+        metrics_queue: Queue of the metrics collector, metrics are not
+        recorded if None.
+        log_queue: Queue of the log listener, the log file is written
+        directly if None.
+        log_sample: Keep one of `log_sample` info and debug log records.
+        debug: If True setting log level to DEBUG, INFO otherwise.
+
+    Returns:
+        The number of valid posts.
+    """
+    metrics.configure(metrics_queue)
+    logging.configure(log_queue, log_sample)
+    logger = logging.get_logger(
+        filename=f'extracter_{process_number}',
+        debug=debug,
+    )
+    extract_post_data = extracter.get_extractor(engine, from_html=True)
+    valid_posts = 0
+
+    while True:
+        page = page_queue.get()
+        if page is None:
+            break
+        post_id, html_text = page
+
+        try:
+            with metrics.timer('extracter_extract_seconds', engine=engine):
+                post = extract_post_data(html_text, str(post_id))
+        except EXTRACTING_ERRORS as err:
+            metrics.inc('extracter_posts_total', status='error')
+            logger.error(
+                'An error occurred while extracting post "%s": %s',
+                post_id,
+                str(err),
+            )
+            continue
+        if not extracter.validate_post(post):
+            metrics.inc('extracter_posts_total', status='invalid')
+            continue
+
+        metrics.inc('extracter_posts_total', status='valid')
+        valid_posts += 1
+        if post_queue is None:
+            extracter.save_post_data(post, path_dest)
+        else:
+            post_queue.put(post)
+        logger.debug('Post "%s" extracted', post_id)
+
+    if post_queue is not None:
+        post_queue.put(None)
+    # The pool process outlives the worker, send metrics before returning
+    metrics.flush(force=True)
+    logging.flush()
+    return valid_posts
+
+
+def write_posts(post_queue: Queue, store: PostStore, producers: int) -> None:
+    """
+    Append posts taken from the queue to the store until every producer
+    puts a None sentinel.
+
+    Args:
+        post_queue: Queue of valid posts data.
+        store: Post store where processed posts will be saved.
+        producers: The number of extracting processes.
+    """
+    finished = 0
+    while finished < producers:
+        post = post_queue.get()
+        if post is None:
+            finished += 1
+        else:
+            with metrics.timer('extracter_write_seconds', format='store'):
+                store.append(post)
+
+
+def run_pipeline(first_id: int,
+                 last_id: int,
+                 crawl_workers: int = 1,
+                 extract_workers: int = 1,
+                 path_dest: str = 'data/processed_posts',
+                 output_format: str = 'json',
+                 html_path: str = None,
+                 archive: bool = False,
+                 engine: str = 'sync',
+                 extract_engine: str = 'lxml',
+                 concurrency: int = 100,
+                 chunk_size: int = 500,
+                 manifest_path: str = 'data/crawl_manifest',
+                 resume: bool = False,
+                 queue_size: int = 1000,
+                 adaptive: bool = False,
+                 rate: float = 10.0,
+                 max_attempts: int = 3,
+                 timeout: float = 30.0,
+                 hedge_percentile: float = None,
+                 metrics_path: str = None,
+                 log_sample: int = 1,
+                 refresh_path: str = None,
+                 max_age: float = None,
+                 explore: bool = False,
+                 block_size: int = 1000,
+                 sample_every: int = 20,
+                 min_density: float = 0.0,
+                 debug: bool = False) -> int:
+    """
+    Crawl posts and extract them as soon as they are downloaded.
+
+    Downloaded pages go through a bounded queue straight to the extracting
+    processes, so crawling slows down instead of filling the memory when
+    extracting can not keep up.
+
+    Args:
+        first_id: ID of the first post to be crawled.
+        last_id: ID of the last post to be crawled.
+        crawl_workers: The maximum number of crawling processes.
+        extract_workers: The number of extracting processes.
+        path_dest: Directory where processed posts will be saved.
+        output_format: 'json' or 'store', see
+        `extracter.extract_posts_data`.
+        html_path: Directory where downloaded html is also saved, html is
+        not kept if None.
+        archive: If True `html_path` is an html archive.
+        engine: Crawler engine, see `crawler.crawl`.
+        extract_engine: Extracter engine, see `extracter.get_extractor`.
+        concurrency: The maximum number of requests in flight per crawling
+        process, only used by the 'async' engine.
+        chunk_size: The number of post IDs in a chunk of crawling work.
+        manifest_path: Directory where download outcomes are recorded.
+        resume: If True skip posts that the manifest marks as saved or gone.
+        queue_size: The maximum number of pages waiting for extracting.
+        adaptive: If True adapt crawling speed to the site responses, see
+        `crawler.crawl`.
+        rate: Initial request rate per second of every crawling process.
+        max_attempts: The maximum number of attempts to download a post.
+        timeout: Request timeout in seconds.
+        hedge_percentile: Latency percentile after which a hedged request
+        is sent, see `crawler.crawl`.
+        metrics_path: File where crawling and extracting metrics are
+        written in the Prometheus text format, not collected if None.
+        log_sample: Keep one of `log_sample` info and debug records of the
+        crawling and extracting processes, see `crawler.crawl`.
+        refresh_path: Processed posts to be refreshed instead of crawling
+        the ID range, only changed pages are extracted again, see
+        `crawler.crawl`.
+        max_age: Only refresh posts published within `max_age` days.
+        explore: If True probe the ID range first and crawl the densest
+        blocks first, see `crawler.crawl`.
+        block_size: The number of IDs in a block.
+        sample_every: Distance between probed IDs.
+        min_density: Blocks with a lower estimated share of available
+        posts are skipped.
+        debug: If True setting log level to DEBUG, INFO otherwise.
+
+    Returns:
+        The number of valid extracted posts.
+    """
+    extracter.get_extractor(extract_engine)  # Fail early on unknown engine
+    if output_format not in extracter.OUTPUT_FORMATS:
+        raise ValueError(f'Unknown output format "{output_format}"')
+
+    if not os.path.exists(path_dest):
+        os.makedirs(path_dest)
+
+    store = None
+    if output_format == 'store':
+        store = PostStore(path_dest)
+
+    with Manager() as manager, ProcessPoolExecutor(
+            max_workers=extract_workers) as executor:
+        page_queue = manager.Queue(maxsize=queue_size)
+        metrics_queue = None
+        collector = None
+        if metrics_path is not None:
+            metrics_queue = manager.Queue()
+            collector = metrics.start_collector(metrics_queue, metrics_path)
+        log_queue = manager.Queue()
+        listener = logging.start_listener(log_queue)
+        post_queue = None
+        writer = None
+        if store is not None:
+            post_queue = manager.Queue(maxsize=queue_size)
+            writer = Thread(
+                target=write_posts,
+                args=(post_queue, store, extract_workers),
+            )
+            writer.start()
+
+        futures = [
+            executor.submit(extract_worker, page_queue, i, path_dest,
+                            extract_engine, post_queue, metrics_queue,
+                            log_queue, log_sample, debug)
+            for i in range(extract_workers)
+        ]
+        try:
+            crawler.crawl(
+                first_id=first_id,
+                last_id=last_id,
+                max_workers=crawl_workers,
+                path=html_path,
+                debug=debug,
+                engine=engine,
+                concurrency=concurrency,
+                manifest_path=manifest_path,
+                resume=resume,
+                chunk_size=chunk_size,
+                archive=archive,
+                page_queue=page_queue,
+                adaptive=adaptive,
+                rate=rate,
+                max_attempts=max_attempts,
+                timeout=timeout,
+                hedge_percentile=hedge_percentile,
+                metrics_queue=metrics_queue,
+                log_sample=log_sample,
+                log_queue=log_queue,
+                refresh_path=refresh_path,
+                max_age=max_age,
+                explore=explore,
+                block_size=block_size,
+                sample_every=sample_every,
+                min_density=min_density,
+            )
+        finally:
+            for _ in range(extract_workers):
+                page_queue.put(None)
+            valid_posts = sum(future.result() for future in futures)
+            if writer is not None:
+                writer.join()
+                store.close()
+            if collector is not None:
+                print(metrics.stop_collector(collector))
+            listener.stop()
+
+    return valid_posts
@@ -0,0 +1,371 @@
+"""
+Sharded compressed storage of processed posts
+"""
+import os
+import re
+import json
+import mmap
+import zlib
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from tqdm.auto import tqdm
+
+# Name of a processed post file, other json files such as the manifest of
+# the incremental extraction are not posts
+POST_FILE_NAME = re.compile(r'^(\d+)\.json$')
+
+
+def post_file_id(file_name: str) -> Optional[int]:
+    """
+    Return the post ID of a processed post file, None if the file is not a
+    processed post.
+
+    Args:
+        file_name: Name of a file in a directory of processed posts.
+    """
+    match = POST_FILE_NAME.fullmatch(file_name)
+    return None if match is None else int(match.group(1))
+
+
+class RecordStore():
+    """
+    Append-only storage of binary records with an ID index.
+
+    Records are appended to shard files `shard_{number}.bin`, a new shard is
+    started when the current one exceeds `max_shard_size` bytes. Every
+    write appends an (id, shard, offset, length) record to `index.bin`, the
+    latest record of an ID wins and a zero length marks a deleted record.
+    Shards are read through memory maps.
+
+    Note:
+        Only one process may write to the store at a time.
+
+    Attributes:
+        path: Directory of the store.
+        max_shard_size: The maximum size of a shard file in bytes.
+    """
+    _index_record = struct.Struct('<IHQI')
+
+    def __init__(self,
+                 path: str,
+                 max_shard_size: int = 64 * 1024 * 1024) -> None:
+        """
+        Init RecordStore
+        """
+        self.path = path
+        self.max_shard_size = max_shard_size
+        self._index = {}
+        self._maps = {}
+        self._shard_files = {}
+        self._index_file = None
+        self._shard_file = None
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._load_index()
+
+        shards = [
+            int(file_[len('shard_'):-len('.bin')])
+            for file_ in os.listdir(path)
+            if file_.startswith('shard_') and file_.endswith('.bin')
+        ]
+        self._shard = max(shards, default=0)
+        self._shard_size = 0
+        if os.path.exists(self._shard_path(self._shard)):
+            self._shard_size = os.path.getsize(self._shard_path(self._shard))
+
+    def __enter__(self) -> 'RecordStore':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, record_id: int) -> bool:
+        return int(record_id) in self._index
+
+    def _shard_path(self, shard: int) -> str:
+        return f'{self.path}/shard_{shard:05}.bin'
+
+    def _load_index(self) -> None:
+        """
+        Read the index file, skipping a record truncated by a crash.
+        """
+        index_path = f'{self.path}/index.bin'
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, 'rb') as file_:
+            data = file_.read()
+        data = data[:len(data) - len(data) % self._index_record.size]
+        for record_id, shard, offset, length in (
+                self._index_record.iter_unpack(data)):
+            if length == 0:
+                self._index.pop(record_id, None)
+            else:
+                self._index[record_id] = (shard, offset, length)
+
+    def _write_index(self, record_id: int, shard: int, offset: int,
+                     length: int) -> None:
+        if self._index_file is None:
+            self._index_file = open(f'{self.path}/index.bin', 'ab')
+        self._index_file.write(
+            self._index_record.pack(record_id, shard, offset, length))
+
+    def _read(self, shard: int, offset: int, length: int) -> bytes:
+        if shard not in self._maps:
+            if shard == self._shard and self._shard_file is not None:
+                self._shard_file.flush()
+            shard_file = open(self._shard_path(shard), 'rb')
+            self._shard_files[shard] = shard_file
+            self._maps[shard] = mmap.mmap(
+                shard_file.fileno(),
+                0,
+                access=mmap.ACCESS_READ,
+            )
+        return self._maps[shard][offset:offset + length]
+
+    def _unmap(self, shard: int) -> None:
+        if shard in self._maps:
+            self._maps.pop(shard).close()
+            self._shard_files.pop(shard).close()
+
+    def ids(self) -> List[int]:
+        """
+        Return sorted IDs of stored records.
+        """
+        return sorted(self._index)
+
+    def location(self, record_id: int) -> Tuple[int, int, int]:
+        """
+        Return (shard, offset, length) of the record.
+
+        Args:
+            record_id: ID of the record.
+
+        Raises:
+            KeyError: The record is not in the store.
+        """
+        return self._index[int(record_id)]
+
+    def get_record(self, record_id: int) -> bytes:
+        """
+        Return the record data.
+
+        Args:
+            record_id: ID of the record.
+
+        Raises:
+            KeyError: The record is not in the store.
+        """
+        return self._read(*self.location(record_id))
+
+    def iter_records(self) -> Iterator[Tuple[int, bytes]]:
+        """
+        Iterate over (id, data) of all records in storage order.
+        """
+        locations = sorted(
+            (location, record_id)
+            for record_id, location in self._index.items())
+        for (shard, offset, length), record_id in locations:
+            yield record_id, self._read(shard, offset, length)
+
+    def put_record(self, record_id: int, data: bytes) -> None:
+        """
+        Add the record, a previously stored record with the same ID is
+        replaced.
+
+        Args:
+            record_id: ID of the record.
+            data: Record data, must not be empty.
+        """
+        if self._shard_size > 0 and (self._shard_size + len(data) >
+                                     self.max_shard_size):
+            self._close_shard()
+            self._shard += 1
+            self._shard_size = 0
+        if self._shard_file is None:
+            self._shard_file = open(self._shard_path(self._shard), 'ab')
+
+        offset = self._shard_size
+        self._shard_file.write(data)
+        self._shard_size += len(data)
+        # Existing memory map does not cover appended data
+        self._unmap(self._shard)
+
+        record_id = int(record_id)
+        self._write_index(record_id, self._shard, offset, len(data))
+        self._index[record_id] = (self._shard, offset, len(data))
+
+    def delete(self, record_id: int) -> None:
+        """
+        Remove the record if it is stored.
+
+        Args:
+            record_id: ID of the record.
+        """
+        record_id = int(record_id)
+        if self._index.pop(record_id, None) is not None:
+            self._write_index(record_id, 0, 0, 0)
+
+    @classmethod
+    def index_position(cls, path: str) -> int:
+        """
+        Return the size of the complete index records of a store, the
+        changes made after now are read from it, see `read_changes`.
+
+        Args:
+            path: Directory of the store.
+        """
+        index_path = f'{path}/index.bin'
+        if not os.path.exists(index_path):
+            return 0
+        size = os.path.getsize(index_path)
+        return size - size % cls._index_record.size
+
+    def read_changes(self, position: int) -> Iterator[Tuple[int, int]]:
+        """
+        Iterate over the records written or deleted after `position` bytes
+        of the index file, also by another process. Every index record is
+        applied to the ID index before it is yielded, so the record is read
+        as it was written.
+
+        Args:
+            position: Size of the index file when changes were last read.
+
+        Yields:
+            ID of the changed record and the position after its index
+            record.
+        """
+        index_path = f'{self.path}/index.bin'
+        if not os.path.exists(index_path):
+            return
+        with open(index_path, 'rb') as file_:
+            file_.seek(position)
+            data = file_.read()
+        data = data[:len(data) - len(data) % self._index_record.size]
+        for record_id, shard, offset, length in (
+                self._index_record.iter_unpack(data)):
+            position += self._index_record.size
+            if length == 0:
+                self._index.pop(record_id, None)
+            else:
+                self._index[record_id] = (shard, offset, length)
+                if shard in self._maps and (
+                        offset + length > len(self._maps[shard])):
+                    # Another process appended to the mapped shard
+                    self._unmap(shard)
+            yield record_id, position
+
+    def flush(self) -> None:
+        """
+        Write appended records and index records to disk.
+        """
+        if self._shard_file is not None:
+            self._shard_file.flush()
+        if self._index_file is not None:
+            self._index_file.flush()
+
+    def _close_shard(self) -> None:
+        if self._shard_file is not None:
+            self._shard_file.close()
+            self._shard_file = None
+
+    def close(self) -> None:
+        """
+        Flush and close all store files.
+        """
+        # Shard data must reach the disk before the index points to it
+        self._close_shard()
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+        for shard in list(self._maps):
+            self._unmap(shard)
+
+
+class PostStore(RecordStore):
+    """
+    Append-only storage of processed posts with an ID index.
+
+    Posts are stored as zlib compressed compact json records, see
+    `RecordStore`.
+
+    Attributes:
+        path: Directory of the store.
+        max_shard_size: The maximum size of a shard file in bytes.
+        compress_level: zlib compression level of records.
+    """
+
+    def __init__(self,
+                 path: str,
+                 max_shard_size: int = 64 * 1024 * 1024,
+                 compress_level: int = 6) -> None:
+        """
+        Init PostStore
+        """
+        super().__init__(path, max_shard_size)
+        self.compress_level = compress_level
+
+    def __enter__(self) -> 'PostStore':
+        return self
+
+    def __iter__(self) -> Iterator[Dict]:
+        """
+        Iterate over all posts in storage order.
+        """
+        for _, data in self.iter_records():
+            yield self._decode(data)
+
+    @staticmethod
+    def _decode(data: bytes) -> Dict:
+        return json.loads(zlib.decompress(data).decode('utf-8'))
+
+    def get(self, post_id: int) -> Dict:
+        """
+        Return the post data.
+
+        Args:
+            post_id: ID of the post.
+
+        Raises:
+            KeyError: The post is not in the store.
+        """
+        return self._decode(self.get_record(post_id))
+
+    def append(self, post: Dict) -> None:
+        """
+        Add the post, a previously stored post with the same ID is replaced.
+
+        Args:
+            post: Dictionary of extracted post data.
+        """
+        data = json.dumps(
+            post,
+            ensure_ascii=False,
+            separators=(',', ':'),
+            sort_keys=True,
+        ).encode('utf-8')
+        self.put_record(post['id'], zlib.compress(data, self.compress_level))
+
+
+def convert_directory(path_src: str = 'data/processed_posts',
+                      path_dest: str = 'data/post_store') -> None:
+    """
+    Copy processed posts saved as `{post_id}.json` files to a post store.
+
+    Args:
+        path_src: Directory where processed posts are stored.
+        path_dest: Directory of the post store.
+    """
+    file_names = sorted(
+        (file_ for file_ in os.listdir(path_src)
+         if post_file_id(file_) is not None),
+        key=post_file_id,
+    )
+    with PostStore(path_dest) as store:
+        for file_name in tqdm(file_names):
+            with open(f'{path_src}/{file_name}', encoding='utf-8') as file_:
+                store.append(json.load(file_))
@@ -1,33 +1,116 @@
 """
 Proxy manager class
 """
-from typing import List
+import time
+import asyncio
+from typing import Dict, List, Optional, Tuple
 from logging import Logger
-from random import choice
+from random import choices
+from threading import RLock
+from multiprocessing.managers import BaseManager
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from bs4 import BeautifulSoup
 
+from utils import logging
+
+
+class NoProxyError(IndexError):
+    """
+    Proxy list is empty, a new one is loaded by a later call.
+    """
+
+
+class ProxyHealth():
+    """
+    Rolling health statistics of a proxy.
+
+    Attributes:
+        latency: Exponential moving average of response time in seconds.
+        success_rate: Exponential moving average of request success.
+        failures: The number of consecutive failed requests.
+        cooldown_until: Time until which the proxy is not used.
+    """
+
+    def __init__(self, latency: float = 1.0, alpha: float = 0.2) -> None:
+        """
+        Init ProxyHealth
+        """
+        self.latency = latency
+        self.success_rate = 1.0
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self._alpha = alpha
+
+    def update(self, success: bool, latency: float = None) -> None:
+        """
+        Add the request outcome to the statistics.
+
+        Args:
+            success: True if the request succeeded.
+            latency: Response time in seconds, not used if None.
+        """
+        self.success_rate += self._alpha * (success - self.success_rate)
+        if latency is not None:
+            self.latency += self._alpha * (latency - self.latency)
+        if success:
+            self.failures = 0
+        else:
+            self.failures += 1
+
+    @property
+    def weight(self) -> float:
+        """
+        Selection weight, fast proxies with high success rate are preferred.
+        """
+        return max(self.success_rate, 0.01) / max(self.latency, 0.01)
+
 
 class ProxyManager():
     """
     Class for scrapping, storing and managing proxy list.
 
+    Proxies are selected randomly with weights given by their health: fast
+    proxies with high success rate are used more often. A failed proxy is
+    put on an exponentially growing cooldown and only removed after
+    `max_failures` consecutive failures.
+
     Attributes:
         proxies: List of initial proxies.
         checked_url: Url used for checking if proxy is working.
         logger: Logger used for logging.
+        check_timeout: Timeout of a proxy check request in seconds.
+        check_workers: The number of proxies checked concurrently.
+        cooldown: Cooldown after the first failure in seconds.
+        max_failures: The number of consecutive failures after which the
+        proxy is removed.
     """
 
     def __init__(self,
                  logger: Logger,
                  proxies: List[str] = None,
-                 checked_url: str = 'https://www.google.com/') -> None:
+                 checked_url: str = 'https://www.google.com/',
+                 check_timeout: float = 5.0,
+                 check_workers: int = 32,
+                 cooldown: float = 10.0,
+                 max_failures: int = 5) -> None:
         """
         Init ProxyManager
         """
         self.logger = logger
         self.checked_url = checked_url
+        self.check_timeout = check_timeout
+        self.check_workers = check_workers
+        self.cooldown = cooldown
+        self.max_failures = max_failures
+        self.health = {}
+        # Manager process serves shared pool calls from several threads
+        self._lock = RLock()
+        self._requests = 0
+        self._failures = 0
+        self._refreshes = 0
+        self._refresh_time = None
         self._user_agent = ('Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_4)'
                             ' AppleWebKit/537.36 (KHTML, like Gecko) Chrome/'
                             '83.0.4103.97 Safari/537.36')
@@ -44,27 +127,52 @@ class ProxyManager():
         Clear old proxies and parse new ones.
         """
         self.proxies = []
+        self.health = {}
+        self._refreshes += 1
+        self._refresh_time = time.monotonic()
         self._load_proxies()
 
+    def _refresh_empty(self) -> None:
+        """
+        Load a new proxy list if the list is empty, at most once per
+        `cooldown` seconds, so an unavailable proxy source is not hammered.
+        """
+        if len(self.proxies) > 0:
+            return
+        if (self._refresh_time is None or
+                time.monotonic() - self._refresh_time >= self.cooldown):
+            self._update_proxies()
+
     def _load_proxies(self) -> None:
         """
         Parse proxies from https://hidemy.name/ and update proxy list.
         """
         try:
             headers = {'User-Agent': self._user_agent}
+            # A stuck proxy list source must not hang the crawler start
             html_text = requests.get(url=self._proxy_source_url,
-                                     headers=headers).text
+                                     headers=headers,
+                                     timeout=self.check_timeout).text
             soup = BeautifulSoup(markup=html_text, features='lxml')
 
             free_proxy_container = soup.find('div', {'class': 'table_block'})
             free_proxy_table = free_proxy_container.find('tbody')
 
+            proxy_addresses = []
             for row in free_proxy_table.find_all('tr'):
                 cols = row.find_all('td')
                 if len(cols) != 0:
-                    proxy_address = f'{cols[0].text}:{cols[1].text}'
-                    if self._check_proxy(proxy_address):
-                        self.proxies.append(proxy_address)
+                    proxy_addresses.append(f'{cols[0].text}:{cols[1].text}')
+
+            # Checks are network bound, so threads are enough
+            with ThreadPoolExecutor(
+                    max_workers=max(1, self.check_workers)) as executor:
+                is_working = list(
+                    executor.map(self._check_proxy, proxy_addresses))
+            for proxy_address, is_working_proxy in zip(
+                    proxy_addresses, is_working):
+                if is_working_proxy:
+                    self.proxies.append(proxy_address)
 
         except requests.exceptions.RequestException as err:
             self.logger.error(
@@ -86,15 +194,19 @@ class ProxyManager():
         is_working_proxy = False
 
         try:
+            start_time = time.monotonic()
             response = requests.get(
                 url=self.checked_url,
                 headers=headers,
                 proxies=proxies,
+                timeout=self.check_timeout,
             )
+            latency = time.monotonic() - start_time
 
             response_status = response.status_code
             if response_status == 200:
                 is_working_proxy = True
+                self.health[proxy_address] = ProxyHealth(latency=latency)
                 self.logger.info(
                     'Checked proxy "%s"; Proxy is working',
                     proxy_address,
@@ -115,21 +227,96 @@ class ProxyManager():
 
         return is_working_proxy
 
+    def _get_health(self, proxy_address: str) -> ProxyHealth:
+        if proxy_address not in self.health:
+            self.health[proxy_address] = ProxyHealth()
+        return self.health[proxy_address]
+
+    def candidates(self) -> List[Tuple[str, float]]:
+        """
+        Return the proxies that may be used now with their selection
+        weights given by their health.
+
+        Proxies on cooldown are skipped unless all proxies are on cooldown.
+        An empty proxy list is refreshed, see `get_proxy`.
+        """
+        with self._lock:
+            self._refresh_empty()
+            now = time.monotonic()
+            candidates = [
+                proxy_address for proxy_address in self.proxies
+                if self._get_health(proxy_address).cooldown_until <= now
+            ]
+            if len(candidates) == 0:
+                candidates = self.proxies
+            return [(proxy_address, self._get_health(proxy_address).weight)
+                    for proxy_address in candidates]
+
     def get_proxy(self) -> str:
         """
-        Return random proxy from proxy list.
+        Return random proxy from proxy list weighted by proxy health.
+
+        Proxies on cooldown are skipped unless all proxies are on cooldown.
+        An empty proxy list is loaded again, at most once per `cooldown`
+        seconds.
 
         Returns:
             Endpoint of the proxy, '{ip}:{port}'.
 
         Raises:
-            IndexError: An error occured accessing the proxy
+            NoProxyError: The proxy list is empty.
+        """
+        with self._lock:
+            candidates = self.candidates()
+            if len(candidates) == 0:
+                raise NoProxyError('ProxyManager proxy list is empty')
+            proxy_addresses, weights = zip(*candidates)
+            return choices(proxy_addresses, weights=weights)[0]
+
+    def report_success(self, proxy_address: str,
+                       latency: float = None) -> None:
+        """
+        Record a successful request through the proxy.
+
+        Args:
+            proxy_address: Endpoint of the proxy.
+            latency: Response time in seconds.
+        """
+        with self._lock:
+            self._requests += 1
+            self._get_health(proxy_address).update(True, latency)
+
+    def report_failure(self, proxy_address: str,
+                       latency: float = None) -> None:
         """
-        if len(self.proxies) == 0:
-            raise IndexError('ProxyManager proxy list is empty')
+        Record a failed request through the proxy and put it on cooldown.
 
-        random_proxy_address = choice(self.proxies)
-        return random_proxy_address
+        The proxy is removed after `max_failures` consecutive failures.
+
+        Args:
+            proxy_address: Endpoint of the proxy.
+            latency: Response time in seconds.
+        """
+        with self._lock:
+            self._requests += 1
+            self._failures += 1
+            # Proxy may be already removed by another process
+            if proxy_address not in self.proxies:
+                return
+
+            health = self._get_health(proxy_address)
+            health.update(False, latency)
+            if health.failures >= self.max_failures:
+                self.remove_proxy(proxy_address)
+                return
+
+            cooldown = self.cooldown * 2**(health.failures - 1)
+            health.cooldown_until = time.monotonic() + cooldown
+            self.logger.debug(
+                'Proxy "%s" is on cooldown for %.1f s',
+                proxy_address,
+                cooldown,
+            )
 
     def remove_proxy(self, proxy_address: str) -> None:
         """
@@ -138,17 +325,162 @@ class ProxyManager():
         Args:
             proxy_address: Endpoint of the proxy to remove.
         """
-        if proxy_address in self.proxies:
-            self.proxies.remove(proxy_address)
-            self.logger.info(
-                'Proxy "%s" removed from proxy list',
-                proxy_address,
-            )
-        else:
-            self.logger.warning(
-                'Proxy list does not contain "%s"',
-                proxy_address,
-            )
+        with self._lock:
+            if proxy_address in self.proxies:
+                self.proxies.remove(proxy_address)
+                self.health.pop(proxy_address, None)
+                self.logger.info(
+                    'Proxy "%s" removed from proxy list',
+                    proxy_address,
+                )
+            else:
+                self.logger.warning(
+                    'Proxy list does not contain "%s"',
+                    proxy_address,
+                )
 
-        if len(self.proxies) == 0:
-            self._update_proxies()
+            if len(self.proxies) == 0:
+                self._update_proxies()
+
+    def report(self, outcomes: List[Tuple[str, bool,
+                                          Optional[float]]]) -> None:
+        """
+        Record the outcomes of several requests at once, see
+        `report_success` and `report_failure`.
+
+        Args:
+            outcomes: Proxy, True if the request succeeded and response
+            time in seconds or None of every request.
+        """
+        with self._lock:
+            for proxy_address, success, latency in outcomes:
+                if success:
+                    self.report_success(proxy_address, latency)
+                else:
+                    self.report_failure(proxy_address, latency)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return request statistics of the proxy pool.
+
+        Returns:
+            Dictionary with the number of reported requests, failed
+            requests, proxy list refreshes and current proxies.
+        """
+        with self._lock:
+            return {
+                'requests': self._requests,
+                'failures': self._failures,
+                'refreshes': self._refreshes,
+                'proxies': len(self.proxies),
+            }
+
+
+class CachedProxyPool():
+    """
+    Process-local view of the shared proxy pool for an event loop.
+
+    Calls of the shared pool block until the manager process answers, and
+    a proxy list refresh takes seconds, so they must not run in the event
+    loop. Proxies are selected from a copy of the pool candidates and
+    request outcomes are collected locally, `run` exchanges both with the
+    shared pool in a thread every `interval` seconds.
+
+    Attributes:
+        pool: Proxy pool shared by all processes.
+        interval: Seconds between exchanges with the shared pool.
+    """
+
+    def __init__(self, pool: ProxyManager, interval: float = 1.0) -> None:
+        """
+        Init CachedProxyPool
+        """
+        self.pool = pool
+        self.interval = interval
+        self._candidates = []
+        self._outcomes = []
+
+    def get_proxy(self) -> str:
+        """
+        Return random proxy of the copied candidates weighted by health.
+
+        Raises:
+            NoProxyError: No proxy is known, the shared pool loads a new
+            proxy list at the next exchange.
+        """
+        if len(self._candidates) == 0:
+            raise NoProxyError('ProxyManager proxy list is empty')
+        proxy_addresses, weights = zip(*self._candidates)
+        return choices(proxy_addresses, weights=weights)[0]
+
+    def report_success(self, proxy_address: str,
+                       latency: float = None) -> None:
+        """
+        Record a successful request through the proxy.
+        """
+        self._outcomes.append((proxy_address, True, latency))
+
+    def report_failure(self, proxy_address: str,
+                       latency: float = None) -> None:
+        """
+        Record a failed request through the proxy, it is not selected until
+        the next exchange.
+        """
+        self._outcomes.append((proxy_address, False, latency))
+        remaining = [
+            candidate for candidate in self._candidates
+            if candidate[0] != proxy_address
+        ]
+        if len(remaining) > 0:
+            self._candidates = remaining
+
+    def _exchange(self, outcomes: List[Tuple[str, bool, Optional[float]]]
+                  ) -> List[Tuple[str, float]]:
+        if len(outcomes) > 0:
+            self.pool.report(outcomes)
+        return self.pool.candidates()
+
+    async def sync(self) -> None:
+        """
+        Send the collected outcomes to the shared pool and copy its
+        candidates without blocking the event loop.
+        """
+        outcomes, self._outcomes = self._outcomes, []
+        loop = asyncio.get_running_loop()
+        self._candidates = await loop.run_in_executor(
+            None, self._exchange, outcomes)
+
+    async def run(self) -> None:
+        """
+        Exchange with the shared pool every `interval` seconds until
+        cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.sync()
+
+
+class ProxyPoolManager(BaseManager):
+    """
+    Manager process serving one proxy pool to all crawler processes.
+
+    All processes share the proxy health and the proxy list, so a dead
+    proxy is discovered once and the proxy list is refreshed by a single
+    process at a time.
+    """
+
+
+def create_proxy_pool(proxies: List[str] = None,
+                      debug: bool = False) -> ProxyManager:
+    """
+    Create the proxy manager living in the manager process.
+
+    Args:
+        proxies: Initial proxy list.
+        debug: If True setting log level to DEBUG, INFO otherwise.
+    """
+    logger = logging.get_logger(filename='proxy_pool', debug=debug)
+    return ProxyManager(logger=logger, proxies=proxies)
+
+
+ProxyPoolManager.register('ProxyPool', create_proxy_pool)
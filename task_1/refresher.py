@@ -0,0 +1,263 @@
+"""
+Conditional re-crawling of known posts to keep their counters fresh
+"""
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from tqdm.auto import tqdm
+
+from task_1.post_store import PostStore, post_file_id
+
+# Subdirectories of the crawl manifest directory
+VALIDATORS_DIR = 'validators'
+REFRESH_DIR = 'refresh'
+# Validators of all previous runs merged by `PageValidators.compact`
+SNAPSHOT_NAME = 'snapshot'
+
+# Prefix of the `datetime` field of processed posts
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+# (ETag, Last-Modified, digest of the filtered html)
+Validator = Tuple[Optional[str], Optional[str], str]
+
+
+def page_digest(html_text: str) -> str:
+    """
+    Return the digest of the filtered post html.
+
+    Args:
+        html_text: Filtered post html.
+    """
+    return hashlib.blake2b(html_text.encode('utf-8'),
+                           digest_size=16).hexdigest()
+
+
+class PageValidators():
+    """
+    ETag, Last-Modified and html digest of saved post pages.
+
+    Every process appends `[post_id, etag, last_modified, digest]` json
+    lines to its own `{name}.jsonl` file, so no locking is needed.
+
+    Attributes:
+        path: Directory where validator files are stored.
+        name: Name of the validator file of the running process.
+        known: Validators of the previous runs, conditional requests are
+        only sent for these posts.
+        flush_every: Number of records buffered before writing to disk.
+    """
+
+    def __init__(self,
+                 path: str,
+                 name: str,
+                 known: Dict[int, Validator] = None,
+                 flush_every: int = 256) -> None:
+        """
+        Init PageValidators
+        """
+        self.path = path
+        self.name = name
+        self.known = known or {}
+        self.flush_every = flush_every
+        self._buffer = []
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._file = open(f'{path}/{name}.jsonl', 'a', encoding='utf-8')
+
+    def __enter__(self) -> 'PageValidators':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def headers(self, post_id: int) -> Optional[Dict[str, str]]:
+        """
+        Return conditional request headers of the post, None if the post
+        page is not known.
+
+        Args:
+            post_id: ID of the post.
+        """
+        validator = self.known.get(post_id)
+        if validator is None:
+            return None
+        etag, last_modified, _ = validator
+        headers = {}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        if last_modified is not None:
+            headers['If-Modified-Since'] = last_modified
+        return headers or None
+
+    def update(self,
+               post_id: int,
+               html_text: str,
+               headers: Mapping[str, str] = None) -> bool:
+        """
+        Record validators of the downloaded page.
+
+        Args:
+            post_id: ID of the post.
+            html_text: Filtered post html.
+            headers: Response headers.
+
+        Returns:
+            True if the page is new or changed since it was saved.
+        """
+        headers = headers or {}
+        validator = (headers.get('ETag'), headers.get('Last-Modified'),
+                     page_digest(html_text))
+        previous = self.known.get(post_id)
+        if previous != validator:
+            self._buffer.append(
+                json.dumps([post_id, *validator], separators=(',', ':')))
+            if len(self._buffer) >= self.flush_every:
+                self.flush()
+        return previous is None or previous[2] != validator[2]
+
+    def flush(self) -> None:
+        """
+        Write buffered records to disk.
+        """
+        if len(self._buffer) > 0:
+            self._file.write('\n'.join(self._buffer) + '\n')
+            self._file.flush()
+            self._buffer = []
+
+    def close(self) -> None:
+        """
+        Flush buffered records and close the validator file.
+        """
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    @staticmethod
+    def load(path: str) -> Dict[int, Validator]:
+        """
+        Read validators from every file in the directory, the snapshot is
+        read first and the latest record of a post wins.
+
+        Args:
+            path: Directory where validator files are stored.
+
+        Returns:
+            Dictionary of post ID to its validators.
+        """
+        validators = {}
+        if not os.path.exists(path):
+            return validators
+
+        file_names = sorted(
+            (file_ for file_ in os.listdir(path) if file_.endswith('.jsonl')),
+            key=lambda file_: file_ != f'{SNAPSHOT_NAME}.jsonl',
+        )
+        for file_name in file_names:
+            with open(f'{path}/{file_name}', encoding='utf-8') as file_:
+                for line in file_:
+                    try:
+                        post_id, *validator = json.loads(line)
+                    except ValueError:
+                        continue  # Line truncated by a crash
+                    validators[post_id] = tuple(validator)
+        return validators
+
+    @classmethod
+    def compact(cls, path: str) -> Dict[int, Validator]:
+        """
+        Merge all validator files into the snapshot, so files of the
+        processes only hold records of the next run.
+
+        Args:
+            path: Directory where validator files are stored.
+
+        Returns:
+            Dictionary of post ID to its validators.
+        """
+        validators = cls.load(path)
+        if not os.path.exists(path):
+            return validators
+
+        temp_path = f'{path}/{SNAPSHOT_NAME}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file_:
+            for post_id, validator in validators.items():
+                file_.write(
+                    json.dumps([post_id, *validator], separators=(',', ':')))
+                file_.write('\n')
+        os.replace(temp_path, f'{path}/{SNAPSHOT_NAME}.jsonl')
+        for file_name in os.listdir(path):
+            if (file_name.endswith('.jsonl')
+                    and file_name != f'{SNAPSHOT_NAME}.jsonl'):
+                os.remove(f'{path}/{file_name}')
+        return validators
+
+
+def read_post_dates(path: str) -> Dict[int, str]:
+    """
+    Read publication dates of processed posts.
+
+    Args:
+        path: Directory of `{post_id}.json` files or a post store.
+
+    Returns:
+        Dictionary of post ID to its `datetime` field.
+    """
+    if os.path.exists(f'{path}/index.bin'):
+        with PostStore(path) as store:
+            return {
+                post['id']: post['datetime']
+                for post in tqdm(store, total=len(store), desc='Reading')
+            }
+
+    dates = {}
+    file_names = [
+        file_ for file_ in os.listdir(path) if post_file_id(file_) is not None
+    ]
+    for file_name in tqdm(file_names, desc='Reading'):
+        with open(f'{path}/{file_name}', encoding='utf-8') as file_:
+            post = json.load(file_)
+        dates[post['id']] = post['datetime']
+    return dates
+
+
+def select_posts(path: str,
+                 first_id: int = 0,
+                 last_id: int = None,
+                 max_age: float = None,
+                 now: datetime = None) -> List[int]:
+    """
+    Choose processed posts to be refreshed, the newest posts first since
+    their counters change the most.
+
+    Args:
+        path: Directory of `{post_id}.json` files or a post store.
+        first_id: The smallest post ID.
+        last_id: Posts with this ID and above are not refreshed, no upper
+        bound if None.
+        max_age: Only posts published within `max_age` days are refreshed,
+        all posts if None.
+        now: Time the age is counted from, the current time if None.
+
+    Returns:
+        IDs of the posts sorted by publication date, the newest first.
+    """
+    dates = {
+        int(post_id): date
+        for post_id, date in read_post_dates(path).items()
+        if int(post_id) >= first_id and (last_id is None
+                                         or int(post_id) < last_id)
+    }
+    if max_age is not None:
+        now = now or datetime.now(timezone.utc)
+        oldest = (now - timedelta(days=max_age)).strftime(DATETIME_FORMAT)
+        # Dates of the same format are ordered as strings
+        dates = {
+            post_id: date
+            for post_id, date in dates.items() if date >= oldest
+        }
+    return sorted(dates, key=lambda post_id: (dates[post_id], post_id),
+                  reverse=True)
@@ -0,0 +1,180 @@
+"""
+Retries with exponential backoff and latency percentiles for request hedging
+"""
+import time
+import heapq
+import random
+from collections import deque
+from typing import Any, Iterable, Iterator, Optional, Tuple
+
+from task_1.manifest import PostStatus
+
+# Outcomes that can change on the next attempt
+RETRIED_STATUSES = (PostStatus.FAILED, PostStatus.PROXY_ERROR,
+                    PostStatus.THROTTLED)
+
+
+class RetryPolicy():
+    """
+    Number of attempts and exponential backoff between them.
+
+    Attributes:
+        max_attempts: The maximum number of attempts of a request.
+        backoff: Delay in seconds before the second attempt, doubled for
+        every next one.
+        max_backoff: The maximum delay in seconds.
+    """
+
+    def __init__(self,
+                 max_attempts: int = 3,
+                 backoff: float = 1.0,
+                 max_backoff: float = 60.0) -> None:
+        """
+        Init RetryPolicy
+        """
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def should_retry(self, status: PostStatus, attempt: int) -> bool:
+        """
+        Check that the post should be requested again.
+
+        Args:
+            status: Outcome of the attempt.
+            attempt: Number of the attempt, starting from 1.
+        """
+        return status in RETRIED_STATUSES and attempt < self.max_attempts
+
+    def delay(self, attempt: int) -> float:
+        """
+        Return delay in seconds before the next attempt.
+
+        Jitter spreads retries of posts that failed together.
+
+        Args:
+            attempt: Number of the failed attempt, starting from 1.
+        """
+        delay = min(self.max_backoff, self.backoff * 2**(attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+
+class RetryQueue():
+    """
+    Items waiting for the next attempt ordered by the time it is due.
+
+    Attributes:
+        policy: Retry policy of the items.
+    """
+
+    def __init__(self, policy: RetryPolicy) -> None:
+        """
+        Init RetryQueue
+        """
+        self.policy = policy
+        self._heap = []
+        self._counter = 0
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def schedule(self, item: Any, attempt: int, counted: bool = True) -> None:
+        """
+        Add the item after the failed attempt.
+
+        Args:
+            item: Retried item.
+            attempt: Number of the failed attempt, starting from 1.
+            counted: If False the item is tried again as the same attempt,
+            e.g. when no request was sent.
+        """
+        ready_time = time.monotonic() + self.policy.delay(attempt)
+        next_attempt = attempt + 1 if counted else attempt
+        # Counter keeps items with equal time out of comparison
+        heapq.heappush(self._heap,
+                       (ready_time, self._counter, item, next_attempt))
+        self._counter += 1
+
+    def wait_time(self) -> float:
+        """
+        Return seconds until the first item is due, 0 if it is already due.
+        """
+        return max(0.0, self._heap[0][0] - time.monotonic())
+
+    def pop_ready(self) -> Optional[Tuple[Any, int]]:
+        """
+        Remove and return (item, attempt) of the due item or None.
+        """
+        if len(self._heap) == 0 or self._heap[0][0] > time.monotonic():
+            return None
+        _, _, item, attempt = heapq.heappop(self._heap)
+        return item, attempt
+
+    def iter_items(self, items: Iterable[Any]) -> Iterator[Tuple[Any, int]]:
+        """
+        Iterate over (item, attempt) of the new items and due retries,
+        sleeping until the next retry is due when new items are exhausted.
+
+        Args:
+            items: New items, yielded as the first attempt.
+        """
+        items = iter(items)
+        while True:
+            ready = self.pop_ready()
+            if ready is not None:
+                yield ready
+                continue
+            item = next(items, None)
+            if item is not None:
+                yield item, 1
+            elif len(self._heap) > 0:
+                time.sleep(self.wait_time())
+            else:
+                return
+
+
+class LatencyTracker():
+    """
+    Percentile of recent request latencies.
+
+    Attributes:
+        percentile: Tracked percentile, from 0 to 100.
+        min_samples: The number of samples before the percentile is known.
+        update_every: The number of samples between percentile updates.
+    """
+
+    def __init__(self,
+                 percentile: float = 95.0,
+                 window: int = 1000,
+                 min_samples: int = 50,
+                 update_every: int = 32) -> None:
+        """
+        Init LatencyTracker
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.update_every = update_every
+        self._samples = deque(maxlen=window)
+        self._added = 0
+        self._value = None
+
+    def add(self, latency: float) -> None:
+        """
+        Add latency of a finished request.
+
+        Args:
+            latency: Response time in seconds.
+        """
+        self._samples.append(latency)
+        self._added += 1
+        if (len(self._samples) >= self.min_samples
+                and self._added % self.update_every == 0):
+            samples = sorted(self._samples)
+            index = int(len(samples) * self.percentile / 100)
+            self._value = samples[min(index, len(samples) - 1)]
+
+    def value(self) -> Optional[float]:
+        """
+        Return latency percentile in seconds or None if it is not known yet.
+        """
+        return self._value
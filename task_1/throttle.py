@@ -0,0 +1,253 @@
+"""
+Adaptive concurrency and request rate control for the crawler
+"""
+import time
+import asyncio
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+
+def is_throttled(response_status: int) -> bool:
+    """
+    Check that the response status means the site is overloaded.
+
+    Args:
+        response_status: Response status code.
+    """
+    return response_status == 429 or 500 <= response_status < 600
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse `Retry-After` header value.
+
+    Args:
+        value: Header value, either delay in seconds or http date.
+
+    Returns:
+        Delay in seconds or None if the value is missing or invalid.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_time = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_time is None:
+        return None
+    return max(0.0, retry_time.timestamp() - time.time())
+
+
+class AdaptiveLimiter():
+    """
+    AIMD controller of the number of requests in flight and request rate.
+
+    Every successful response additively increases the limits, a throttled
+    response (429 or 5xx) or a latency rising above `latency_factor` times
+    the lowest latency of the last `baseline_window` seconds
+    multiplicatively decreases them, at most once per observed round trip.
+    Only pages (200 and 304) are timed, so fast error pages do not lower
+    the baseline, and the baseline follows the site when its latency
+    changes for good. `Retry-After` pauses all requests.
+
+    Attributes:
+        concurrency: Current limit of requests in flight.
+        rate: Current limit of requests per second.
+        min_concurrency: Lower bound of the concurrency limit.
+        max_concurrency: Upper bound of the concurrency limit.
+        min_rate: Lower bound of the rate limit.
+        max_rate: Upper bound of the rate limit.
+        decrease: Multiplicative decrease factor.
+        latency_factor: Latency growth treated as congestion.
+        baseline_window: Seconds over which the lowest latency is taken.
+    """
+
+    def __init__(self,
+                 max_concurrency: int = 100,
+                 initial_concurrency: int = 8,
+                 min_concurrency: int = 1,
+                 initial_rate: float = 10.0,
+                 min_rate: float = 0.5,
+                 max_rate: float = 1000.0,
+                 decrease: float = 0.5,
+                 latency_factor: float = 3.0,
+                 baseline_window: float = 30.0) -> None:
+        """
+        Init AdaptiveLimiter
+        """
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.concurrency = float(
+            min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.rate = float(min(max(initial_rate, min_rate), max_rate))
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.baseline_window = baseline_window
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self._latency = None
+        # Increasing latencies of the window with their times, the first
+        # one is the lowest (monotonic queue)
+        self._min_latencies = deque()
+        self._last_decrease = 0.0
+        self._next_start = 0.0
+        self._condition = None
+
+    def _reserve(self) -> float:
+        """
+        Reserve the start time of the next request.
+
+        Returns:
+            Delay in seconds before the request may be sent.
+        """
+        now = time.monotonic()
+        start = max(now, self._next_start, self.paused_until)
+        self._next_start = start + 1 / self.rate
+        return start - now
+
+    async def acquire(self) -> None:
+        """
+        Wait until a request may be sent and take a slot of the limit.
+        """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: self.in_flight < int(self.concurrency))
+            self.in_flight += 1
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wait(self) -> None:
+        """
+        Block until a request may be sent, used without concurrency.
+        """
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+        self.in_flight += 1
+
+    def release(self,
+                response_status: int = None,
+                latency: float = None,
+                retry_after: float = None) -> None:
+        """
+        Free the slot and adapt the limits to the response.
+
+        Args:
+            response_status: Response status code, None if the request
+            failed without response.
+            latency: Response time in seconds.
+            retry_after: `Retry-After` delay in seconds.
+        """
+        self.in_flight -= 1
+        now = time.monotonic()
+
+        if retry_after is not None:
+            self.paused_until = max(self.paused_until, now + retry_after)
+
+        if response_status is not None and is_throttled(response_status):
+            self._decrease(now)
+        elif response_status in (200, 304) and latency is not None:
+            self._update_latency(latency, now)
+            if self._latency > self.latency_factor * self._baseline():
+                self._decrease(now)
+            else:
+                self._increase()
+        elif response_status is not None:
+            self._increase()
+
+        if self._condition is not None:
+            asyncio.ensure_future(self._notify())
+
+    async def _notify(self) -> None:
+        async with self._condition:
+            self._condition.notify_all()
+
+    def _update_latency(self, latency: float, now: float) -> None:
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency += 0.2 * (latency - self._latency)
+        while self._min_latencies and self._min_latencies[-1][1] >= latency:
+            self._min_latencies.pop()
+        self._min_latencies.append((now, latency))
+        while self._min_latencies[0][0] < now - self.baseline_window:
+            self._min_latencies.popleft()
+
+    def _baseline(self) -> float:
+        return self._min_latencies[0][1]
+
+    def _increase(self) -> None:
+        # About one more request in flight per window of responses
+        self.concurrency = min(self.max_concurrency,
+                               self.concurrency + 1 / self.concurrency)
+        self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+    def _decrease(self, now: float) -> None:
+        # Responses of one round trip carry the same congestion signal
+        round_trip = self._latency if self._latency is not None else 1.0
+        if now - self._last_decrease < round_trip:
+            return
+        self._last_decrease = now
+        self.concurrency = max(self.min_concurrency,
+                               self.concurrency * self.decrease)
+        self.rate = max(self.min_rate, self.rate * self.decrease)
+        # Latency is judged again on the responses after the decrease, so
+        # the limits recover once it comes back
+        if self._min_latencies:
+            self._latency = self._baseline()
+
+    def describe(self) -> Dict[str, str]:
+        """
+        Return current limits for the progress bar.
+        """
+        return {
+            'limit': f'{int(self.concurrency)}',
+            'rate': f'{self.rate:.1f}/s',
+        }
+
+
+class HostLimiters():
+    """
+    Separate adaptive limiter for every requested host.
+
+    Attributes:
+        kwargs: Arguments of created `AdaptiveLimiter`.
+    """
+
+    def __init__(self, **kwargs) -> None:
+        """
+        Init HostLimiters
+        """
+        self.kwargs = kwargs
+        self._limiters = {}
+
+    def get(self, url: str) -> AdaptiveLimiter:
+        """
+        Return the limiter of the url host.
+
+        Args:
+            url: Requested url.
+        """
+        host = urlsplit(url).netloc
+        if host not in self._limiters:
+            self._limiters[host] = AdaptiveLimiter(**self.kwargs)
+        return self._limiters[host]
+
+    def describe(self) -> Dict[str, str]:
+        """
+        Return current limits of the most used host for the progress bar.
+        """
+        if len(self._limiters) == 0:
+            return {}
+        limiter = max(self._limiters.values(), key=lambda x: x.rate)
+        return limiter.describe()
@@ -0,0 +1,212 @@
+"""
+Boolean term queries over index segments
+"""
+import re
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from task_2.codec import ALL_FIELDS, FIELDS
+from task_2.segment import Segment
+
+# Query nodes: ('term', term, fields), ('and', children), ('or', children)
+# and ('not', child)
+Node = Tuple
+# Words, field prefixes, parentheses and the negation sign
+_QUERY_TOKEN = re.compile(r'(' + '|'.join(FIELDS) +
+                          r'):|(\()|(\))|(-)(?=[\w(])|([^\s()]+)')
+
+
+def _tokenize_query(query: str) -> List[Tuple[str, str]]:
+    tokens = []
+    for match in _QUERY_TOKEN.finditer(query):
+        field, opening, closing, minus, word = match.groups()
+        if field is not None:
+            tokens.append(('field', field))
+        elif opening is not None or closing is not None:
+            tokens.append((opening or closing, opening or closing))
+        elif minus is not None:
+            tokens.append(('NOT', minus))
+        elif word in ('AND', 'OR', 'NOT'):
+            tokens.append((word, word))
+        else:
+            tokens.append(('word', word))
+    return tokens
+
+
+class QueryParser():
+    """
+    Parser of boolean queries.
+
+    Words next to each other must all be in a post, `OR` matches any of its
+    sides and `NOT` or `-` excludes posts. `NOT` binds tighter than `AND`,
+    and `AND` tighter than `OR`, parentheses group. A word may be limited
+    to a field with `title:`, `tags:`, `habs:` or `content:`.
+
+    Words are normalized the same way as the indexed text. Words without
+    terms, e.g. stopwords, are left out of the query.
+
+    Attributes:
+        normalize: Function splitting a word into terms.
+    """
+
+    def __init__(self, normalize: Callable[[str], List[str]]) -> None:
+        """
+        Init QueryParser
+        """
+        self.normalize = normalize
+        self._tokens = []
+        self._position = 0
+
+    def parse(self, query: str) -> Optional[Node]:
+        """
+        Parse the query.
+
+        Args:
+            query: Query text.
+
+        Returns:
+            Root node of the query, None if the query has no terms.
+
+        Raises:
+            ValueError: Unbalanced parentheses or a missing operand.
+        """
+        self._tokens = _tokenize_query(query)
+        self._position = 0
+        node = self._parse_or()
+        if self._position < len(self._tokens):
+            raise ValueError(f'Unexpected "{self._tokens[self._position][1]}"')
+        return node
+
+    def _peek(self) -> Optional[str]:
+        if self._position < len(self._tokens):
+            return self._tokens[self._position][0]
+        return None
+
+    def _parse_or(self) -> Optional[Node]:
+        children = [self._parse_and()]
+        while self._peek() == 'OR':
+            self._position += 1
+            children.append(self._parse_and())
+        children = [child for child in children if child is not None]
+        if len(children) == 0:
+            return None
+        return children[0] if len(children) == 1 else ('or', children)
+
+    def _parse_and(self) -> Optional[Node]:
+        children = []
+        while self._peek() not in (None, 'OR', ')'):
+            if self._peek() == 'AND':
+                self._position += 1
+                continue
+            children.append(self._parse_not())
+        children = [child for child in children if child is not None]
+        if len(children) == 0:
+            return None
+        return children[0] if len(children) == 1 else ('and', children)
+
+    def _parse_not(self) -> Optional[Node]:
+        if self._peek() == 'NOT':
+            self._position += 1
+            child = self._parse_not()
+            return None if child is None else ('not', child)
+        return self._parse_atom()
+
+    def _parse_atom(self) -> Optional[Node]:
+        if self._peek() is None:
+            raise ValueError('Unexpected end of the query')
+        kind, value = self._tokens[self._position]
+        self._position += 1
+        if kind == '(':
+            node = self._parse_or()
+            if self._peek() != ')':
+                raise ValueError('Unbalanced parentheses')
+            self._position += 1
+            return node
+        if kind == ')':
+            raise ValueError('Unbalanced parentheses')
+
+        fields = ALL_FIELDS
+        if kind == 'field':
+            fields = 1 << FIELDS.index(value)
+            if self._peek() != 'word':
+                raise ValueError(f'No word after "{value}:"')
+            _, value = self._tokens[self._position]
+            self._position += 1
+        elif kind != 'word':
+            raise ValueError(f'Unexpected "{value}"')
+        terms = self.normalize(value)
+        if len(terms) == 0:
+            return None
+        nodes = [('term', term, fields) for term in terms]
+        return nodes[0] if len(nodes) == 1 else ('and', nodes)
+
+
+def _cost(node: Node, segment: Segment) -> int:
+    kind = node[0]
+    if kind == 'term':
+        postings = segment.postings(node[1])
+        return 0 if postings is None else postings.df
+    if kind == 'and':
+        return min(_cost(child, segment) for child in node[1])
+    if kind == 'or':
+        return sum(_cost(child, segment) for child in node[1])
+    return len(segment)
+
+
+def _difference(docs: Sequence[int], excluded: Sequence[int]) -> List[int]:
+    excluded = set(excluded)
+    return [doc for doc in docs if doc not in excluded]
+
+
+def _intersect(docs: Sequence[int], node: Node,
+               segment: Segment) -> List[int]:
+    """
+    Return the documents that match the node, terms are checked through
+    their skip tables instead of being decoded in full.
+    """
+    if node[0] == 'term':
+        postings = segment.postings(node[1])
+        return [] if postings is None else postings.intersect(docs, node[2])
+    if node[0] == 'not':
+        return _difference(docs, _intersect(docs, node[1], segment))
+    matched = set(evaluate(node, segment))
+    return [doc for doc in docs if doc in matched]
+
+
+def evaluate(node: Node, segment: Segment) -> List[int]:
+    """
+    Return the documents of the segment that match the query.
+
+    Conjunctions start from their rarest part and only check the
+    remaining documents against the other parts.
+
+    Args:
+        node: Root node of the query, see `QueryParser`.
+        segment: Index segment.
+
+    Returns:
+        Ascending document numbers.
+    """
+    kind = node[0]
+    if kind == 'term':
+        postings = segment.postings(node[1])
+        return [] if postings is None else postings.docs(node[2])
+    if kind == 'or':
+        docs = set()
+        for child in node[1]:
+            docs.update(evaluate(child, segment))
+        return sorted(docs)
+    if kind == 'not':
+        return _difference(range(len(segment)), evaluate(node[1], segment))
+
+    children = sorted(node[1], key=lambda child: _cost(child, segment))
+    positive = [child for child in children if child[0] != 'not']
+    if len(positive) > 0:
+        docs = evaluate(positive[0], segment)
+        children = [child for child in children if child is not positive[0]]
+    else:
+        docs = range(len(segment))
+    for child in children:
+        if len(docs) == 0:
+            break
+        docs = _intersect(docs, child, segment)
+    return list(docs)
@@ -0,0 +1,191 @@
+"""
+Delta and varint coding of posting blocks
+"""
+import struct
+from functools import lru_cache
+from itertools import accumulate
+from typing import List, Sequence, Tuple
+
+# The number of postings in a block, blocks are the unit of skipping
+BLOCK_SIZE = 128
+
+# Fields of a posting as bits of its field mask
+FIELDS = ('content', 'title', 'tags', 'habs')
+ALL_FIELDS = (1 << len(FIELDS)) - 1
+# Positions of the set bits of every mask
+MASK_FIELDS = tuple(
+    tuple(field for field in range(len(FIELDS)) if mask >> field & 1)
+    for mask in range(ALL_FIELDS + 1))
+
+# Skip entry of a block: the last document, the end offset of the block
+# relative to the postings of the term, the length of its documents part,
+# and the impacts of the block: the largest term frequency in every field
+# and the smallest length of that field among the documents with the term
+SKIP = struct.Struct(f'<IIH{len(FIELDS)}H{len(FIELDS)}I')
+# Larger term frequencies are stored in impacts as this value, which
+# stands for an unknown frequency
+MAX_IMPACT_TF = 0xFFFF
+
+_LOW_BYTES = bytes(range(0x80))
+
+
+def encode_varint(value: int, out: bytearray) -> None:
+    """
+    Append the unsigned integer in 7 bits per byte, the high bit marks that
+    more bytes follow.
+
+    Args:
+        value: Non-negative integer.
+        out: Buffer the bytes are appended to.
+    """
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data: bytes, position: int = 0) -> Tuple[int, int]:
+    """
+    Decode one varint.
+
+    Args:
+        data: Encoded integers.
+        position: Offset of the varint in `data`.
+
+    Returns:
+        Decoded integer and the offset after it.
+    """
+    value = 0
+    shift = 0
+    while data[position] & 0x80:
+        value |= (data[position] & 0x7F) << shift
+        shift += 7
+        position += 1
+    return value | data[position] << shift, position + 1
+
+
+def decode_varints(data: bytes) -> List[int]:
+    """
+    Decode consecutive varints.
+
+    Args:
+        data: Encoded integers.
+
+    Returns:
+        Decoded integers.
+    """
+    # Small integers are stored as they are
+    if len(data) == 0 or max(data) < 0x80:
+        return list(data)
+    values = []
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+    return values
+
+
+@lru_cache(maxsize=65536)
+def _encode_frequencies(tfs: Tuple[int, ...]) -> Tuple[int, bytes]:
+    mask = 0
+    encoded = bytearray()
+    for field, tf in enumerate(tfs):
+        if tf > 0:
+            mask |= 1 << field
+            encode_varint(tf, encoded)
+    return mask, bytes(encoded)
+
+
+def encode_block(docs: Sequence[int], tfs: Sequence[Tuple[int, ...]],
+                 base: int, out: bytearray) -> int:
+    """
+    Append a block of postings.
+
+    A block is the document deltas, a field mask byte per posting and the
+    non-zero term frequencies of every posting, all integers are varints.
+
+    Args:
+        docs: Ascending document numbers.
+        tfs: Term frequencies in every field of `FIELDS` of every document.
+        base: The last document of the previous block, 0 for the first one.
+        out: Buffer the block is appended to.
+
+    Returns:
+        The length of the documents part.
+    """
+    start = len(out)
+    if len(docs) == 1:
+        # Most terms are in a single document
+        encode_varint(docs[0] - base, out)
+        docs_length = len(out) - start
+        mask, frequencies = _encode_frequencies(tuple(tfs[0]))
+        out.append(mask)
+        out += frequencies
+        return docs_length
+
+    deltas = [doc - previous for previous, doc in zip((base, *docs), docs)]
+    if max(deltas) < 0x80:
+        out += bytes(deltas)
+    else:
+        for delta in deltas:
+            if delta < 0x80:
+                out.append(delta)
+            elif delta < 0x4000:
+                out += bytes((delta & 0x7F | 0x80, delta >> 7))
+            else:
+                encode_varint(delta, out)
+    docs_length = len(out) - start
+
+    # Frequencies of a posting are encoded once per distinct tuple
+    encoded = [_encode_frequencies(tuple(doc_tfs)) for doc_tfs in tfs]
+    out += bytes(mask for mask, _ in encoded)
+    out += b''.join(frequencies for _, frequencies in encoded)
+    return docs_length
+
+
+def block_length(data: bytes, docs_length: int) -> int:
+    """
+    Return the number of postings of a block without decoding it.
+
+    Args:
+        data: The block.
+        docs_length: The length of its documents part.
+    """
+    # Every varint ends with a byte without the high bit
+    docs = data[:docs_length]
+    return len(docs) - len(docs.translate(None, _LOW_BYTES))
+
+
+def decode_docs(data: bytes, base: int) -> List[int]:
+    """
+    Decode the documents part of a block.
+
+    Args:
+        data: The documents part.
+        base: The last document of the previous block, 0 for the first one.
+
+    Returns:
+        Ascending document numbers.
+    """
+    return list(accumulate(decode_varints(data), initial=base))[1:]
+
+
+def decode_frequencies(data: bytes, count: int) -> Tuple[bytes, List[int]]:
+    """
+    Decode the field masks and term frequencies of a block.
+
+    Args:
+        data: The block without its documents part.
+        count: The number of postings in the block.
+
+    Returns:
+        Field mask of every posting and the non-zero frequencies of all
+        postings in order, see `MASK_FIELDS`.
+    """
+    return data[:count], decode_varints(data[count:])
@@ -0,0 +1,210 @@
+"""
+Inverted index over processed posts
+"""
+import os
+import json
+from collections import Counter
+from typing import Dict, List
+
+from task_2.boolean import QueryParser, evaluate
+from task_2.codec import FIELDS
+from task_2.ranking import BM25F, Result, top_k
+from task_2.segment import Segment
+from utils.normalizer import Normalizer, STOPWORDS
+
+# Index description listing its segments
+INDEX_META = 'meta.json'
+# Increase when the format of segments changes
+INDEX_VERSION = 2
+# Times the segments of a new description are opened before giving up,
+# a merge may remove them between reading the description and opening
+_OPEN_ATTEMPTS = 5
+
+
+def read_meta(path: str) -> Dict:
+    """
+    Read the index description.
+
+    Args:
+        path: Directory of the index.
+
+    Raises:
+        FileNotFoundError: The directory has no index.
+        ValueError: The index was built by another version.
+    """
+    with open(f'{path}/{INDEX_META}', encoding='utf-8') as file_:
+        meta = json.load(file_)
+    if meta['version'] != INDEX_VERSION:
+        raise ValueError(f'Index version {meta["version"]} is not supported, '
+                         'build the index again')
+    return meta
+
+
+def write_meta(path: str, meta: Dict) -> None:
+    """
+    Replace the index description, readers see either the old or the new
+    one.
+
+    Args:
+        path: Directory of the index.
+        meta: Index description.
+    """
+    temp_path = f'{path}/{INDEX_META}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as file_:
+        json.dump({'version': INDEX_VERSION, 'fields': FIELDS, **meta}, file_)
+    os.replace(temp_path, f'{path}/{INDEX_META}')
+
+
+def index_normalizer(meta: Dict) -> Normalizer:
+    """
+    Return the normalizer the index was built with.
+
+    Args:
+        meta: Index description.
+    """
+    return Normalizer(STOPWORDS if meta['stopwords'] else None, meta['stem'])
+
+
+class InvertedIndex():
+    """
+    Read-only inverted index opened through memory maps.
+
+    The index sees the segments and deletions committed by an updater
+    after it was opened only when it is refreshed, see `refresh`.
+
+    Attributes:
+        path: Directory of the index.
+        normalizer: Normalizer of the indexed text and of queries.
+        segments: Opened segments.
+        scorer: Ranking of the posts.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Init InvertedIndex
+        """
+        self.path = path
+        self.segments = []
+        self._meta_version = None
+        self.refresh()
+
+    def __enter__(self) -> 'InvertedIndex':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return sum(segment.live_documents for segment in self.segments)
+
+    def refresh(self) -> bool:
+        """
+        Open the segments and read the deletions committed since the index
+        was opened or last refreshed. Segments still in the index are kept
+        open, so a refresh without changes costs one `os.stat`.
+
+        Returns:
+            True if the index changed.
+
+        Raises:
+            FileNotFoundError: The directory has no index.
+            ValueError: The index was built by another version.
+        """
+        stat = os.stat(f'{self.path}/{INDEX_META}')
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if version == self._meta_version:
+            return False
+        for attempt in range(_OPEN_ATTEMPTS):
+            meta = read_meta(self.path)
+            try:
+                segments = self._open_segments(meta)
+                break
+            except FileNotFoundError:
+                if attempt + 1 == _OPEN_ATTEMPTS:
+                    raise
+        kept = set(map(id, segments))
+        for segment in self.segments:
+            if id(segment) not in kept:
+                segment.close()
+        self.normalizer = index_normalizer(meta)
+        self._parser = QueryParser(self.normalizer.tokenize)
+        self.segments = segments
+        self.scorer = BM25F(segments)
+        self._meta_version = version
+        return True
+
+    def _open_segments(self, meta: Dict) -> List[Segment]:
+        """
+        Return the segments of the description, opened ones are reused.
+        """
+        opened = {
+            os.path.basename(segment.path): segment
+            for segment in self.segments
+        }
+        deletes = meta.get('deletes', {})
+        segments = []
+        try:
+            for name in meta['segments']:
+                segment = opened.get(name)
+                if segment is None:
+                    segment = Segment(f'{self.path}/{name}', deletes.get(name))
+                else:
+                    segment.load_deletes(deletes.get(name))
+                segments.append(segment)
+        except FileNotFoundError:
+            for segment in segments:
+                if segment not in opened.values():
+                    segment.close()
+            raise
+        return segments
+
+    def search(self, query: str) -> List[int]:
+        """
+        Return the posts matching the boolean query, see `QueryParser`.
+
+        Args:
+            query: Query text.
+
+        Returns:
+            Ascending IDs of the matching posts.
+
+        Raises:
+            ValueError: The query can not be parsed.
+        """
+        node = self._parser.parse(query)
+        if node is None:
+            return []
+        post_ids = []
+        for segment in self.segments:
+            deleted = segment.deleted
+            post_ids += [
+                segment.post_id(doc) for doc in evaluate(node, segment)
+                if doc not in deleted
+            ]
+        return sorted(post_ids)
+
+    def rank(self, query: str, k: int = 10,
+             prune: bool = True) -> List[Result]:
+        """
+        Return the posts with any of the query words ranked by BM25F, see
+        `ranking.top_k`.
+
+        Args:
+            query: Query text, its words are normalized as the indexed
+                text.
+            k: The number of returned posts.
+            prune: If False every posting of the query terms is scored.
+
+        Returns:
+            Post IDs and scores from the best.
+        """
+        terms = Counter(self.normalizer.tokenize(query))
+        return top_k(self.segments, terms, self.scorer, k, prune)
+
+    def close(self) -> None:
+        """
+        Close the segments.
+        """
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
@@ -0,0 +1,364 @@
+"""
+Building of the inverted index from processed posts
+"""
+import os
+import json
+import time
+import shutil
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from tqdm.auto import tqdm
+
+from task_1.post_store import PostStore, post_file_id
+from task_2.codec import FIELDS
+from task_2.index import index_normalizer, write_meta
+from task_2.merger import MERGE_FAN_IN, merge_segments
+from task_2.segment import SegmentWriter
+from utils.normalizer import Normalizer
+
+# Post ID, the number of tokens in every field and term frequencies in
+# every field of every term of a post
+PostTerms = Tuple[int, Tuple[int, ...], Dict[str, Tuple[int, ...]]]
+
+# Approximate memory of in-memory postings: a posting is a document
+# number in an array and a reference to its frequencies, a term is its
+# string, dictionary entry and containers
+POSTING_BYTES = 12
+TERM_BYTES = 400
+DOCUMENT_BYTES = 150
+
+# Normalizer and opened post store of a process started by `build_index`
+_normalizer = None
+_store = None
+
+
+def list_posts(path: str) -> List[Union[int, str]]:
+    """
+    Return the keys of the processed posts, see `read_post`.
+
+    Args:
+        path: Directory of `{post_id}.json` files or a post store.
+
+    Returns:
+        Post IDs of a post store in storage order or names of the json
+        files.
+    """
+    if os.path.exists(f'{path}/index.bin'):
+        with PostStore(path) as store:
+            return sorted(store.ids(), key=store.location)
+    return [
+        file_ for file_ in os.listdir(path) if post_file_id(file_) is not None
+    ]
+
+
+def source_state(path: str) -> Dict:
+    """
+    Return where the changes of the processed posts made after now start,
+    see `updater.IndexUpdater.update`.
+
+    Args:
+        path: Directory of `{post_id}.json` files or a post store.
+
+    Returns:
+        The directory and the size of the index file of a post store or
+        the time in nanoseconds for json files.
+    """
+    if os.path.exists(f'{path}/index.bin'):
+        return {'path': path, 'position': PostStore.index_position(path)}
+    return {'path': path, 'time': time.time_ns()}
+
+
+def read_post(path: str, key: Union[int, str],
+              store: Optional[PostStore] = None) -> Dict:
+    """
+    Read a processed post.
+
+    Args:
+        path: Directory of `{post_id}.json` files or a post store.
+        key: Post ID in a post store or name of a json file.
+        store: Opened post store of `path` if it is a post store.
+    """
+    if store is not None:
+        return store.get(key)
+    with open(f'{path}/{key}', encoding='utf-8') as file_:
+        return json.load(file_)
+
+
+def post_terms(post: Dict, normalizer: Normalizer) -> PostTerms:
+    """
+    Split the indexed fields of a post into terms.
+
+    Args:
+        post: Processed post.
+        normalizer: Normalizer of the indexed text.
+
+    Returns:
+        Post ID, the number of tokens in every field of `FIELDS` and term
+        frequencies in every field of every term.
+    """
+    counts = []
+    lengths = []
+    for name in FIELDS:
+        value = post.get(name) or ''
+        if isinstance(value, list):
+            value = ' '.join(value)
+        tokens = normalizer.tokenize(value)
+        lengths.append(len(tokens))
+        counts.append(Counter(tokens))
+
+    # Content holds most terms, the other fields are small
+    zeros = (0, ) * (len(FIELDS) - 1)
+    terms = {term: (tf, ) + zeros for term, tf in counts[0].items()}
+    for field in range(1, len(FIELDS)):
+        for term, tf in counts[field].items():
+            tfs = terms.get(term, zeros + (0, ))
+            terms[term] = tfs[:field] + (tf, ) + tfs[field + 1:]
+    return int(post['id']), tuple(lengths), terms
+
+
+def _segment_names(path: str) -> List[str]:
+    return sorted(file_ for file_ in os.listdir(path)
+                  if file_.startswith('segment_'))
+
+
+def next_segment_name(path: str) -> str:
+    """
+    Return a segment name not used in the index directory.
+
+    Args:
+        path: Directory of the index.
+    """
+    names = _segment_names(path)
+    number = int(names[-1][len('segment_'):]) + 1 if names else 0
+    return f'segment_{number:05}'
+
+
+class PostingsBuffer():
+    """
+    In-memory postings of posts written as a segment when full
+    (single-pass in-memory indexing, SPIMI).
+
+    Attributes:
+        documents: Post ID and field lengths of every added post.
+        size: Approximate memory of the postings in bytes.
+    """
+
+    def __init__(self) -> None:
+        """
+        Init PostingsBuffer
+        """
+        self.documents = []
+        self.size = 0
+        self._postings = {}
+        # Most postings share a few frequency tuples
+        self._frequencies = {}
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, post_id: int, lengths: Tuple[int, ...],
+            terms: Dict[str, Tuple[int, ...]]) -> None:
+        """
+        Add the terms of a post, see `post_terms`.
+
+        Args:
+            post_id: ID of the post.
+            lengths: The number of tokens in every field.
+            terms: Term frequencies in every field of every term.
+        """
+        doc = len(self.documents)
+        self.documents.append((post_id, lengths))
+        new_terms = 0
+        for term, tfs in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array('I'), [])
+                new_terms += 1
+            postings[0].append(doc)
+            postings[1].append(self._frequencies.setdefault(tfs, tfs))
+        self.size += (DOCUMENT_BYTES + POSTING_BYTES * len(terms) +
+                      TERM_BYTES * new_terms)
+
+    def write(self, path: str) -> None:
+        """
+        Write the postings as a segment.
+
+        Args:
+            path: Directory of the segment.
+        """
+        with SegmentWriter(path) as writer:
+            for post_id, lengths in self.documents:
+                writer.add_document(post_id, lengths)
+            for term in sorted(self._postings):
+                writer.add_term(term, *self._postings[term])
+
+
+def index_runs(path_src: str, keys: Iterable[Union[int, str]],
+               normalizer: Normalizer, path_runs: str, prefix: str,
+               memory_budget: int, store: Optional[PostStore] = None
+               ) -> List[str]:
+    """
+    Index posts into segments holding at most `memory_budget` bytes of
+    postings in memory each (runs).
+
+    Args:
+        path_src: Directory of `{post_id}.json` files or a post store.
+        keys: Keys of the posts, see `list_posts`.
+        normalizer: Normalizer of the indexed text.
+        path_runs: Directory of the runs.
+        prefix: Prefix of the run names.
+        memory_budget: Memory of in-memory postings in bytes.
+        store: Opened post store of `path_src` if it is a post store.
+
+    Returns:
+        Names of the runs in the order of the posts.
+    """
+    names = []
+    buffer = PostingsBuffer()
+    for key in keys:
+        buffer.add(*post_terms(read_post(path_src, key, store), normalizer))
+        if buffer.size >= memory_budget:
+            names.append(f'{prefix}_{len(names):05}')
+            buffer.write(f'{path_runs}/{names[-1]}')
+            buffer = PostingsBuffer()
+    if len(buffer) > 0:
+        names.append(f'{prefix}_{len(names):05}')
+        buffer.write(f'{path_runs}/{names[-1]}')
+    return names
+
+
+def _init_builder(normalizer: Normalizer, path_src: str) -> None:
+    global _normalizer, _store
+    _normalizer = normalizer
+    if os.path.exists(f'{path_src}/index.bin'):
+        _store = PostStore(path_src)
+
+
+def _index_runs(path_src: str, keys: List[Union[int, str]], path_runs: str,
+                prefix: str, memory_budget: int) -> List[str]:
+    return index_runs(path_src, keys, _normalizer, path_runs, prefix,
+                      memory_budget, _store)
+
+
+def _merge_runs(path_runs: str, names: List[str], executor) -> List[str]:
+    """
+    Merge runs in groups of `MERGE_FAN_IN` until at most that many are
+    left, groups are merged in parallel.
+    """
+    level = 0
+    while len(names) > MERGE_FAN_IN:
+        groups = [
+            names[start:start + MERGE_FAN_IN]
+            for start in range(0, len(names), MERGE_FAN_IN)
+        ]
+        merged = [f'merged_{level}_{number:05}' for number in
+                  range(len(groups))]
+        sources = [[f'{path_runs}/{name}' for name in group]
+                   for group in groups]
+        destinations = [f'{path_runs}/{name}' for name in merged]
+        if executor is None:
+            list(map(merge_segments, sources, destinations))
+        else:
+            list(executor.map(merge_segments, sources, destinations))
+        for name in names:
+            shutil.rmtree(f'{path_runs}/{name}')
+        names = merged
+        level += 1
+    return names
+
+
+def build_index(path_src: str = 'data/processed_posts',
+                path_dest: str = 'data/index',
+                stem: bool = False,
+                stopwords: bool = False,
+                max_workers: int = 1,
+                memory_budget: int = 256) -> int:
+    """
+    Build the inverted index over content, title, tags and habs of
+    processed posts.
+
+    Posts are split between processes in contiguous parts. A process
+    reads the posts of its part and collects their postings in memory
+    until `memory_budget` is reached, then writes them as a sorted segment
+    (run). Runs are combined into one segment by a k-way merge of their
+    lexicons, so peak memory depends on the budget and the number of
+    processes, not on the number of posts. The new index replaces the
+    index in `path_dest` when it is complete, it must not be updated
+    meanwhile, see `updater.IndexUpdater`.
+
+    Args:
+        path_src: Directory of `{post_id}.json` files or a post store.
+        path_dest: Directory of the index.
+        stem: If True terms are stemmed, see `utils.normalizer.Normalizer`.
+        stopwords: If True stopwords are not indexed.
+        max_workers: The number of processes building runs.
+        memory_budget: Memory of in-memory postings of a process in
+            megabytes.
+
+    Returns:
+        The number of indexed posts.
+    """
+    if not os.path.exists(path_dest):
+        os.makedirs(path_dest)
+    meta = {'stem': stem, 'stopwords': stopwords}
+    normalizer = index_normalizer(meta)
+    path_runs = f'{path_dest}/runs'
+    if os.path.exists(path_runs):
+        shutil.rmtree(path_runs)
+    os.makedirs(path_runs)
+
+    source = source_state(path_src)
+    keys = list_posts(path_src)
+    budget = memory_budget * 2**20
+    if max_workers <= 1:
+        store = None
+        if os.path.exists(f'{path_src}/index.bin'):
+            store = PostStore(path_src)
+        try:
+            names = index_runs(path_src, tqdm(keys, desc='Indexing'),
+                               normalizer, path_runs, 'run_00000', budget,
+                               store)
+        finally:
+            if store is not None:
+                store.close()
+        names = _merge_runs(path_runs, names, None)
+    else:
+        # Several parts per process even out their speed
+        size = max(-(-len(keys) // (4 * max_workers)), 1)
+        parts = [keys[start:start + size]
+                 for start in range(0, len(keys), size)]
+        with ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_builder,
+                initargs=(normalizer, path_src),
+        ) as executor:
+            futures = {
+                executor.submit(_index_runs, path_src, part_keys, path_runs,
+                                f'run_{part:05}', budget): part
+                for part, part_keys in enumerate(parts)
+            }
+            part_names = [[] for _ in parts]
+            with tqdm(total=len(keys), desc='Indexing') as progress_bar:
+                for future in as_completed(futures):
+                    part_names[futures[future]] = future.result()
+                    progress_bar.update(len(parts[futures[future]]))
+            names = _merge_runs(path_runs,
+                                [name for part in part_names
+                                 for name in part], executor)
+
+    old_segments = _segment_names(path_dest)
+    name = next_segment_name(path_dest)
+    if len(names) == 1:
+        os.replace(f'{path_runs}/{names[0]}', f'{path_dest}/{name}')
+    else:
+        merge_segments([f'{path_runs}/{run}' for run in names],
+                       f'{path_dest}/{name}')
+    shutil.rmtree(path_runs)
+
+    write_meta(path_dest, {**meta, 'segments': [name], 'source': source})
+    for old_name in old_segments:
+        shutil.rmtree(f'{path_dest}/{old_name}')
+    return len(keys)
@@ -0,0 +1,78 @@
+"""
+Merging of index segments
+"""
+import heapq
+from array import array
+from itertools import groupby
+from operator import itemgetter
+from typing import Collection, Iterator, Optional, Sequence, Tuple
+
+from task_2.segment import PostingList, Segment, SegmentWriter
+
+# The maximum number of segments merged at once, every opened segment
+# holds five file descriptors
+MERGE_FAN_IN = 64
+
+
+def _numbered_terms(segment: Segment,
+                    number: int) -> Iterator[Tuple[str, int, PostingList]]:
+    for term, postings in segment.iter_terms():
+        yield term, number, postings
+
+
+def merge_segments(paths: Sequence[str],
+                   path: str,
+                   deleted: Optional[Sequence[Collection[int]]] = None
+                   ) -> int:
+    """
+    Merge segments into a new one, documents keep the order of the
+    segments.
+
+    The sorted lexicons of all segments are merged in one pass (k-way
+    merge), so only the postings of one term are in memory at a time.
+    Deleted documents are dropped, postings of the segments without them
+    are copied without decoding.
+
+    Args:
+        paths: Directories of the merged segments, at most
+            `MERGE_FAN_IN`.
+        path: Directory of the new segment.
+        deleted: Numbers of the deleted documents of every segment.
+
+    Returns:
+        The number of documents of the new segment.
+    """
+    segments = [Segment(segment_path) for segment_path in paths]
+    deleted = [
+        frozenset(docs) for docs in (deleted or [()] * len(segments))
+    ]
+    try:
+        with SegmentWriter(path) as writer:
+            offsets = []
+            doc_maps = []
+            for segment, segment_deleted in zip(segments, deleted):
+                offsets.append(writer.documents)
+                doc_map = None
+                if len(segment_deleted) > 0:
+                    doc_map = array('i', [-1]) * segment.documents
+                for doc, (post_id, lengths) in enumerate(
+                        segment.iter_documents()):
+                    if doc in segment_deleted:
+                        continue
+                    if doc_map is not None:
+                        doc_map[doc] = writer.documents - offsets[-1]
+                    writer.add_document(post_id, lengths)
+                doc_maps.append(doc_map)
+
+            # Equal terms come in the order of the segments
+            terms = heapq.merge(*(_numbered_terms(segment, number)
+                                  for number, segment in enumerate(segments)))
+            for term, group in groupby(terms, key=itemgetter(0)):
+                writer.add_merged_term(
+                    term,
+                    [(postings, offsets[number], doc_maps[number])
+                     for _, number, postings in group])
+            return writer.documents
+    finally:
+        for segment in segments:
+            segment.close()
@@ -0,0 +1,376 @@
+"""
+Ranked search over index segments with BM25F and MaxScore pruning
+"""
+import math
+import heapq
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from task_2.codec import FIELDS, MASK_FIELDS, MAX_IMPACT_TF
+from task_2.segment import PostingList, Segment
+
+# Weight of a term occurrence in every field relative to content
+FIELD_WEIGHTS = {'content': 1.0, 'title': 3.0, 'tags': 2.0, 'habs': 1.5}
+K1 = 1.2
+B = 0.75
+# Upper bounds are compared with this relative margin, so rounding errors
+# of differently summed scores never prune a document of the top
+_MARGIN = 1 + 1e-9
+
+# Post ID and score
+Result = Tuple[int, float]
+# Weight of a term, its postings in a segment, the upper bounds of its
+# blocks and of the whole term there
+_Term = Tuple[float, PostingList, List[float], float]
+
+
+class BM25F():
+    """
+    BM25 over the term frequencies of all fields, every frequency is
+    weighted by its field and normalized by the length of the field in the
+    document (BM25F).
+
+    Statistics are collected over all segments, so a post gets the same
+    score in whichever segment it is. Deleted documents count in the
+    number of documents until their segment is merged, as their postings
+    count in document frequencies, average lengths are of the live
+    documents.
+
+    Attributes:
+        weights: Weight of every field of `FIELDS`.
+        documents: The number of documents, deleted ones too.
+        average_lengths: Average number of tokens in every field.
+        k1: Saturation of term frequencies.
+        b: Strength of the length normalization.
+    """
+
+    def __init__(self,
+                 segments: Sequence[Segment],
+                 weights: Optional[Dict[str, float]] = None,
+                 k1: float = K1,
+                 b: float = B) -> None:
+        """
+        Init BM25F
+        """
+        weights = FIELD_WEIGHTS if weights is None else weights
+        self.weights = [weights.get(field, 0.0) for field in FIELDS]
+        self.documents = sum(len(segment) for segment in segments)
+        live_documents = sum(segment.live_documents for segment in segments)
+        lengths = [segment.live_lengths for segment in segments]
+        self.average_lengths = [
+            sum(segment_lengths[field] for segment_lengths in lengths) /
+            max(live_documents, 1) for field in range(len(FIELDS))
+        ]
+        self.k1 = k1
+        self.b = b
+        # The normalized frequency is tf * weight / (base + slope * length)
+        self._base = 1 - b
+        self._slopes = [
+            b / average if average > 0 else 0.0
+            for average in self.average_lengths
+        ]
+
+    def idf(self, df: int) -> float:
+        """
+        Return the inverse document frequency, always positive.
+
+        Args:
+            df: The number of documents with the term.
+        """
+        return math.log(1 + (self.documents - df + 0.5) / (df + 0.5))
+
+    def term_weight(self, df: int, count: int = 1) -> float:
+        """
+        Return the score of a term with an infinite frequency.
+
+        Args:
+            df: The number of documents with the term.
+            count: The number of times the term is in the query.
+        """
+        return count * self.idf(df) * (self.k1 + 1)
+
+    def block_bound(self, weight: float, postings: PostingList,
+                    block: int) -> float:
+        """
+        Return the upper bound of the scores of the documents of a block.
+
+        The highest frequency and the shortest length of every field bound
+        the normalized frequency of every document from above.
+
+        Args:
+            weight: Term weight, see `term_weight`.
+            postings: Postings of the term.
+            block: Number of the block.
+        """
+        max_tfs, min_lengths = postings.block_impacts(block)
+        frequency = 0.0
+        for field, (tf, length) in enumerate(zip(max_tfs, min_lengths)):
+            if tf == 0:
+                continue
+            if tf == MAX_IMPACT_TF:
+                return weight
+            frequency += self.weights[field] * tf / (
+                self._base + self._slopes[field] * length)
+        return weight * frequency / (frequency + self.k1)
+
+    def block_bounds(self, weight: float,
+                     postings: PostingList) -> List[float]:
+        """
+        Return the upper bounds of the scores of every block.
+
+        Args:
+            weight: Term weight, see `term_weight`.
+            postings: Postings of the term.
+        """
+        return [
+            self.block_bound(weight, postings, block)
+            for block in range(postings.blocks)
+        ]
+
+    def score_block(self,
+                    weight: float,
+                    segment: Segment,
+                    postings: PostingList,
+                    block: int,
+                    wanted: Optional[Dict[int, float]] = None
+                    ) -> List[Tuple[int, float]]:
+        """
+        Score the documents of a block, deleted documents are skipped.
+
+        Args:
+            weight: Term weight, see `term_weight`.
+            segment: Segment of the postings.
+            postings: Postings of the term.
+            block: Number of the block.
+            wanted: If given only these documents are scored.
+
+        Returns:
+            Documents and their scores for the term.
+        """
+        docs, masks, tfs = postings.block_postings(block)
+        lengths = [
+            segment.field_lengths(field) for field in range(len(FIELDS))
+        ]
+        deleted = segment.deleted
+        content_lengths = lengths[0]
+        content_weight = self.weights[0]
+        content_slope = self._slopes[0]
+        base = self._base
+        k1 = self.k1
+
+        scores = []
+        position = 0
+        for doc, mask in zip(docs, masks):
+            if (wanted is not None and doc not in wanted) or doc in deleted:
+                position += len(MASK_FIELDS[mask])
+                continue
+            # Most terms are only in the content
+            if mask == 1:
+                frequency = content_weight * tfs[position] / (
+                    base + content_slope * content_lengths[doc])
+                position += 1
+            else:
+                frequency = 0.0
+                for field in MASK_FIELDS[mask]:
+                    frequency += self.weights[field] * tfs[position] / (
+                        base + self._slopes[field] * lengths[field][doc])
+                    position += 1
+            scores.append((doc, weight * frequency / (frequency + k1)))
+        return scores
+
+
+def _threshold(heap: List[Tuple[float, int]], scores: Dict[int, float],
+               k: int) -> float:
+    """
+    Return the lowest score a document needs to get into the top, scores
+    only grow, so the k-th best score so far is a lower bound of it.
+    """
+    threshold = heap[0][0] if len(heap) == k else 0.0
+    if len(scores) >= k:
+        threshold = max(threshold, heapq.nlargest(k, scores.values())[-1])
+    return threshold
+
+
+def _add_first_term(scorer: BM25F, segment: Segment, term: _Term,
+                    scores: Dict[int, float], rest: float,
+                    heap: List[Tuple[float, int]], k: int) -> None:
+    """
+    Score the first term of the segment. Blocks go from the highest upper
+    bound down, once a block can not get a document into the top even with
+    the rest of the terms, the following blocks can not either.
+    """
+    weight, postings, block_bounds, _ = term
+    threshold = heap[0][0] if len(heap) == k else 0.0
+    # Minimum heap of the best scores of the term
+    top = []
+    for block in sorted(range(postings.blocks),
+                        key=lambda block: -block_bounds[block]):
+        if (block_bounds[block] + rest) * _MARGIN < threshold:
+            break
+        for doc, score in scorer.score_block(weight, segment, postings,
+                                             block):
+            scores[doc] = score
+            if len(top) < k:
+                heapq.heappush(top, score)
+            elif score > top[0]:
+                heapq.heapreplace(top, score)
+        if len(top) == k:
+            threshold = max(threshold, top[0])
+
+
+def _add_term(scorer: BM25F, segment: Segment, term: _Term,
+              scores: Dict[int, float], rest: float,
+              threshold: float) -> None:
+    """
+    Score all documents of the term, but the blocks where even the best
+    document scored so far can not get into the top.
+    """
+    weight, postings, block_bounds, _ = term
+    best = max(scores.values(), default=0.0) + rest
+    for block in range(postings.blocks):
+        if (best + block_bounds[block]) * _MARGIN < threshold:
+            continue
+        for doc, score in scorer.score_block(weight, segment, postings,
+                                             block):
+            scores[doc] = scores.get(doc, 0.0) + score
+
+
+def _update_term(scorer: BM25F, segment: Segment, term: _Term,
+                 scores: Dict[int, float], rest: float,
+                 threshold: float) -> None:
+    """
+    Add the term to the scored documents only. A block is decoded only if
+    it holds a document that may still get into the top, the documents that
+    can not are dropped.
+    """
+    weight, postings, block_bounds, _ = term
+    candidates = sorted(scores)
+    last_docs = postings.last_docs
+    block = 0
+    start = 0
+    while start < len(candidates):
+        block = bisect_left(last_docs, candidates[start], block)
+        if block == len(last_docs):
+            break
+        end = bisect_right(candidates, last_docs[block], start)
+        bound = block_bounds[block] + rest
+        wanted = {}
+        for doc in candidates[start:end]:
+            if (scores[doc] + bound) * _MARGIN < threshold:
+                del scores[doc]
+            else:
+                wanted[doc] = scores[doc]
+        if len(wanted) > 0:
+            for doc, score in scorer.score_block(weight, segment, postings,
+                                                 block, wanted):
+                scores[doc] += score
+        start = end
+
+    # Documents without the term can not get more than the rest
+    for doc in candidates[start:]:
+        if doc in scores and (scores[doc] + rest) * _MARGIN < threshold:
+            del scores[doc]
+
+
+def _score_segment(scorer: BM25F, segment: Segment, terms: List[_Term],
+                   heap: List[Tuple[float, int]], k: int,
+                   prune: bool) -> Dict[int, float]:
+    """
+    Score the documents of a segment term at a time (MaxScore).
+
+    Terms go from the highest upper bound down. Once the upper bounds of
+    the remaining terms sum below the threshold of the top, a document
+    without the terms seen so far can not get into the top, so the rest
+    of the terms only update the documents already scored and skip the
+    blocks without them.
+
+    A document is scored by every term in the same order with or without
+    pruning, so its score is the same to the last bit.
+    """
+    scores = {}
+    remaining = [
+        sum(term[3] for term in terms[index:])
+        for index in range(len(terms) + 1)
+    ]
+    for index, term in enumerate(terms):
+        rest = remaining[index + 1]
+        if not prune:
+            _add_term(scorer, segment, term, scores, rest, 0.0)
+        elif index == 0:
+            _add_first_term(scorer, segment, term, scores, rest, heap, k)
+        else:
+            threshold = _threshold(heap, scores, k)
+            if remaining[index] * _MARGIN < threshold:
+                _update_term(scorer, segment, term, scores, rest,
+                             threshold)
+                if len(scores) == 0:
+                    break
+            else:
+                _add_term(scorer, segment, term, scores, rest, threshold)
+    return scores
+
+
+def top_k(segments: Sequence[Segment],
+          terms: Dict[str, int],
+          scorer: BM25F,
+          k: int = 10,
+          prune: bool = True) -> List[Result]:
+    """
+    Return the best scoring posts for the query terms.
+
+    A post matches if it has any of the terms. With `prune` most postings
+    of frequent terms are skipped instead of scored, the result is the
+    same as without it.
+
+    Args:
+        segments: Index segments.
+        terms: Query terms and the number of times every term is in the
+            query.
+        scorer: Scorer with the statistics of the segments.
+        k: The number of returned posts.
+        prune: If False every posting of the terms is scored.
+
+    Returns:
+        Post IDs and scores from the best, posts with equal scores are
+        ordered by their IDs.
+    """
+    if k <= 0 or len(terms) == 0:
+        return []
+    postings = [{term: segment.postings(term)
+                 for term in terms}
+                for segment in segments]
+    dfs = {
+        term: sum(segment_postings[term].df
+                  for segment_postings in postings
+                  if segment_postings[term] is not None)
+        for term in terms
+    }
+
+    # Minimum heap of the top, the larger post ID is dropped from a tie
+    heap = []
+    for segment, segment_postings in zip(segments, postings):
+        segment_terms = []
+        for term, count in terms.items():
+            if segment_postings[term] is None:
+                continue
+            weight = scorer.term_weight(dfs[term], count)
+            block_bounds = scorer.block_bounds(weight,
+                                               segment_postings[term])
+            segment_terms.append((weight, segment_postings[term],
+                                  block_bounds, max(block_bounds)))
+        segment_terms.sort(key=lambda term: -term[3])
+
+        scores = _score_segment(scorer, segment, segment_terms, heap, k,
+                                prune)
+        # Only the best documents of the segment may get into the top
+        lowest = _threshold(heap, scores, k)
+        for doc, score in scores.items():
+            if score < lowest:
+                continue
+            item = (score, -segment.post_id(doc))
+            if len(heap) < k:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+    return [(-post_id, score) for score, post_id in sorted(heap, reverse=True)]
@@ -0,0 +1,740 @@
+"""
+Immutable on-disk segment of the inverted index
+"""
+import os
+import json
+import sys
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from itertools import chain
+from typing import (Collection, FrozenSet, Iterator, List, Optional,
+                    Sequence, Tuple)
+
+from task_2.codec import (ALL_FIELDS, BLOCK_SIZE, FIELDS, MASK_FIELDS,
+                          MAX_IMPACT_TF, SKIP, block_length, decode_docs,
+                          decode_frequencies, decode_varint, encode_block,
+                          encode_varint)
+
+# Post ID and the number of tokens in every field of a document
+DOCUMENT = struct.Struct(f'<I{len(FIELDS)}I')
+# Term offset and length in the term file, document frequency, postings
+# offset and index of the first skip entry of a term
+TERM = struct.Struct('<IHIQI')
+
+SEGMENT_FILES = ('docs.bin', 'lexicon.bin', 'terms.bin', 'postings.bin',
+                 'skips.bin')
+SEGMENT_INFO = 'segment.json'
+# Postings of a term in another segment, the number the first document of
+# that segment gets and the new numbers of its documents relative to it,
+# -1 for a dropped document, None if the documents are kept as they are
+MergedPart = Tuple['PostingList', int, Optional[Sequence[int]]]
+
+
+def write_deletes(path: str, docs: Collection[int], documents: int) -> None:
+    """
+    Write the deleted documents of a segment as a bitmap.
+
+    Args:
+        path: Path of the bitmap file.
+        docs: Numbers of the deleted documents.
+        documents: The number of documents of the segment.
+    """
+    bitmap = bytearray((documents + 7) // 8)
+    for doc in docs:
+        bitmap[doc >> 3] |= 1 << (doc & 7)
+    with open(path, 'wb') as file_:
+        file_.write(bitmap)
+
+
+def read_deletes(path: str) -> FrozenSet[int]:
+    """
+    Read the deleted documents of a segment, see `write_deletes`.
+
+    Args:
+        path: Path of the bitmap file.
+    """
+    with open(path, 'rb') as file_:
+        bitmap = file_.read()
+    return frozenset(
+        number * 8 + bit for number, byte in enumerate(bitmap) if byte
+        for bit in range(8) if byte >> bit & 1)
+
+
+class SegmentWriter():
+    """
+    Write a segment of documents and their sorted terms.
+
+    Documents get consecutive numbers in the order they are added. Terms
+    must be added after all documents in ascending order of their utf-8
+    bytes (the same as the order of strings) with postings in ascending
+    document order, so postings are written in one pass and never held in
+    memory.
+
+    Attributes:
+        path: Directory of the segment.
+        documents: The number of added documents.
+        terms: The number of added terms.
+        lengths: Total number of tokens in every field.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Init SegmentWriter
+        """
+        self.path = path
+        self.documents = 0
+        self.terms = 0
+        self.lengths = [0] * len(FIELDS)
+        self._previous_term = None
+        # Field lengths of every document for the impacts of blocks
+        self._doc_lengths = [array('I') for _ in FIELDS]
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._files = {
+            name: open(f'{path}/{name}', 'wb')
+            for name in SEGMENT_FILES
+        }
+        self._terms_size = 0
+        self._postings_size = 0
+        self._skips_count = 0
+
+    def __enter__(self) -> 'SegmentWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def add_document(self, post_id: int, lengths: Sequence[int]) -> int:
+        """
+        Add a document.
+
+        Args:
+            post_id: ID of the post.
+            lengths: The number of tokens in every field of `FIELDS`.
+
+        Returns:
+            Number of the document in the segment.
+        """
+        self._files['docs.bin'].write(DOCUMENT.pack(post_id, *lengths))
+        for field, length in enumerate(lengths):
+            self.lengths[field] += length
+            self._doc_lengths[field].append(length)
+        self.documents += 1
+        return self.documents - 1
+
+    def _impacts(self, docs: Sequence[int],
+                 tfs: Sequence[Sequence[int]]) -> List[int]:
+        """
+        Return the highest term frequency and the shortest length among
+        the documents with the term in every field, they bound the score of
+        any document of the block.
+        """
+        if len(docs) == 1:
+            # Most terms are in a single document
+            return [min(tf, MAX_IMPACT_TF) for tf in tfs[0]] + [
+                lengths[docs[0]] if tf > 0 else 0
+                for tf, lengths in zip(tfs[0], self._doc_lengths)
+            ]
+
+        max_tfs = []
+        min_lengths = []
+        for field, lengths in enumerate(self._doc_lengths):
+            max_tf = 0
+            min_length = 0
+            for doc, doc_tfs in zip(docs, tfs):
+                tf = doc_tfs[field]
+                if tf == 0:
+                    continue
+                if tf > max_tf:
+                    max_tf = tf
+                if min_length == 0 or lengths[doc] < min_length:
+                    min_length = lengths[doc]
+            max_tfs.append(min(max_tf, MAX_IMPACT_TF))
+            min_lengths.append(min_length)
+        return max_tfs + min_lengths
+
+    def add_term(self, term: str, docs: Sequence[int],
+                 tfs: Sequence[Sequence[int]]) -> None:
+        """
+        Add the postings of a term.
+
+        Args:
+            term: Term greater than the previously added one.
+            docs: Ascending numbers of the documents with the term.
+            tfs: Term frequencies in every field of every document.
+        """
+        encoded = self._check_order(term)
+        postings = bytearray()
+        skips = bytearray()
+        self._encode_blocks(docs, tfs, 0, postings, skips)
+        self._write_term(encoded, len(docs), postings, skips)
+
+    def add_merged_term(self, term: str,
+                        parts: Sequence[MergedPart]) -> None:
+        """
+        Add the postings of a term from other segments.
+
+        Blocks are copied as they are, only the first document delta of a
+        part and the skip entries change. Blocks of different parts are
+        joined while they fit in one, so merging many small segments does
+        not leave nearly empty blocks. Postings are decoded only for the
+        parts that drop documents. A term left without documents is not
+        added.
+
+        Args:
+            term: Term greater than the previously added one.
+            parts: Postings of the term in other segments, in ascending
+                order of the numbers of their documents here.
+        """
+        encoded = self._check_order(term)
+        postings = bytearray()
+        skips = bytearray()
+        if len(parts) == 1 and parts[0][2] is None:
+            # Most terms are in a single segment
+            part, offset, _ = parts[0]
+            data, part_skips = part.postings_bytes()
+            first, position = decode_varint(data)
+            encode_varint(first + offset, postings)
+            shift = len(postings) - position
+            postings += data[position:]
+            for block, (last_doc, end, docs_length,
+                        *impacts) in enumerate(part_skips):
+                skips += SKIP.pack(last_doc + offset, end + shift,
+                                   docs_length + (shift if block == 0 else 0),
+                                   *impacts)
+            self._write_term(encoded, part.df, postings, skips)
+            return
+
+        base = 0
+        df = 0
+        # Block being joined: the number of documents, its parts and impacts
+        count = 0
+        pieces = ([], [], [])
+        impacts = []
+        for part, offset, doc_map in parts:
+            if doc_map is not None:
+                docs, tfs = self._remap(part, offset, doc_map)
+                if len(docs) == 0:
+                    continue
+                if count > 0:
+                    self._write_block(count, pieces, impacts, base,
+                                      postings, skips)
+                    count = 0
+                    pieces = ([], [], [])
+                    impacts = []
+                base = self._encode_blocks(docs, tfs, base, postings, skips)
+                df += len(docs)
+                continue
+
+            df += part.df
+            for block in range(part.blocks):
+                data, skip = part.block_bytes(block)
+                docs_length = skip[2]
+                block_count = block_length(data, docs_length)
+                if count + block_count > BLOCK_SIZE:
+                    self._write_block(count, pieces, impacts, base,
+                                      postings, skips)
+                    count = 0
+                    pieces = ([], [], [])
+                    impacts = []
+                docs = data[:docs_length]
+                if block == 0:
+                    # The first document of a part is stored as it is
+                    first, position = decode_varint(docs)
+                    rebased = bytearray()
+                    encode_varint(first + offset - base, rebased)
+                    docs = rebased + docs[position:]
+                pieces[0].append(docs)
+                pieces[1].append(data[docs_length:docs_length + block_count])
+                pieces[2].append(data[docs_length + block_count:])
+                impacts.append(skip[3:])
+                count += block_count
+                base = skip[0] + offset
+        if count > 0:
+            self._write_block(count, pieces, impacts, base, postings, skips)
+        if df > 0:
+            self._write_term(encoded, df, postings, skips)
+
+    @staticmethod
+    def _remap(part: 'PostingList', offset: int, doc_map: Sequence[int]
+               ) -> Tuple[List[int], List[List[int]]]:
+        """
+        Decode the postings of the kept documents with their new numbers.
+        """
+        docs = []
+        tfs = []
+        zeros = [0] * len(FIELDS)
+        for block in range(part.blocks):
+            block_docs, masks, block_tfs = part.block_postings(block)
+            position = 0
+            for doc, mask in zip(block_docs, masks):
+                fields = MASK_FIELDS[mask]
+                if doc_map[doc] >= 0:
+                    doc_tfs = zeros.copy()
+                    for index, field in enumerate(fields):
+                        doc_tfs[field] = block_tfs[position + index]
+                    docs.append(doc_map[doc] + offset)
+                    tfs.append(doc_tfs)
+                position += len(fields)
+        return docs, tfs
+
+    @staticmethod
+    def _write_block(count: int, pieces: Tuple[List[bytes], ...],
+                     impacts: List[Tuple[int, ...]], last_doc: int,
+                     postings: bytearray, skips: bytearray) -> None:
+        """
+        Append a block joined from the documents, masks and frequencies of
+        blocks.
+        """
+        docs = b''.join(pieces[0])
+        postings += docs
+        postings += b''.join(pieces[1])
+        postings += b''.join(pieces[2])
+        if len(impacts) == 1:
+            skips += SKIP.pack(last_doc, len(postings), len(docs),
+                               *impacts[0])
+            return
+        columns = list(zip(*impacts))
+        max_tfs = [max(column) for column in columns[:len(FIELDS)]]
+        # Fields without the term have zero lengths
+        min_lengths = [
+            min(filter(None, column), default=0)
+            for column in columns[len(FIELDS):]
+        ]
+        skips += SKIP.pack(last_doc, len(postings), len(docs), *max_tfs,
+                           *min_lengths)
+
+    def _check_order(self, term: str) -> bytes:
+        encoded = term.encode('utf-8')
+        if self._previous_term is not None and encoded <= self._previous_term:
+            raise ValueError(f'Term "{term}" is added out of order')
+        self._previous_term = encoded
+        return encoded
+
+    def _encode_blocks(self, docs: Sequence[int],
+                       tfs: Sequence[Sequence[int]], base: int,
+                       postings: bytearray, skips: bytearray) -> int:
+        """
+        Append the postings in full blocks but the last one and return the
+        last document.
+        """
+        for start in range(0, len(docs), BLOCK_SIZE):
+            block_docs = docs[start:start + BLOCK_SIZE]
+            block_tfs = tfs[start:start + BLOCK_SIZE]
+            docs_length = encode_block(block_docs, block_tfs, base, postings)
+            base = block_docs[-1]
+            skips += SKIP.pack(base, len(postings), docs_length,
+                               *self._impacts(block_docs, block_tfs))
+        return base
+
+    def _write_term(self, encoded: bytes, df: int, postings: bytearray,
+                    skips: bytearray) -> None:
+        self._files['lexicon.bin'].write(
+            TERM.pack(self._terms_size, len(encoded), df,
+                      self._postings_size, self._skips_count))
+        self._files['terms.bin'].write(encoded)
+        self._files['postings.bin'].write(postings)
+        self._files['skips.bin'].write(skips)
+        self._terms_size += len(encoded)
+        self._postings_size += len(postings)
+        self._skips_count += len(skips) // SKIP.size
+        self.terms += 1
+
+    def close(self) -> None:
+        """
+        Close the segment files and write the segment statistics.
+        """
+        if self._files is None:
+            return
+        for file_ in self._files.values():
+            file_.close()
+        self._files = None
+        with open(f'{self.path}/{SEGMENT_INFO}', 'w',
+                  encoding='utf-8') as file_:
+            json.dump(
+                {
+                    'documents': self.documents,
+                    'terms': self.terms,
+                    'lengths': dict(zip(FIELDS, self.lengths)),
+                }, file_)
+
+
+class PostingList():
+    """
+    Postings of a term read block by block from the memory map.
+
+    Attributes:
+        df: The number of documents with the term.
+        last_docs: The last document of every block.
+    """
+
+    def __init__(self, postings: mmap.mmap, offset: int, df: int,
+                 skips: Sequence[Tuple[int, ...]]) -> None:
+        """
+        Init PostingList
+        """
+        self.df = df
+        self.last_docs = [skip[0] for skip in skips]
+        self._postings = postings
+        self._offset = offset
+        self._skips = skips
+
+    def __len__(self) -> int:
+        return self.df
+
+    def _block_range(self, block: int) -> Tuple[int, int, int]:
+        start = self._offset
+        if block > 0:
+            start += self._skips[block - 1][1]
+        _, end, docs_length = self._skips[block][:3]
+        return start, start + docs_length, self._offset + end
+
+    @property
+    def blocks(self) -> int:
+        """
+        The number of blocks.
+        """
+        return len(self._skips)
+
+    def block_impacts(self,
+                      block: int) -> Tuple[Tuple[int, ...], Tuple[int, ...]]:
+        """
+        Return what bounds the scores of the documents of the block.
+
+        Args:
+            block: Number of the block.
+
+        Returns:
+            The highest term frequency in every field of `FIELDS`, at most
+            `codec.MAX_IMPACT_TF`, and the shortest length of the field
+            among the documents with the term in it, 0 if none has it.
+        """
+        impacts = self._skips[block][3:]
+        return impacts[:len(FIELDS)], impacts[len(FIELDS):]
+
+    def block_docs(self, block: int) -> List[int]:
+        """
+        Return the documents of the block.
+
+        Args:
+            block: Number of the block.
+        """
+        start, docs_end, _ = self._block_range(block)
+        base = self.last_docs[block - 1] if block > 0 else 0
+        return decode_docs(self._postings[start:docs_end], base)
+
+    def block_postings(self,
+                       block: int) -> Tuple[List[int], bytes, List[int]]:
+        """
+        Return the documents, field masks and term frequencies of the block.
+
+        Args:
+            block: Number of the block.
+
+        Returns:
+            Documents, field mask of every document and the non-zero term
+            frequencies of all documents in order, see `codec.MASK_FIELDS`.
+        """
+        start, docs_end, end = self._block_range(block)
+        base = self.last_docs[block - 1] if block > 0 else 0
+        docs = decode_docs(self._postings[start:docs_end], base)
+        masks, tfs = decode_frequencies(self._postings[docs_end:end],
+                                        len(docs))
+        return docs, masks, tfs
+
+    def postings_bytes(self) -> Tuple[bytes, Sequence[Tuple[int, ...]]]:
+        """
+        Return all encoded blocks and their skip entries.
+        """
+        return (self._postings[self._offset:self._offset + self._skips[-1][1]],
+                self._skips)
+
+    def block_bytes(self, block: int) -> Tuple[bytes, Tuple[int, ...]]:
+        """
+        Return the encoded block and its skip entry.
+
+        Args:
+            block: Number of the block.
+        """
+        start, _, end = self._block_range(block)
+        return self._postings[start:end], self._skips[block]
+
+    def docs(self, fields: int = ALL_FIELDS) -> List[int]:
+        """
+        Return all documents with the term.
+
+        Args:
+            fields: Mask of the fields the term must be in, see
+            `codec.FIELDS`.
+        """
+        docs = []
+        for block in range(len(self._skips)):
+            if fields == ALL_FIELDS:
+                docs += self.block_docs(block)
+            else:
+                block_docs, masks, _ = self.block_postings(block)
+                docs += [
+                    doc for doc, mask in zip(block_docs, masks)
+                    if mask & fields
+                ]
+        return docs
+
+    def intersect(self,
+                  candidates: Sequence[int],
+                  fields: int = ALL_FIELDS) -> List[int]:
+        """
+        Return the candidates with the term, only the blocks that may hold
+        a candidate are decoded.
+
+        Args:
+            candidates: Ascending document numbers.
+            fields: Mask of the fields the term must be in.
+        """
+        found = []
+        block = -1
+        block_docs = set()
+        for doc in candidates:
+            if block < 0 or doc > self.last_docs[block]:
+                block = bisect_left(self.last_docs, doc, max(block, 0))
+                if block == len(self.last_docs):
+                    break
+                if fields == ALL_FIELDS:
+                    block_docs = set(self.block_docs(block))
+                else:
+                    docs, masks, _ = self.block_postings(block)
+                    block_docs = {
+                        doc for doc, mask in zip(docs, masks) if mask & fields
+                    }
+            if doc in block_docs:
+                found.append(doc)
+        return found
+
+
+def _map(path: str) -> Optional[mmap.mmap]:
+    with open(path, 'rb') as file_:
+        if os.fstat(file_.fileno()).st_size == 0:
+            return None  # Empty files can not be mapped
+        return mmap.mmap(file_.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class Segment():
+    """
+    Read-only segment opened through memory maps.
+
+    Nothing is read until it is needed: a term is found by binary search
+    over the sorted lexicon and only its postings are decoded.
+
+    Deleted documents stay in the segment files until the segment is
+    merged, they are listed in a bitmap file of the segment, see
+    `write_deletes`.
+
+    Attributes:
+        path: Directory of the segment.
+        documents: The number of documents, deleted ones too.
+        terms: The number of terms.
+        lengths: Total number of tokens in every field.
+        deletes: Name of the bitmap file of deleted documents or None.
+        deleted: Numbers of the deleted documents.
+    """
+
+    def __init__(self, path: str, deletes: Optional[str] = None) -> None:
+        """
+        Init Segment
+        """
+        self.path = path
+        self.deletes = None
+        self.deleted = frozenset()
+        self.load_deletes(deletes)
+        with open(f'{path}/{SEGMENT_INFO}', encoding='utf-8') as file_:
+            info = json.load(file_)
+        self.documents = info['documents']
+        self.terms = info['terms']
+        self.lengths = [info['lengths'][field] for field in FIELDS]
+        self._maps = {name: _map(f'{path}/{name}') for name in SEGMENT_FILES}
+        # Field lengths of all documents, read when they are first needed
+        self._field_lengths = None
+
+    def __enter__(self) -> 'Segment':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self.documents
+
+    @property
+    def live_documents(self) -> int:
+        """
+        The number of documents that are not deleted.
+        """
+        return self.documents - len(self.deleted)
+
+    @property
+    def live_lengths(self) -> List[int]:
+        """
+        Total number of tokens in every field of the documents that are not
+        deleted.
+        """
+        if len(self.deleted) == 0:
+            return self.lengths
+        return [
+            total - sum(self.field_lengths(field)[doc] for doc in self.deleted)
+            for field, total in enumerate(self.lengths)
+        ]
+
+    def load_deletes(self, deletes: Optional[str]) -> None:
+        """
+        Read the deleted documents from a bitmap file of the segment.
+
+        Args:
+            deletes: Name of the bitmap file, None if no document is
+                deleted.
+        """
+        if deletes != self.deletes:
+            self.deleted = (frozenset() if deletes is None else
+                            read_deletes(f'{self.path}/{deletes}'))
+            self.deletes = deletes
+
+    def post_id(self, doc: int) -> int:
+        """
+        Return the post ID of the document.
+
+        Args:
+            doc: Number of the document.
+        """
+        return DOCUMENT.unpack_from(self._maps['docs.bin'],
+                                    doc * DOCUMENT.size)[0]
+
+    def doc_lengths(self, doc: int) -> Tuple[int, ...]:
+        """
+        Return the number of tokens in every field of the document.
+
+        Args:
+            doc: Number of the document.
+        """
+        return DOCUMENT.unpack_from(self._maps['docs.bin'],
+                                    doc * DOCUMENT.size)[1:]
+
+    def field_lengths(self, field: int) -> Sequence[int]:
+        """
+        Return the number of tokens in the field of every document.
+
+        Args:
+            field: Position of the field in `FIELDS`.
+        """
+        if self._field_lengths is None:
+            records = array('I')
+            if self._maps['docs.bin'] is not None:
+                records.frombytes(self._maps['docs.bin'])
+            if sys.byteorder == 'big':
+                records.byteswap()
+            self._field_lengths = [
+                records[1 + index::len(FIELDS) + 1]
+                for index in range(len(FIELDS))
+            ]
+        return self._field_lengths[field]
+
+    def iter_documents(self) -> Iterator[Tuple[int, Tuple[int, ...]]]:
+        """
+        Iterate over the post ID and the field lengths of every document.
+        """
+        if self._maps['docs.bin'] is None:
+            return
+        for post_id, *lengths in DOCUMENT.iter_unpack(
+                self._maps['docs.bin']):
+            yield post_id, tuple(lengths)
+
+    def _term_record(self, index: int) -> Tuple[int, ...]:
+        return TERM.unpack_from(self._maps['lexicon.bin'], index * TERM.size)
+
+    def _term_bytes(self, index: int) -> bytes:
+        offset, length, *_ = self._term_record(index)
+        return self._maps['terms.bin'][offset:offset + length]
+
+    def term(self, index: int) -> str:
+        """
+        Return the term by its position in the sorted lexicon.
+
+        Args:
+            index: Position of the term.
+        """
+        return self._term_bytes(index).decode('utf-8')
+
+    def find(self, term: str) -> Optional[int]:
+        """
+        Return the position of the term in the lexicon, None if the term is
+        not in the segment.
+
+        Args:
+            term: Normalized term.
+        """
+        encoded = term.encode('utf-8')
+        low, high = 0, self.terms
+        while low < high:
+            middle = (low + high) // 2
+            if self._term_bytes(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.terms and self._term_bytes(low) == encoded:
+            return low
+        return None
+
+    def _postings_at(self, index: int) -> PostingList:
+        # Blocks of merged terms may be not full, so the number of blocks
+        # comes from the next term
+        if index + 1 < self.terms:
+            end = self._term_record(index + 1)[4]
+        else:
+            end = len(self._maps['skips.bin']) // SKIP.size
+        return self._postings(self._term_record(index), end)
+
+    def _postings(self, record: Tuple[int, ...], end: int) -> PostingList:
+        _, _, df, offset, skip = record
+        skips = list(
+            SKIP.iter_unpack(
+                self._maps['skips.bin'][skip * SKIP.size:end * SKIP.size]))
+        return PostingList(self._maps['postings.bin'], offset, df, skips)
+
+    def postings(self, term: str) -> Optional[PostingList]:
+        """
+        Return the postings of the term, None if the term is not in the
+        segment.
+
+        Args:
+            term: Normalized term.
+        """
+        index = self.find(term)
+        if index is None:
+            return None
+        return self._postings_at(index)
+
+    def iter_terms(self) -> Iterator[Tuple[str, PostingList]]:
+        """
+        Iterate over all terms and their postings in ascending term order.
+        """
+        if self.terms == 0:
+            return
+        records = TERM.iter_unpack(self._maps['lexicon.bin'])
+        record = next(records)
+        for next_record in chain(records, [None]):
+            end = (next_record[4] if next_record is not None else
+                   len(self._maps['skips.bin']) // SKIP.size)
+            offset, length, *_ = record
+            term = self._maps['terms.bin'][offset:offset + length]
+            yield term.decode('utf-8'), self._postings(record, end)
+            record = next_record
+
+    def close(self) -> None:
+        """
+        Unmap the segment files.
+        """
+        for map_ in self._maps.values():
+            if map_ is not None:
+                map_.close()
+        self._maps = {}
+
@@ -0,0 +1,534 @@
+"""
+Incremental updates of the inverted index
+"""
+import os
+import json
+import math
+import time
+import zlib
+import shutil
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Collection, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from task_1.post_store import PostStore, post_file_id
+from task_2.index import index_normalizer, read_meta, write_meta
+from task_2.indexer import PostingsBuffer, next_segment_name, post_terms
+from task_2.merger import MERGE_FAN_IN, merge_segments
+from task_2.segment import Segment, write_deletes
+
+# Segments of about the same size are merged when there are this many
+MERGE_FACTOR = 4
+# Segments with fewer live documents are all of the smallest size
+MIN_MERGE_DOCUMENTS = 1000
+# A segment with a larger share of deleted documents is merged alone
+MAX_DELETED_SHARE = 0.5
+# The number of changed posts of the source applied in one commit
+UPDATE_BATCH = 10000
+
+
+def plan_merge(segments: Sequence[Tuple[str, int, int]],
+               merge_factor: int = MERGE_FACTOR,
+               min_documents: int = MIN_MERGE_DOCUMENTS) -> List[str]:
+    """
+    Choose the segments to merge next (size-tiered merging).
+
+    Segments are grouped in tiers by their live documents, a tier holds
+    sizes up to `merge_factor` times larger than the previous one. The
+    smallest tier with `merge_factor` segments is merged, so a document is
+    merged about log(documents) times. Without one a segment with mostly
+    deleted documents is merged alone to drop them.
+
+    Args:
+        segments: Name, the number of documents and the number of deleted
+            documents of every segment in index order.
+        merge_factor: The number of segments of a tier that are merged.
+        min_documents: Segments smaller than this are in the first tier.
+
+    Returns:
+        Names of the segments to merge in index order, empty if none.
+    """
+    tiers = {}
+    for name, documents, deleted in segments:
+        live = max(documents - deleted, min_documents)
+        tier = int(math.log(live / min_documents, merge_factor))
+        tiers.setdefault(tier, []).append(name)
+    for tier in sorted(tiers):
+        if len(tiers[tier]) >= merge_factor:
+            return tiers[tier][:MERGE_FAN_IN]
+
+    for name, documents, deleted in segments:
+        if deleted > MAX_DELETED_SHARE * documents:
+            return [name]
+    return []
+
+
+class IndexUpdater():
+    """
+    Update the inverted index as posts are added, changed and deleted
+    without building it again (log-structured merging).
+
+    New and changed posts are indexed into a new small segment. The older
+    version of a changed or deleted post stays in its segment and is
+    marked in the bitmap of deleted documents of the segment, so segments
+    are never rewritten. Every update is committed by replacing the index
+    description, `InvertedIndex.refresh` sees it at once. Segments are
+    merged in the background by size, see `plan_merge`, merging drops the
+    deleted documents.
+
+    Note:
+        Only one updater may work on an index at a time, and the index
+        must not be built by `indexer.build_index` meanwhile.
+
+    Attributes:
+        path: Directory of the index.
+        merge_factor: The number of segments of about the same size that
+            are merged.
+        min_documents: Segments with fewer live documents are merged as if
+            they had this many.
+        memory_budget: Memory of the in-memory postings of a new segment in
+            bytes.
+        background: If True segments are merged by a thread in another
+            process, otherwise while updating.
+    """
+
+    def __init__(self,
+                 path: str = 'data/index',
+                 merge_factor: int = MERGE_FACTOR,
+                 min_documents: int = MIN_MERGE_DOCUMENTS,
+                 memory_budget: int = 64,
+                 background: bool = True) -> None:
+        """
+        Init IndexUpdater
+        """
+        self.path = path
+        self.merge_factor = merge_factor
+        self.min_documents = min_documents
+        self.memory_budget = memory_budget * 2**20
+        self.background = background
+        self._meta = read_meta(path)
+        self._normalizer = index_normalizer(self._meta)
+        self._meta.setdefault('deletes', {})
+        self._generation = self._meta.get('generation', 0)
+
+        # Post ID of every document and the deleted documents of every
+        # segment, and the segment and document of every live post
+        self._post_ids = {}
+        self._deleted = {}
+        self._locations = {}
+        for name in self._meta['segments']:
+            self._load_segment(name, self._meta['deletes'].get(name))
+        self._remove_unused()
+        self._number = int(next_segment_name(path)[len('segment_'):])
+
+        self._lock = threading.RLock()
+        self._merging = set()
+        self._merge_thread = None
+        self._merge_requested = False
+        self._executor = None
+        self._store = None
+        if background:
+            self._executor = ProcessPoolExecutor(max_workers=1)
+
+    def __enter__(self) -> 'IndexUpdater':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._locations)
+
+    @property
+    def segments(self) -> List[str]:
+        """
+        Names of the segments of the index.
+        """
+        return list(self._meta['segments'])
+
+    def _load_segment(self, name: str, deletes: Optional[str]) -> None:
+        with Segment(f'{self.path}/{name}', deletes) as segment:
+            post_ids = array('I')
+            deleted = set(segment.deleted)
+            for doc, (post_id, _) in enumerate(segment.iter_documents()):
+                post_ids.append(post_id)
+                if doc not in deleted:
+                    self._locations[post_id] = (name, doc)
+        self._post_ids[name] = post_ids
+        self._deleted[name] = deleted
+
+    def _remove_unused(self) -> None:
+        """
+        Remove segments and bitmaps left by an interrupted update.
+        """
+        for name in os.listdir(self.path):
+            if not name.startswith('segment_'):
+                continue
+            if name not in self._post_ids:
+                shutil.rmtree(f'{self.path}/{name}')
+                continue
+            for file_ in os.listdir(f'{self.path}/{name}'):
+                if (file_.startswith('deleted_') and
+                        file_ != self._meta['deletes'].get(name)):
+                    os.remove(f'{self.path}/{name}/{file_}')
+
+    def _new_segment_name(self) -> str:
+        with self._lock:
+            name = f'segment_{self._number:05}'
+            self._number += 1
+            return name
+
+    def add_posts(self, posts: Iterable[Dict]) -> int:
+        """
+        Index new or changed posts, the older version of a post is deleted.
+
+        Args:
+            posts: Processed posts, a post given twice is indexed as its
+                last version.
+
+        Returns:
+            The number of indexed posts.
+        """
+        return self._apply(posts, ())[0]
+
+    def delete_posts(self, post_ids: Iterable[int]) -> int:
+        """
+        Delete posts from the index.
+
+        Args:
+            post_ids: IDs of the posts, posts not in the index are ignored.
+
+        Returns:
+            The number of deleted posts.
+        """
+        return self._apply((), post_ids)[1]
+
+    def _apply(self,
+               posts: Iterable[Dict],
+               post_ids: Iterable[int],
+               source: Optional[Dict] = None) -> Tuple[int, int]:
+        """
+        Index the posts into new segments, delete the posts and commit the
+        changes at once.
+        """
+        # Name and documents of every new segment
+        written = []
+        buffer = PostingsBuffer()
+        for post in posts:
+            buffer.add(*post_terms(post, self._normalizer))
+            if buffer.size >= self.memory_budget:
+                written.append((self._new_segment_name(), buffer.documents))
+                buffer.write(f'{self.path}/{written[-1][0]}')
+                buffer = PostingsBuffer()
+        if len(buffer) > 0:
+            written.append((self._new_segment_name(), buffer.documents))
+            buffer.write(f'{self.path}/{written[-1][0]}')
+
+        with self._lock:
+            changed = set()
+            deleted = 0
+            for post_id in post_ids:
+                location = self._locations.pop(int(post_id), None)
+                if location is not None:
+                    self._deleted[location[0]].add(location[1])
+                    changed.add(location[0])
+                    deleted += 1
+
+            for name, documents in written:
+                self._post_ids[name] = array('I')
+                self._deleted[name] = set()
+                for doc, (post_id, _) in enumerate(documents):
+                    self._post_ids[name].append(post_id)
+                    # The older version may be in the same update
+                    location = self._locations.get(post_id)
+                    if location is not None:
+                        self._deleted[location[0]].add(location[1])
+                        changed.add(location[0])
+                    self._locations[post_id] = (name, doc)
+                self._meta['segments'].append(name)
+
+            if source is not None:
+                self._meta['source'] = source
+            if len(written) > 0 or len(changed) > 0 or source is not None:
+                self._commit(changed)
+                self._schedule_merge()
+        return sum(len(documents) for _, documents in written), deleted
+
+    def _commit(self, changed: Collection[str],
+                removed: Collection[str] = ()) -> None:
+        """
+        Write the bitmaps of the segments with new deletions and replace
+        the index description, then remove what it no longer refers to.
+        """
+        self._generation += 1
+        deletes = self._meta['deletes']
+        old_files = []
+        removed = set(removed)
+        for name in changed:
+            if name in removed:
+                continue
+            if (len(self._deleted[name]) == len(self._post_ids[name]) and
+                    name not in self._merging):
+                # Nothing is left to search or merge
+                removed.add(name)
+                continue
+            if name in deletes:
+                old_files.append(f'{self.path}/{name}/{deletes[name]}')
+            deletes[name] = f'deleted_{self._generation:06}.bin'
+            write_deletes(f'{self.path}/{name}/{deletes[name]}',
+                          self._deleted[name], len(self._post_ids[name]))
+
+        for name in removed:
+            deletes.pop(name, None)
+            del self._post_ids[name]
+            del self._deleted[name]
+        self._meta['segments'] = [
+            name for name in self._meta['segments'] if name not in removed
+        ]
+        self._meta['generation'] = self._generation
+        write_meta(self.path, self._meta)
+
+        # Readers opening the older description retry with the new one
+        for path in old_files:
+            os.remove(path)
+        for name in removed:
+            shutil.rmtree(f'{self.path}/{name}')
+
+    def _schedule_merge(self) -> None:
+        if not self.background:
+            while self.merge():
+                pass
+            return
+        with self._lock:
+            self._merge_requested = True
+            if self._merge_thread is None:
+                self._merge_thread = threading.Thread(target=self._merge_loop,
+                                                      daemon=True)
+                self._merge_thread.start()
+
+    def _merge_loop(self) -> None:
+        try:
+            while True:
+                with self._lock:
+                    if not self._merge_requested:
+                        return
+                    self._merge_requested = False
+                while self.merge():
+                    pass
+        finally:
+            with self._lock:
+                self._merge_thread = None
+
+    def merge(self) -> bool:
+        """
+        Merge the segments chosen by `plan_merge` once. Deletions made
+        while the segments are merged are applied to the new segment.
+
+        Returns:
+            False if no segments need to be merged.
+        """
+        with self._lock:
+            names = plan_merge(
+                [(name, len(self._post_ids[name]), len(self._deleted[name]))
+                 for name in self._meta['segments']
+                 if name not in self._merging], self.merge_factor,
+                self.min_documents)
+            if len(names) == 0:
+                return False
+            self._merging.update(names)
+            deleted = [frozenset(self._deleted[name]) for name in names]
+            new_name = self._new_segment_name()
+
+        try:
+            paths = [f'{self.path}/{name}' for name in names]
+            new_path = f'{self.path}/{new_name}'
+            if self._executor is None:
+                merge_segments(paths, new_path, deleted)
+            else:
+                self._executor.submit(merge_segments, paths, new_path,
+                                      deleted).result()
+            with self._lock:
+                self._commit_merge(names, deleted, new_name)
+        finally:
+            with self._lock:
+                self._merging.difference_update(names)
+        return True
+
+    def _commit_merge(self, names: List[str], deleted: List[Collection[int]],
+                      new_name: str) -> None:
+        """
+        Replace the merged segments with the new one.
+        """
+        post_ids = array('I')
+        new_deleted = set()
+        for name, merged_deleted in zip(names, deleted):
+            now_deleted = self._deleted[name]
+            for doc, post_id in enumerate(self._post_ids[name]):
+                if doc in merged_deleted:
+                    continue
+                if doc in now_deleted:
+                    new_deleted.add(len(post_ids))
+                else:
+                    self._locations[post_id] = (new_name, len(post_ids))
+                post_ids.append(post_id)
+        self._post_ids[new_name] = post_ids
+        self._deleted[new_name] = new_deleted
+
+        segments = self._meta['segments']
+        segments.insert(segments.index(names[0]), new_name)
+        self._commit([new_name] if len(new_deleted) > 0 or
+                     len(post_ids) == 0 else [],
+                     removed=names)
+
+    def update(self, path_src: str,
+               batch_size: int = UPDATE_BATCH) -> Tuple[int, int]:
+        """
+        Apply the changes of the processed posts made since the index was
+        built or last updated from them.
+
+        Changes of a post store are read from its index file, which grows
+        with every change, a record whose post can not be read yet stops
+        the update until the next call. Json files are indexed if they were
+        modified since the last update and deleted if they are gone.
+
+        Args:
+            path_src: Directory of `{post_id}.json` files or a post store.
+            batch_size: The number of changed posts committed at once.
+
+        Returns:
+            The number of indexed posts and the number of deleted posts.
+        """
+        source = self._meta.get('source') or {}
+        if source.get('path') != path_src:
+            source = {}
+        if os.path.exists(f'{path_src}/index.bin'):
+            changes = self._store_changes(path_src, source.get('position', 0))
+        else:
+            changes = self._directory_changes(path_src, source.get('time', 0))
+
+        indexed = 0
+        deleted = 0
+        for posts, post_ids, state in self._batches(changes, batch_size):
+            batch_indexed, batch_deleted = self._apply(
+                posts, post_ids, {'path': path_src, **state})
+            indexed += batch_indexed
+            deleted += batch_deleted
+        return indexed, deleted
+
+    @staticmethod
+    def _batches(changes: Iterable[Tuple[Optional[int], Optional[Dict],
+                                         Dict]],
+                 batch_size: int
+                 ) -> Iterable[Tuple[List[Dict], List[int], Dict]]:
+        """
+        Collect the latest change of every post in batches, a batch comes
+        with the source state after its changes. A change without a post
+        ID only updates the state.
+        """
+        posts = {}
+        post_ids = set()
+        state = None
+        committed = None
+        for post_id, post, state in changes:
+            if post_id is None:
+                continue
+            if post is None:
+                posts.pop(post_id, None)
+                post_ids.add(post_id)
+            else:
+                posts[post_id] = post
+                post_ids.discard(post_id)
+            if len(posts) + len(post_ids) >= batch_size:
+                yield list(posts.values()), list(post_ids), state
+                posts = {}
+                post_ids = set()
+                committed = state
+        if (len(posts) + len(post_ids) > 0 or
+                committed is not None and state != committed):
+            yield list(posts.values()), list(post_ids), state
+
+    def _store_changes(
+            self, path_src: str, position: int
+    ) -> Iterable[Tuple[Optional[int], Optional[Dict], Dict]]:
+        """
+        Iterate over the changed posts of a post store, None for a deleted
+        post.
+        """
+        if self._store is None or self._store.path != path_src:
+            if self._store is not None:
+                self._store.close()
+            self._store = PostStore(path_src)
+        for post_id, next_position in self._store.read_changes(position):
+            post = None
+            if post_id in self._store:
+                try:
+                    post = self._store.get(post_id)
+                except (OSError, ValueError, zlib.error):
+                    # The writer has not flushed the post yet
+                    return
+            yield post_id, post, {'position': next_position}
+
+    def _directory_changes(
+            self, path_src: str, since: int
+    ) -> Iterable[Tuple[Optional[int], Optional[Dict], Dict]]:
+        """
+        Iterate over the json files modified since the time in nanoseconds
+        and the posts without files, None for a deleted post.
+        """
+        start = time.time_ns()
+        present = set()
+        modified = []
+        with os.scandir(path_src) as entries:
+            for entry in entries:
+                post_id = post_file_id(entry.name)
+                if post_id is None:
+                    continue
+                present.add(post_id)
+                mtime = entry.stat().st_mtime_ns
+                if mtime >= since:
+                    modified.append((entry.path, mtime))
+
+        for path, mtime in modified:
+            try:
+                with open(path, encoding='utf-8') as file_:
+                    post = json.load(file_)
+            except FileNotFoundError:
+                continue
+            except ValueError:
+                # The file is being written, it is read again next time
+                start = min(start, mtime)
+                continue
+            yield int(post['id']), post, {'time': start}
+
+        with self._lock:
+            post_ids = [
+                post_id for post_id in self._locations
+                if post_id not in present
+            ]
+        for post_id in post_ids:
+            yield post_id, None, {'time': start}
+        yield None, None, {'time': start}
+
+    def wait(self) -> None:
+        """
+        Wait for the background merges to finish.
+        """
+        while True:
+            with self._lock:
+                thread = self._merge_thread
+            if thread is None:
+                return
+            thread.join()
+
+    def close(self) -> None:
+        """
+        Wait for the background merges and release the updater resources.
+        """
+        self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._store is not None:
+            self._store.close()
+            self._store = None
@@ -0,0 +1,50 @@
+"""
+Incremental extraction of the example pages
+"""
+import os
+import tempfile
+import unittest
+
+from task_1.extracter import extract_posts_data
+from task_1.post_store import PostStore
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), '..', 'examples',
+                             'unprocessed_posts')
+POST_IDS = [72, 299, 439, 461]
+
+
+class IncrementalExtractionTest(unittest.TestCase):
+    """
+    A processed post deleted after extraction is extracted again although
+    its source file did not change.
+    """
+
+    def setUp(self) -> None:
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.path_dest = f'{self._temp_dir.name}/processed_posts'
+
+    def tearDown(self) -> None:
+        self._temp_dir.cleanup()
+
+    def test_deleted_json_file(self) -> None:
+        extract_posts_data(EXAMPLES_PATH, self.path_dest, incremental=True)
+        os.remove(f'{self.path_dest}/{POST_IDS[0]}.json')
+
+        extract_posts_data(EXAMPLES_PATH, self.path_dest, incremental=True)
+        self.assertTrue(
+            os.path.exists(f'{self.path_dest}/{POST_IDS[0]}.json'))
+
+    def test_deleted_stored_post(self) -> None:
+        extract_posts_data(EXAMPLES_PATH, self.path_dest, incremental=True,
+                           output_format='store')
+        with PostStore(self.path_dest) as store:
+            store.delete(POST_IDS[0])
+
+        extract_posts_data(EXAMPLES_PATH, self.path_dest, incremental=True,
+                           output_format='store')
+        with PostStore(self.path_dest) as store:
+            self.assertEqual(store.ids(), POST_IDS)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""
+Indexing of the processed posts written by the incremental extraction
+"""
+import os
+import tempfile
+import unittest
+
+from task_1.extracter import MANIFEST_NAME, extract_posts_data
+from task_2.index import InvertedIndex
+from task_2.indexer import build_index, list_posts
+from task_2.updater import IndexUpdater
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(__file__), '..', 'examples',
+                             'unprocessed_posts')
+POST_IDS = [72, 299, 439, 461]
+
+
+class IncrementalDirectoryTest(unittest.TestCase):
+    """
+    The manifest of the incremental extraction is kept next to the posts
+    and must not be read as a post.
+    """
+
+    def setUp(self) -> None:
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.posts_path = f'{self._temp_dir.name}/processed_posts'
+        self.index_path = f'{self._temp_dir.name}/index'
+        extract_posts_data(EXAMPLES_PATH, self.posts_path, incremental=True)
+
+    def tearDown(self) -> None:
+        self._temp_dir.cleanup()
+
+    def test_manifest_is_not_a_post(self) -> None:
+        self.assertTrue(
+            os.path.exists(f'{self.posts_path}/{MANIFEST_NAME}'))
+        self.assertEqual(sorted(list_posts(self.posts_path)),
+                         sorted(f'{post_id}.json' for post_id in POST_IDS))
+
+    def test_build_and_update(self) -> None:
+        self.assertEqual(build_index(self.posts_path, self.index_path),
+                         len(POST_IDS))
+
+        os.remove(f'{self.posts_path}/{POST_IDS[0]}.json')
+        with IndexUpdater(self.index_path, background=False) as updater:
+            self.assertEqual(updater.update(self.posts_path), (0, 1))
+
+        with InvertedIndex(self.index_path) as index:
+            self.assertEqual(len(index), len(POST_IDS) - 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
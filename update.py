@@ -0,0 +1,81 @@
+"""
+Script to keep the inverted index up to date with processed posts
+"""
+import time
+import argparse
+
+from task_2.updater import MERGE_FACTOR, MIN_MERGE_DOCUMENTS, IndexUpdater
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--src',
+        type=str,
+        default='data/processed_posts',
+        help=('directory of processed posts json files or a post store, '
+              'default data/processed_posts'),
+    )
+    parser.add_argument(
+        '--index',
+        type=str,
+        default='data/index',
+        help='directory of the index built by index.py, default data/index',
+    )
+    parser.add_argument(
+        '-i',
+        '--interval',
+        type=float,
+        default=5,
+        help=('seconds between checks of the processed posts, updates once '
+              'if 0, default 5'),
+    )
+    parser.add_argument(
+        '--merge_factor',
+        type=int,
+        default=MERGE_FACTOR,
+        help=('the number of segments of about the same size that are '
+              f'merged, default {MERGE_FACTOR}'),
+    )
+    parser.add_argument(
+        '--min_documents',
+        type=int,
+        default=MIN_MERGE_DOCUMENTS,
+        help=('segments with fewer posts are merged as if they had this '
+              f'many, default {MIN_MERGE_DOCUMENTS}'),
+    )
+    parser.add_argument(
+        '-m',
+        '--memory',
+        type=int,
+        default=64,
+        help='memory of in-memory postings in megabytes, default 64',
+    )
+
+    args = parser.parse_args()
+
+    if args.interval < 0:
+        raise ValueError('Interval must not be negative')
+    if args.merge_factor < 2:
+        raise ValueError('Merge factor must be at least 2')
+    if min(args.min_documents, args.memory) < 1:
+        raise ValueError('Minimum documents and memory must be positive')
+
+    with IndexUpdater(args.index, args.merge_factor, args.min_documents,
+                      args.memory) as updater:
+        print(f'Updating {len(updater)} posts in '
+              f'{len(updater.segments)} segments.')
+        try:
+            while True:
+                start_time = time.perf_counter()
+                indexed, deleted = updater.update(args.src)
+                elapsed = time.perf_counter() - start_time
+                if indexed > 0 or deleted > 0:
+                    print(f'{indexed} posts indexed and {deleted} deleted in '
+                          f'{elapsed:.2f} s, {len(updater.segments)} '
+                          'segments.')
+                if args.interval == 0:
+                    break
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            print('Stopping, waiting for merges.')
+    print('Done.')
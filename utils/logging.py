@@ -1,8 +1,231 @@
 """
 Helper functions for logging
 """
+import copy
 import logging
 import os
+import time
+from queue import Empty, Queue
+from threading import Event, Thread
+from logging.handlers import BufferingHandler
+from multiprocessing.util import Finalize
+from typing import List
+
+_FORMATTER = logging.Formatter(
+    fmt='%(asctime)s | %(levelname)s | %(message)s',
+    datefmt='%m-%d-%Y %H:%M:%S')
+
+# Logging of the running process, see `configure`
+_queue = None
+_sample = 1
+_handler = None
+_finalizer = None
+
+
+class SampleFilter(logging.Filter):
+    """
+    Keep one of `rate` records below WARNING level, warnings and errors
+    are always kept.
+
+    Attributes:
+        rate: Sampling rate, all records are kept if 1.
+    """
+
+    def __init__(self, rate: int = 1) -> None:
+        """
+        Init SampleFilter
+        """
+        super().__init__()
+        self.rate = rate
+        self._count = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate <= 1 or record.levelno >= logging.WARNING:
+            return True
+        self._count += 1
+        return self._count % self.rate == 1
+
+
+class BatchQueueHandler(BufferingHandler):
+    """
+    Send records to the log listener in batches.
+
+    A batch is sent when it is full, when a warning or an error is logged
+    and when `interval` passed since the previous batch, so logging does
+    not wait for the disk and costs one queue put per batch.
+
+    Attributes:
+        queue: Queue of `LogListener`.
+        filename: Log file name of the records.
+        interval: The maximum time in seconds a record waits in the batch.
+        flush_level: Records of this level or above are sent immediately.
+    """
+
+    def __init__(self,
+                 queue: Queue,
+                 filename: str,
+                 capacity: int = 256,
+                 interval: float = 1.0,
+                 flush_level: int = logging.WARNING) -> None:
+        """
+        Init BatchQueueHandler
+        """
+        super().__init__(capacity)
+        self.queue = queue
+        self.filename = filename
+        self.interval = interval
+        self.flush_level = flush_level
+        self._last_flush = time.monotonic()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Return a picklable copy of the record with the formatted message.
+
+        Args:
+            record: Logged record.
+        """
+        # Message with the traceback, the listener adds time and level
+        message = self.format(record)
+        record = copy.copy(record)
+        record.message = message
+        record.msg = message
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.logfile = self.filename
+        return record
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.buffer.append(self.prepare(record))
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+            return
+        if self.shouldFlush(record):
+            self.flush()
+
+    def shouldFlush(self, record: logging.LogRecord) -> bool:
+        return (len(self.buffer) >= self.capacity
+                or record.levelno >= self.flush_level
+                or time.monotonic() - self._last_flush >= self.interval)
+
+    def flush(self) -> None:
+        self.acquire()
+        try:
+            self._last_flush = time.monotonic()
+            if len(self.buffer) > 0:
+                batch, self.buffer = self.buffer, []
+                self.queue.put(batch)
+        finally:
+            self.release()
+
+
+class LogListener(Thread):
+    """
+    Write records sent by all processes to their log files.
+
+    Records go to `{path}/{filename}.log` of the logger they were logged
+    with, every file is written and flushed once per batch.
+
+    Attributes:
+        queue: Queue where processes put batches of records.
+        path: Directory of the log files.
+        encoding: The encoding used for the log files.
+    """
+
+    def __init__(self,
+                 queue: Queue,
+                 path: str = 'log',
+                 encoding: str = 'utf-8') -> None:
+        """
+        Init LogListener
+        """
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.path = path
+        self.encoding = encoding
+        self._files = {}
+        self._stop_event = Event()
+
+    def write(self, records: List[logging.LogRecord]) -> None:
+        """
+        Write a batch of records.
+
+        Args:
+            records: Records prepared by `BatchQueueHandler`.
+        """
+        written = {}
+        for record in records:
+            file_ = self._files.get(record.logfile)
+            if file_ is None:
+                if not os.path.exists(self.path):
+                    os.makedirs(self.path)
+                file_ = self._files[record.logfile] = open(
+                    f'{self.path}/{record.logfile}.log',
+                    'w+',
+                    encoding=self.encoding)
+            file_.write(_FORMATTER.format(record) + '\n')
+            written[record.logfile] = file_
+        for file_ in written.values():
+            file_.flush()
+
+    def _drain(self, timeout: float = None) -> None:
+        while True:
+            try:
+                if timeout is None:
+                    records = self.queue.get_nowait()
+                else:
+                    records = self.queue.get(timeout=timeout)
+                    timeout = None
+            except Empty:
+                return
+            self.write(records)
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            self._drain(timeout=0.5)
+
+    def stop(self) -> None:
+        """
+        Write the remaining records, close the files and stop listening.
+        """
+        self._stop_event.set()
+        self.join()
+        self._drain()
+        for file_ in self._files.values():
+            file_.close()
+        self._files = {}
+
+
+def _remove_handler() -> None:
+    global _handler, _finalizer
+    if _finalizer is not None:
+        _finalizer.cancel()
+        _finalizer = None
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler.close()
+        _handler = None
+
+
+def configure(queue: Queue = None, sample: int = 1) -> None:
+    """
+    Choose where loggers of the running process write to, must be called
+    before `get_logger`.
+
+    The handler inherited from the parent process is removed.
+
+    Args:
+        queue: Queue of `LogListener`, records are sent to the listener in
+        batches instead of being written to the log file directly. Log
+        files are written directly if None.
+        sample: Keep one of `sample` info and debug records, warnings and
+        errors are always kept.
+    """
+    global _queue, _sample
+    _remove_handler()
+    _queue = queue
+    _sample = sample
 
 
 def get_logger(filename: str,
@@ -12,31 +235,69 @@ def get_logger(filename: str,
     """
     Configuring and return logger with file as sream for logging.
 
+    A process logs to one file at a time, the handler added by the
+    previous call is replaced, so records are never written twice.
+
     Args:
         filename: Filename of created .log file.
-        path: Directory where the log file will be created.
+        path: Directory where the log file will be created, the directory
+        of the listener is used if records are sent to `LogListener`.
         encoding: The encoding used for the log file.
         debug: If True setting log level to DEBUG, INFO otherwise.
 
     Returns:
         A logger that uses a file as a stream for logging.
     """
-    if not os.path.exists(path):
-        os.makedirs(path)
-
-    formatter = logging.Formatter(
-        fmt='%(asctime)s | %(levelname)s | %(message)s',
-        datefmt='%m-%d-%Y %H:%M:%S')
+    global _handler, _finalizer
+    _remove_handler()
     logging_level = logging.DEBUG if debug else logging.INFO
 
-    file_handler = logging.FileHandler(filename=f'{path}/{filename}.log',
-                                       mode='w+',
-                                       encoding=encoding)
-    file_handler.setLevel(logging_level)
-    file_handler.setFormatter(formatter)
+    if _queue is None:
+        if not os.path.exists(path):
+            os.makedirs(path)
+        handler = logging.FileHandler(filename=f'{path}/{filename}.log',
+                                      mode='w+',
+                                      encoding=encoding)
+        handler.setFormatter(_FORMATTER)
+    else:
+        handler = BatchQueueHandler(_queue, filename)
+        # Batched records are sent when the process exits
+        _finalizer = Finalize(handler, handler.flush, exitpriority=100)
+    handler.setLevel(logging_level)
+    if _sample > 1:
+        handler.addFilter(SampleFilter(_sample))
+    _handler = handler
 
     logger = logging.getLogger()
     logger.setLevel(logging_level)
-    logger.addHandler(file_handler)
+    logger.addHandler(handler)
 
     return logger
+
+
+def flush() -> None:
+    """
+    Send the batched records of the running process to the listener.
+    """
+    if _handler is not None:
+        _handler.flush()
+
+
+def start_listener(queue: Queue,
+                   path: str = 'log',
+                   encoding: str = 'utf-8') -> LogListener:
+    """
+    Start writing records that processes configured with the queue send.
+
+    Args:
+        queue: Queue shared by processes, e.g. `multiprocessing.Manager`
+        queue.
+        path: Directory of the log files.
+        encoding: The encoding used for the log files.
+
+    Returns:
+        Started listener.
+    """
+    listener = LogListener(queue, path, encoding)
+    listener.start()
+    return listener
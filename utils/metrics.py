@@ -0,0 +1,395 @@
+"""
+Counters and histograms aggregated across processes
+"""
+import os
+import time
+import bisect
+from contextlib import contextmanager, nullcontext
+from queue import Empty, Queue
+from threading import Event, Thread
+from multiprocessing.util import Finalize
+from typing import ContextManager, Dict, Iterator, Sequence, Tuple
+
+# Upper bounds of histogram buckets in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0)
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                    0.025, 0.05, 0.1, 0.25, 1.0)
+
+_NULL_TIMER = nullcontext()
+
+
+def _labels_key(labels: Dict[str, str]) -> Tuple[Tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+class Metrics():
+    """
+    Metrics of one process sent to the collector as deltas.
+
+    Nothing is recorded until a queue is configured, so disabled metrics
+    cost one attribute check.
+
+    Attributes:
+        queue: Queue of the collector where deltas are put.
+        interval: The minimum time in seconds between deltas.
+    """
+
+    def __init__(self) -> None:
+        """
+        Init Metrics
+        """
+        self.queue = None
+        self.interval = 5.0
+        self._counters = {}
+        self._histograms = {}
+        self._last_flush = 0.0
+        self._finalizer = None
+
+    @property
+    def enabled(self) -> bool:
+        """
+        True if metrics are recorded.
+        """
+        return self.queue is not None
+
+    def configure(self, queue: Queue = None, interval: float = 5.0) -> None:
+        """
+        Start sending metrics to the collector queue, metrics are disabled
+        if the queue is None.
+
+        Metrics recorded before, e.g. inherited from the parent process,
+        are dropped. Unsent metrics are flushed when the process exits.
+
+        Args:
+            queue: Queue of `MetricsCollector`.
+            interval: The minimum time in seconds between deltas.
+        """
+        self.queue = queue
+        self.interval = interval
+        self._counters = {}
+        self._histograms = {}
+        self._last_flush = time.monotonic()
+        if self._finalizer is not None:
+            self._finalizer.cancel()
+            self._finalizer = None
+        if queue is not None:
+            self._finalizer = Finalize(self, self.flush, kwargs={
+                'force': True,
+            }, exitpriority=100)
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """
+        Increase the counter.
+
+        Args:
+            name: Name of the counter.
+            value: Increment.
+            labels: Labels of the counter.
+        """
+        if self.queue is None:
+            return
+        key = (name, _labels_key(labels))
+        self._counters[key] = self._counters.get(key, 0) + value
+        self.flush()
+
+    def observe(self,
+                name: str,
+                value: float,
+                buckets: Sequence[float] = DURATION_BUCKETS,
+                **labels) -> None:
+        """
+        Add the value to the histogram.
+
+        Args:
+            name: Name of the histogram.
+            value: Observed value.
+            buckets: Upper bounds of the histogram buckets, must be the same
+            for all observations of the histogram.
+            labels: Labels of the histogram.
+        """
+        if self.queue is None:
+            return
+        key = (name, _labels_key(labels))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms[key] = {
+                'buckets': tuple(buckets),
+                'counts': [0] * (len(buckets) + 1),
+                'sum': 0.0,
+            }
+        histogram['counts'][bisect.bisect_left(histogram['buckets'],
+                                               value)] += 1
+        histogram['sum'] += value
+        self.flush()
+
+    def timer(self, name: str, **labels) -> ContextManager:
+        """
+        Return a context manager adding its run time to the histogram.
+
+        Args:
+            name: Name of the histogram.
+            labels: Labels of the histogram.
+        """
+        if self.queue is None:
+            return _NULL_TIMER
+        return self._timer(name, labels)
+
+    @contextmanager
+    def _timer(self, name: str, labels: Dict) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time, **labels)
+
+    def flush(self, force: bool = False) -> None:
+        """
+        Send the recorded metrics to the collector if the interval passed.
+
+        Args:
+            force: If True send the metrics regardless of the interval.
+        """
+        if self.queue is None:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_flush < self.interval:
+            return
+        self._last_flush = now
+        if len(self._counters) == 0 and len(self._histograms) == 0:
+            return
+        delta = {'counters': self._counters, 'histograms': self._histograms}
+        self._counters = {}
+        self._histograms = {}
+        self.queue.put(delta)
+
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...],
+                   extra: str = None) -> str:
+    labels = [
+        '{}="{}"'.format(name,
+                         value.replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels
+    ]
+    if extra is not None:
+        labels.append(extra)
+    if len(labels) == 0:
+        return ''
+    return '{' + ','.join(labels) + '}'
+
+
+def _histogram_percentile(histogram: Dict, percent: float) -> float:
+    """
+    Return the upper bound of the bucket with the percentile.
+    """
+    count = sum(histogram['counts'])
+    rank = count * percent / 100
+    cumulative = 0
+    for bound, bucket_count in zip(histogram['buckets'],
+                                   histogram['counts']):
+        cumulative += bucket_count
+        if cumulative >= rank:
+            return bound
+    return float('inf')
+
+
+class MetricsCollector(Thread):
+    """
+    Merge metrics of all processes and write them periodically in the
+    Prometheus text format.
+
+    Attributes:
+        queue: Queue where processes put their metrics.
+        path: Metrics file, rewritten atomically.
+        interval: Time in seconds between writes.
+    """
+
+    def __init__(self, queue: Queue, path: str, interval: float = 5.0):
+        """
+        Init MetricsCollector
+        """
+        super().__init__(daemon=True)
+        self.queue = queue
+        self.path = path
+        self.interval = interval
+        self.counters = {}
+        self.histograms = {}
+        self._stop_event = Event()
+        self._start_time = time.monotonic()
+
+    def merge(self, delta: Dict) -> None:
+        """
+        Add metrics sent by a process.
+
+        Args:
+            delta: Metrics recorded since the previous delta.
+        """
+        for key, value in delta['counters'].items():
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, histogram in delta['histograms'].items():
+            total = self.histograms.get(key)
+            if total is None:
+                self.histograms[key] = histogram
+                continue
+            total['counts'] = [
+                count + other
+                for count, other in zip(total['counts'], histogram['counts'])
+            ]
+            total['sum'] += histogram['sum']
+
+    def _drain(self, timeout: float = None) -> None:
+        while True:
+            try:
+                if timeout is None:
+                    delta = self.queue.get_nowait()
+                else:
+                    delta = self.queue.get(timeout=timeout)
+                    timeout = None
+            except Empty:
+                return
+            self.merge(delta)
+
+    def run(self) -> None:
+        last_write = time.monotonic()
+        while not self._stop_event.is_set():
+            self._drain(timeout=0.5)
+            if time.monotonic() - last_write >= self.interval:
+                self.write()
+                last_write = time.monotonic()
+
+    def stop(self) -> None:
+        """
+        Merge the remaining metrics, write the file and stop collecting.
+        """
+        self._stop_event.set()
+        self.join()
+        self._drain()
+        self.write()
+
+    def to_prometheus(self) -> str:
+        """
+        Return all metrics in the Prometheus text format.
+        """
+        lines = []
+        names = sorted({name for name, _ in self.counters})
+        for name in names:
+            lines.append(f'# TYPE {name} counter')
+            for (metric, labels), value in sorted(self.counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{_format_labels(labels)} {value}')
+
+        names = sorted({name for name, _ in self.histograms})
+        for name in names:
+            lines.append(f'# TYPE {name} histogram')
+            for (metric, labels), histogram in sorted(
+                    self.histograms.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                bounds = [*histogram['buckets'], '+Inf']
+                for bound, count in zip(bounds, histogram['counts']):
+                    cumulative += count
+                    bucket_labels = _format_labels(labels, f'le="{bound}"')
+                    lines.append(f'{name}_bucket{bucket_labels} {cumulative}')
+                lines.append(f'{name}_sum{_format_labels(labels)} '
+                             f'{histogram["sum"]}')
+                lines.append(f'{name}_count{_format_labels(labels)} '
+                             f'{cumulative}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self) -> None:
+        """
+        Write the metrics file.
+        """
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as file_:
+            file_.write(self.to_prometheus())
+        os.replace(temp_path, self.path)
+
+    def summary(self) -> str:
+        """
+        Return a human readable summary of the metrics.
+        """
+        elapsed = time.monotonic() - self._start_time
+        lines = [f'Metrics over {elapsed:.1f} s:']
+        totals = {}
+        for (name, labels), value in self.counters.items():
+            totals.setdefault(name, []).append((value, labels))
+        for name, values in sorted(totals.items()):
+            total = sum(value for value, _ in values)
+            lines.append(f'  {name}: {total:g} ({total / elapsed:.1f}/s)')
+            if len(values) > 1:
+                for value, labels in sorted(values, reverse=True)[:5]:
+                    lines.append(f'    {_format_labels(labels)}: {value:g}')
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            count = sum(histogram['counts'])
+            if count == 0:
+                continue
+            lines.append(
+                f'  {name}{_format_labels(labels)}: count {count}, '
+                f'mean {histogram["sum"] / count:.6f} s, '
+                f'p50 <= {_histogram_percentile(histogram, 50):g} s, '
+                f'p99 <= {_histogram_percentile(histogram, 99):g} s, '
+                f'total {histogram["sum"]:.3f} s')
+        return '\n'.join(lines)
+
+
+# Metrics of the running process
+_metrics = Metrics()
+configure = _metrics.configure
+inc = _metrics.inc
+observe = _metrics.observe
+timer = _metrics.timer
+flush = _metrics.flush
+
+
+def get_queue() -> Queue:
+    """
+    Return the collector queue of the running process, None if metrics are
+    disabled.
+    """
+    return _metrics.queue
+
+
+def start_collector(queue: Queue,
+                    path: str,
+                    interval: float = 5.0) -> MetricsCollector:
+    """
+    Start collecting metrics of all processes and record metrics of the
+    running process.
+
+    Args:
+        queue: Queue shared by processes, e.g. `multiprocessing.Manager`
+        queue.
+        path: Metrics file in the Prometheus text format.
+        interval: Time in seconds between metrics file writes.
+
+    Returns:
+        Started collector.
+    """
+    collector = MetricsCollector(queue, path, interval)
+    collector.start()
+    configure(queue, interval)
+    return collector
+
+
+def stop_collector(collector: MetricsCollector) -> str:
+    """
+    Send metrics of the running process, stop recording them and write the
+    final metrics file.
+
+    Args:
+        collector: Collector returned by `start_collector`.
+
+    Returns:
+        Summary of the metrics.
+    """
+    flush(force=True)
+    configure(None)
+    collector.stop()
+    return collector.summary()
+
@@ -0,0 +1,188 @@
+"""
+Single pass text normalization and tokenization
+"""
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, FrozenSet, Iterable, List
+
+try:
+    import snowballstemmer
+except ImportError:  # Stemming is optional
+    snowballstemmer = None
+
+# URLs are matched before words, so their parts do not become words.
+# Numbers are matched without a group and disappear from `findall`.
+_TOKEN_PATTERN = re.compile(
+    r'(?:https?|ftp)://[\w-]+(?:\.[\w-]+)+'
+    r'(?:[\w.,@?^=%&:/~+#-]*[\w@?^=%&/~+#-])?'
+    r'|(?<![\w-])[\d-]+(?![\w-])'
+    r'|([\w-]+)')
+
+STOPWORDS_RU = frozenset((
+    'а', 'без', 'более', 'бы', 'был', 'была', 'были', 'было', 'быть', 'в',
+    'вам', 'вас', 'весь', 'во', 'вот', 'все', 'всего', 'всех', 'вы', 'где',
+    'да', 'даже', 'для', 'до', 'его', 'ее', 'если', 'есть', 'еще', 'же',
+    'за', 'здесь', 'и', 'из', 'или', 'им', 'их', 'к', 'как', 'когда',
+    'кто', 'ли', 'либо', 'мне', 'может', 'мы', 'на', 'над', 'надо', 'наш',
+    'не', 'него', 'нее', 'нет', 'ни', 'них', 'но', 'ну', 'о', 'об',
+    'однако', 'он', 'она', 'они', 'оно', 'от', 'очень', 'по', 'под',
+    'после', 'при', 'про', 'с', 'со', 'так', 'также', 'такой', 'там',
+    'те', 'тем', 'то', 'того', 'тоже', 'той', 'только', 'том', 'ты', 'у',
+    'уже', 'хотя', 'чего', 'чей', 'чем', 'что', 'чтобы', 'чье', 'чья',
+    'эта', 'эти', 'это', 'этого', 'этой', 'этом', 'этот', 'я'))
+
+STOPWORDS_EN = frozenset((
+    'a', 'about', 'above', 'after', 'again', 'all', 'am', 'an', 'and',
+    'any', 'are', 'as', 'at', 'be', 'because', 'been', 'before', 'being',
+    'below', 'between', 'both', 'but', 'by', 'can', 'did', 'do', 'does',
+    'doing', 'down', 'during', 'each', 'few', 'for', 'from', 'further',
+    'had', 'has', 'have', 'having', 'he', 'her', 'here', 'hers', 'him',
+    'his', 'how', 'i', 'if', 'in', 'into', 'is', 'it', 'its', 'just',
+    'me', 'more', 'most', 'my', 'no', 'nor', 'not', 'now', 'of', 'off',
+    'on', 'once', 'only', 'or', 'other', 'our', 'out', 'over', 'own',
+    'same', 'she', 'should', 'so', 'some', 'such', 'than', 'that', 'the',
+    'their', 'them', 'then', 'there', 'these', 'they', 'this', 'those',
+    'through', 'to', 'too', 'under', 'until', 'up', 'very', 'was', 'we',
+    'were', 'what', 'when', 'where', 'which', 'while', 'who', 'whom',
+    'why', 'will', 'with', 'you', 'your'))
+
+STOPWORDS = STOPWORDS_RU | STOPWORDS_EN
+
+
+def _words(text: str) -> List[str]:
+    # Hyphens are removed inside words, words of hyphens disappear
+    return ' '.join(_TOKEN_PATTERN.findall(text)).replace('-', '').split()
+
+
+def clean_text(text: str) -> str:
+    """
+    Removes punctuation marks, special characters, numbers, urls and extra
+    spaces in one pass over the text.
+
+    Args:
+        text: Text to clean up.
+
+    Returns:
+        Clean text.
+    """
+    return ' '.join(_words(text))
+
+
+class Normalizer():
+    """
+    Split texts into lowercase tokens.
+
+    Tokens are the words of `clean_text` with `ё` replaced by `е`.
+    Russian words are stemmed by the Russian snowball stemmer and the
+    other words by the English one. Stems are cached, so every distinct
+    word is stemmed once.
+
+    Note:
+        Stemming needs the `snowballstemmer` package.
+
+    Attributes:
+        stopwords: Tokens to be removed, checked before stemming.
+        stem: If True tokens are stemmed.
+    """
+
+    def __init__(self,
+                 stopwords: Iterable[str] = None,
+                 stem: bool = False) -> None:
+        """
+        Init Normalizer
+        """
+        if stem and snowballstemmer is None:
+            raise ImportError('Stemming requires the snowballstemmer package')
+        self.stopwords: FrozenSet[str] = frozenset(stopwords or ())
+        self.stem = stem
+        self._stems: Dict[str, str] = {}
+        self._russian = None
+        self._english = None
+        if stem:
+            self._russian = snowballstemmer.stemmer('russian')
+            self._english = snowballstemmer.stemmer('english')
+
+    def __getstate__(self) -> Dict:
+        # Stemmers are created again by the process the normalizer is sent to
+        return {'stopwords': self.stopwords, 'stem': self.stem}
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__init__(**state)
+
+    def stem_word(self, word: str) -> str:
+        """
+        Return the cached stem of the lowercase word.
+
+        Args:
+            word: Lowercase word.
+        """
+        stem = self._stems.get(word)
+        if stem is None:
+            last = word[-1]
+            if 'а' <= last <= 'я':
+                stem = self._russian.stemWord(word)
+            else:
+                stem = self._english.stemWord(word)
+            self._stems[word] = stem
+        return stem
+
+    def tokenize(self, text: str) -> List[str]:
+        """
+        Split the text into normalized tokens.
+
+        Args:
+            text: Raw text.
+
+        Returns:
+            Tokens in the order of the text.
+        """
+        tokens = _words(text.lower().replace('ё', 'е'))
+        if self.stopwords:
+            stopwords = self.stopwords
+            tokens = [token for token in tokens if token not in stopwords]
+        if self.stem:
+            stems = self._stems
+            tokens = [
+                stems.get(token) or self.stem_word(token) for token in tokens
+            ]
+        return tokens
+
+    def tokenize_batch(self,
+                       texts: Iterable[str],
+                       max_workers: int = 1,
+                       chunksize: int = 64) -> List[List[str]]:
+        """
+        Tokenize many texts, in parallel if `max_workers` is above 1.
+
+        Every process gets a copy of the normalizer with its own stem
+        cache and tokenizes `chunksize` texts at a time.
+
+        Args:
+            texts: Raw texts.
+            max_workers: The number of processes.
+            chunksize: The number of texts sent to a process at once.
+
+        Returns:
+            Tokens of every text in the order of the texts.
+        """
+        if max_workers <= 1:
+            return [self.tokenize(text) for text in texts]
+        with ProcessPoolExecutor(
+                max_workers=max_workers,
+                initializer=_init_worker,
+                initargs=(self, ),
+        ) as executor:
+            return list(executor.map(_tokenize, texts, chunksize=chunksize))
+
+
+# Normalizer of a process started by `Normalizer.tokenize_batch`
+_worker_normalizer = None
+
+
+def _init_worker(normalizer: Normalizer) -> None:
+    global _worker_normalizer
+    _worker_normalizer = normalizer
+
+
+def _tokenize(text: str) -> List[str]:
+    return _worker_normalizer.tokenize(text)
@@ -28,3 +28,26 @@ def get_subintervals(left: int, right: int,
         right_bounds.append(left + (i + 1) * k + min(i + 1, m))
 
     return left_bounds, right_bounds
+
+
+def get_chunks(left: int, right: int,
+               chunk_size: int) -> Tuple[List[int], List[int]]:
+    """
+    Split the original interval into chunks of fixed size.
+
+    Args:
+        left: Left bound of the original interval.
+        right: Right bound of the original interval.
+        chunk_size: Size of a chunk, the last chunk may be smaller.
+
+    Returns:
+        Two lists:
+        - List of left bounds of chunks;
+        - List of right bounds of chunks;
+    """
+    left_bounds = list(range(left, right, chunk_size))
+    right_bounds = [
+        min(left_bound + chunk_size, right) for left_bound in left_bounds
+    ]
+
+    return left_bounds, right_bounds